@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+
+import os
+import stat
+import sqlite3
+import tarfile
+import logging
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+archive_formats = ('tar', 'tar.zst')
+index_suffix = '.index.sqlite'
+index_batch = 500
+compression_level = 3
+# A zstd frame is closed between two files once it holds this much data, an extract only decompresses the frames
+# holding the files it wants
+frame_size = 4 * 1024 * 1024
+read_size = 1024 * 1024
+# Space taken by the headers of a file, its header block and an extended header for long names, plus the padding of
+# its data to a whole block
+member_overhead = 4 * tarfile.BLOCKSIZE
+
+
+def archive_space(filecount, filesize):
+    """Return the space an uncompressed archive of files takes at most.
+    The files are stored at their full size, sparse files included, so the size of the files is used rather than
+    the space allocated to them.
+    Input:
+        filecount   : integer - the number of files.
+        filesize    : integer - the size of the files in bytes.
+    Output:
+        returns     : integer - bytes"""
+    return filesize + filecount * member_overhead
+
+
+class ArchiveError(Exception):
+    """Raised when an archive can not be written or read."""
+    pass
+
+
+def archive_path(name):
+    """Return the path of a file in an archive, always separated by /.
+    Input:
+        name    : string - the path relative to the destination.
+    Output:
+        returns : string"""
+    return name.replace(os.sep, '/') if os.sep != '/' else name
+
+
+class ArchiveIndex():
+    """Index of the files of an archive, kept next to its volumes.
+    For every file the volume, the zstd frame and the offset of its data in the frame are stored so that an extract
+    goes straight to the files it wants. Writes are buffered and committed in batches, as in the manifest."""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending = []
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS volumes (
+                                       volume INTEGER PRIMARY KEY,
+                                       name TEXT NOT NULL,
+                                       compressed INTEGER NOT NULL)""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS files (
+                                       id INTEGER PRIMARY KEY,
+                                       path TEXT NOT NULL,
+                                       volume INTEGER NOT NULL,
+                                       frame_offset INTEGER NOT NULL,
+                                       data_offset INTEGER NOT NULL,
+                                       size INTEGER NOT NULL,
+                                       mtime REAL NOT NULL,
+                                       mode INTEGER NOT NULL)""")
+        self.connection.commit()
+
+    def add_volume(self, volume, name, compressed):
+        """Record a new volume.
+        Input:
+            volume      : integer - number of the volume.
+            name        : string - file name of the volume, next to the index.
+            compressed  : bool - the volume is compressed with zstd.
+        Output:
+            None"""
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO volumes (volume, name, compressed) VALUES (?, ?, ?)",
+                                    (volume, name, int(compressed)))
+
+    def volumes(self):
+        """Return the volumes of the archive.
+        Input:
+            None
+        Output:
+            returns : dict - volume number to (file name, compressed)"""
+        with self.lock:
+            rows = self.connection.execute("SELECT volume, name, compressed FROM volumes").fetchall()
+        return dict((volume, (name, bool(compressed))) for volume, name, compressed in rows)
+
+    def record(self, path, volume, frame_offset, data_offset, size, mtime, mode):
+        """Record a file added to a volume, the entry is written with the next batch.
+        Input:
+            path        : string - path of the file in the archive.
+            volume      : integer - number of the volume.
+            frame_offset: integer - offset in the volume of the zstd frame holding the file, 0 if not compressed.
+            data_offset : integer - offset of the data of the file from the start of the frame, once decompressed.
+            size        : integer - size of the file.
+            mtime       : float - modified time of the file.
+            mode        : integer - permission bits of the file.
+        Output:
+            None"""
+        with self.lock:
+            self.pending.append((path, volume, frame_offset, data_offset, size, mtime, mode))
+            if len(self.pending) >= index_batch:
+                self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.connection.executemany("INSERT INTO files (path, volume, frame_offset, data_offset, size, mtime, "
+                                        "mode) VALUES (?, ?, ?, ?, ?, ?, ?)", self.pending)
+            self.pending = []
+        self.connection.commit()
+
+    def files(self, patterns=None):
+        """Generator yielding the files of the archive in the order they are stored.
+        Input:
+            patterns    : list - glob patterns matched against the paths in the archive, a pattern also selects the
+                          files below a matching directory. Every file if omitted.
+        Output:
+            yields      : tuple - (path, volume, frame_offset, data_offset, size, mtime, mode)"""
+        with self.lock:
+            self._flush()
+        query = "SELECT path, volume, frame_offset, data_offset, size, mtime, mode FROM files"
+        args = []
+        if patterns:
+            query += " WHERE " + " OR ".join(["path GLOB ? OR path GLOB ?"] * len(patterns))
+            for pattern in patterns:
+                pattern = archive_path(pattern).strip('/')
+                args.extend([pattern, pattern + '/*'])
+        reader = sqlite3.connect(self.path)
+        try:
+            for row in reader.execute(query + " ORDER BY volume, id", args):
+                yield row
+        finally:
+            reader.close()
+
+    def close(self):
+        """Flush the buffered entries and close the database.
+        Input:
+            None
+        Output:
+            None"""
+        with self.lock:
+            self._flush()
+            self.connection.close()
+
+
+class ArchiveVolume():
+    """A volume being written, a tar file optionally compressed with zstd.
+    The instance is the file object tarfile writes to, so that the offsets of the data can be recorded as it goes."""
+    def __init__(self, path, compressed):
+        self.path = path
+        self.raw = open(path, 'wb')
+        self.writer = None
+        if compressed:
+            self.writer = zstandard.ZstdCompressor(level=compression_level).stream_writer(self.raw, closefd=False)
+        # Bytes written before compression, and where the current frame starts in the volume and in that count
+        self.position = 0
+        self.frame_offset = 0
+        self.frame_start = 0
+        self.tar = tarfile.open(fileobj=self, mode='w', format=tarfile.PAX_FORMAT)
+
+    def write(self, data):
+        if self.writer is not None:
+            self.writer.write(data)
+        else:
+            self.raw.write(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def size(self):
+        """Return the bytes written to the volume so far.
+        Input:
+            None
+        Output:
+            returns : int"""
+        return self.raw.tell()
+
+    def add(self, tarinfo, fileobj):
+        """Add a file to the volume.
+        Input:
+            tarinfo : TarInfo - the header of the file.
+            fileobj : file - the data of the file, tarinfo.size bytes are read.
+        Output:
+            returns : tuple - (offset of the frame in the volume, offset of the data in the frame)"""
+        if self.writer is not None and self.position - self.frame_start >= frame_size:
+            self.writer.flush(zstandard.FLUSH_FRAME)
+            self.frame_offset = self.raw.tell()
+            self.frame_start = self.position
+        self.tar.addfile(tarinfo, fileobj)
+        # The data ends the entry, padded to a whole block
+        blocks = (tarinfo.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+        return self.frame_offset, self.position - blocks * tarfile.BLOCKSIZE - self.frame_start
+
+    def close(self):
+        """Finish the volume.
+        Input:
+            None
+        Output:
+            returns : int - the size of the volume"""
+        self.tar.close()
+        if self.writer is not None:
+            self.writer.flush(zstandard.FLUSH_FRAME)
+            self.writer.close()
+        size = self.raw.tell()
+        self.raw.close()
+        return size
+
+
+class SourceReader():
+    """File object handing the data of a source file to tarfile.
+    Exactly size bytes are returned whatever happens to the file, a file that shrinks or fails while it is read is
+    padded with zeros so that the volume stays readable, the error is then kept in error."""
+    def __init__(self, handle, size, throttle=None):
+        self.handle = handle
+        self.remaining = size
+        self.throttle = throttle
+        self.error = None
+
+    def read(self, count=-1):
+        if count < 0 or count > self.remaining:
+            count = self.remaining
+        data = b''
+        while self.error is None and len(data) < count:
+            try:
+                chunk = self.handle.read(count - len(data))
+            except OSError as err:
+                self.error = err
+                break
+            if not chunk:
+                self.error = IOError('%s shrank while it was archived' % self.handle.name)
+                break
+            data += chunk
+        if len(data) < count:
+            data += b'\0' * (count - len(data))
+        self.remaining -= count
+        if self.throttle is not None and count:
+            self.throttle(count)
+        return data
+
+
+class ArchiveWriter():
+    """Write files into numbered tar volumes and their index, in place of copying them one by one.
+    Files are streamed into the current volume as they come, only the volume being written is open. A new volume is
+    started once the next file would take the volume past the split size, a file is never split across volumes.
+    The volumes can be read with any tar tool, or with extract using the index."""
+    def __init__(self, destdir, name, compressed=False, split_size=None):
+        if compressed and zstandard is None:
+            raise ValueError('The zstandard package is required for compressed archives')
+        self.destdir = destdir
+        self.name = name
+        self.compressed = compressed
+        self.split_size = split_size
+        self.index_path = os.path.join(destdir, name + index_suffix)
+        if os.path.exists(self.index_path):
+            raise ValueError('An archive named %s already exists in %s' % (name, destdir))
+        self.index = ArchiveIndex(self.index_path)
+        self.volume = None
+        self.volume_names = []
+        self.archive_bytes = 0
+
+    def next_volume(self):
+        """Close the current volume and start the next one."""
+        if self.volume is not None:
+            self.archive_bytes += self.volume.close()
+        name = '%s.%03d.%s' % (self.name, len(self.volume_names), 'tar.zst' if self.compressed else 'tar')
+        self.volume = ArchiveVolume(os.path.join(self.destdir, name), self.compressed)
+        self.index.add_volume(len(self.volume_names), name, self.compressed)
+        self.volume_names.append(name)
+        log.info('Writing archive volume %s', name)
+
+    def add(self, filepath, arcname, throttle=None):
+        """Add a file to the archive.
+        Input:
+            filepath    : string - path of the source file.
+            arcname     : string - path of the file in the archive.
+            throttle    : callable - called with the number of bytes read, see copybackend.copy_data.
+        Output:
+            returns     : int - the size of the file
+        Raises:
+            OSError if the file can not be read, a file failing part way is left in the volume padded with zeros
+            but is not indexed. ArchiveError if the volume can not be written."""
+        with open(filepath, 'rb') as handle:
+            st = os.fstat(handle.fileno())
+            tarinfo = tarfile.TarInfo(archive_path(arcname))
+            tarinfo.size = st.st_size
+            tarinfo.mtime = st.st_mtime
+            tarinfo.mode = stat.S_IMODE(st.st_mode)
+            tarinfo.uid = st.st_uid
+            tarinfo.gid = st.st_gid
+            if self.volume is None or (self.split_size and self.volume.position and
+                                       self.volume.size() + st.st_size >= self.split_size):
+                self.next_volume()
+            reader = SourceReader(handle, st.st_size, throttle)
+            try:
+                frame_offset, data_offset = self.volume.add(tarinfo, reader)
+            except OSError as err:
+                raise ArchiveError('Unable to write %s: %s' % (self.volume.path, err))
+        if reader.error is not None:
+            raise reader.error
+        self.index.record(tarinfo.name, len(self.volume_names) - 1, frame_offset, data_offset, st.st_size,
+                          st.st_mtime, tarinfo.mode)
+        return st.st_size
+
+    def close(self):
+        """Finish the current volume and the index.
+        Input:
+            None
+        Output:
+            returns : dict - index, volumes and archive_bytes"""
+        if self.volume is not None:
+            self.archive_bytes += self.volume.close()
+            self.volume = None
+        self.index.close()
+        return {'index': self.index_path, 'volumes': list(self.volume_names), 'archive_bytes': self.archive_bytes}
+
+
+class FrameReader():
+    """Read forward through a volume from a frame, decompressing it if needed."""
+    def __init__(self, path, frame_offset, compressed):
+        self.handle = open(path, 'rb')
+        self.handle.seek(frame_offset)
+        self.stream = self.handle
+        self.compressed = compressed
+        if compressed:
+            if zstandard is None:
+                self.handle.close()
+                raise ArchiveError('The zstandard package is required to extract %s' % path)
+            self.stream = zstandard.ZstdDecompressor().stream_reader(self.handle, closefd=False)
+        self.start = frame_offset
+        self.position = 0
+
+    def skip_to(self, offset):
+        """Move to an offset from the start of the frame, only forward if compressed."""
+        if not self.compressed:
+            self.handle.seek(self.start + offset)
+        else:
+            while self.position < offset:
+                data = self.stream.read(min(read_size, offset - self.position))
+                if not data:
+                    raise ArchiveError('%s is truncated' % self.handle.name)
+                self.position += len(data)
+        self.position = offset
+
+    def read(self, count):
+        data = self.stream.read(count)
+        self.position += len(data)
+        return data
+
+    def close(self):
+        if self.compressed:
+            self.stream.close()
+        self.handle.close()
+
+
+def extract(index_path, destdir, patterns=None, progress=None, keep_running=None):
+    """Extract files from an archive using its index.
+    Only the volumes and, for compressed volumes, the frames holding the selected files are read. Files stored twice
+    under the same path are extracted in the order they were archived, so the last one is kept.
+    Input:
+        index_path  : string - the index of the archive, the volumes are next to it.
+        destdir     : string - the directory the files are extracted to.
+        patterns    : list - glob patterns selecting the files, see ArchiveIndex.files, every file if omitted.
+        progress    : callable - called with the number of files and bytes extracted so far after each file.
+        keep_running: callable - polled between files, the extract stops when it returns False.
+    Output:
+        returns     : tuple - (number of files, number of bytes) extracted
+    Raises:
+        ArchiveError if a volume is missing or truncated, or a path would land outside destdir"""
+    if not os.path.isfile(index_path):
+        raise ArchiveError('%s is not an archive index' % index_path)
+    archive_dir = os.path.dirname(os.path.abspath(index_path))
+    destdir = os.path.abspath(destdir)
+    index = ArchiveIndex(index_path)
+    volumes = index.volumes()
+    reader = None
+    current = None
+    filecount = 0
+    filesize = 0
+    try:
+        for path, volume, frame_offset, data_offset, size, mtime, mode in index.files(patterns):
+            if keep_running is not None and not keep_running():
+                break
+            target = os.path.normpath(os.path.join(destdir, *path.split('/')))
+            if not target.startswith(os.path.join(destdir, '')):
+                raise ArchiveError('%s would be extracted outside of %s' % (path, destdir))
+            if reader is None or current != (volume, frame_offset) or \
+                    (reader.compressed and data_offset < reader.position):
+                if reader is not None:
+                    reader.close()
+                if volume not in volumes:
+                    raise ArchiveError('Volume %s of %s is not indexed' % (volume, index_path))
+                name, compressed = volumes[volume]
+                volume_path = os.path.join(archive_dir, name)
+                if not os.path.isfile(volume_path):
+                    raise ArchiveError('Volume %s is missing' % volume_path)
+                reader = FrameReader(volume_path, frame_offset, compressed)
+                current = (volume, frame_offset)
+            reader.skip_to(data_offset)
+            targetdir = os.path.dirname(target)
+            if not os.path.isdir(targetdir):
+                os.makedirs(targetdir)
+            with open(target, 'wb') as handle:
+                remaining = size
+                while remaining:
+                    data = reader.read(min(read_size, remaining))
+                    if not data:
+                        raise ArchiveError('%s is truncated' % volumes[volume][0])
+                    handle.write(data)
+                    remaining -= len(data)
+            os.chmod(target, mode)
+            os.utime(target, (mtime, mtime))
+            filecount += 1
+            filesize += size
+            if progress is not None:
+                progress(filecount, filesize)
+    finally:
+        if reader is not None:
+            reader.close()
+        index.close()
+    return filecount, filesize
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from copyengine import FileOperations, CopyEngine, copy_workers, large_copy_workers
+from pathplan import PathPlanner
+from devices import device_class
+
+# Version of the JSON report, changed whenever a key is renamed or its meaning changes
+report_format = 1
+block_size = 1024 * 1024
+seed = 20140601
+
+# Synthetic trees: number of files, (smallest, largest) size of the files, files per directory and nesting depth
+profiles = OrderedDict([
+    ('tiny', {'files': 20000, 'sizes': [(1.0, 0, 4096)], 'per_dir': 200, 'depth': 1}),
+    ('huge', {'files': 4, 'sizes': [(1.0, 128 * 1024 * 1024, 128 * 1024 * 1024)], 'per_dir': 4, 'depth': 1}),
+    ('deep', {'files': 2000, 'sizes': [(1.0, 1024, 16 * 1024)], 'per_dir': 10, 'depth': 40}),
+    ('mixed', {'files': 5000, 'sizes': [(0.9, 0, 64 * 1024), (0.09, 64 * 1024, 4 * 1024 * 1024),
+                                        (0.01, 16 * 1024 * 1024, 64 * 1024 * 1024)], 'per_dir': 50, 'depth': 4}),
+])
+stage_names = ('scan', 'plan', 'copy')
+startup_runs = 3
+startup_names = ('interpreter', 'cli', 'gui_import', 'gui_window', 'gui_ready')
+package_dir = os.path.dirname(os.path.abspath(__file__))
+# Run in a fresh interpreter, times the import of the gui, the window being shown and the end of the deferred startup
+gui_probe = '''
+import sys, json, time
+started = time.perf_counter()
+import mclub
+from PySide.QtGui import QApplication
+imported = time.perf_counter()
+app = QApplication(sys.argv)
+window = mclub.MainWindow()
+window.show()
+app.processEvents()
+shown = time.perf_counter()
+deadline = shown + 60
+while window.model is None and time.perf_counter() < deadline:
+    app.processEvents()
+ready = time.perf_counter()
+print(json.dumps({'gui_import': imported - started, 'gui_window': shown - started, 'gui_ready': ready - started}))
+'''
+
+
+def generate_tree(root, profile, scale=1.0):
+    """Write the synthetic tree of a profile, the layout and sizes are the same on every run.
+    Input:
+        root    : string - the directory to create the tree in.
+        profile : dict - see profiles.
+        scale   : float - multiplies the number of files.
+    Output:
+        returns : tuple - (number of files, bytes)"""
+    rng = random.Random(seed)
+    block = os.urandom(block_size)
+    filecount = max(1, int(profile['files'] * scale))
+    filesize = 0
+    dirpath = root
+    for index in range(filecount):
+        if index % profile['per_dir'] == 0:
+            # Each directory nests up to depth levels below the root before starting over
+            dirnum = index // profile['per_dir']
+            level = dirnum % profile['depth']
+            if level == 0:
+                dirpath = os.path.join(root, 'd%05d' % dirnum)
+            else:
+                dirpath = os.path.join(dirpath, 'd%05d' % dirnum)
+            os.makedirs(dirpath)
+        draw = rng.random()
+        for share, smallest, largest in profile['sizes']:
+            draw -= share
+            if draw <= 0:
+                break
+        size = rng.randint(smallest, largest)
+        with open(os.path.join(dirpath, 'f%06d.bin' % index), 'wb') as handle:
+            remaining = size
+            while remaining > 0:
+                handle.write(block[:min(remaining, block_size)])
+                remaining -= block_size
+        filesize += size
+    return filecount, filesize
+
+
+def _io_counters():
+    """Return the read and write syscall counts of the process from /proc/self/io, None if unavailable."""
+    counters = {}
+    try:
+        with open('/proc/self/io') as handle:
+            for line in handle:
+                name, value = line.split(':')
+                counters[name] = int(value)
+    except (IOError, OSError, ValueError):
+        return None
+    return counters.get('syscr', 0), counters.get('syscw', 0)
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS of the process so that it covers the next stage only, Linux only.
+    Output:
+        returns : bool - False if the peak can not be reset and covers the process lifetime"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as handle:
+            handle.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _peak_rss():
+    """Return the peak RSS of the process in bytes, None if unavailable."""
+    try:
+        with open('/proc/self/status') as handle:
+            for line in handle:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageProbe():
+    """Measure a stage of the pipeline: time, rates, read/write syscalls and peak RSS."""
+    def __init__(self):
+        self.per_stage_rss = _reset_peak_rss()
+        self.io = _io_counters()
+        self.started = time.perf_counter()
+
+    def result(self, filecount, filesize):
+        """Stop measuring and return the measurements.
+        Input:
+            filecount   : integer - files processed by the stage.
+            filesize    : integer - bytes of the files processed by the stage.
+        Output:
+            returns     : dict - seconds, files_per_second, mb_per_second, read_syscalls, write_syscalls (None
+                          where not available), peak_rss_bytes and peak_rss_scope ('stage' or 'process')"""
+        seconds = time.perf_counter() - self.started
+        io = _io_counters()
+        read_syscalls = write_syscalls = None
+        if io is not None and self.io is not None:
+            read_syscalls = io[0] - self.io[0]
+            write_syscalls = io[1] - self.io[1]
+        return {'seconds': round(seconds, 4),
+                'files': filecount,
+                'bytes': filesize,
+                'files_per_second': round(filecount / seconds, 1) if seconds > 0 else None,
+                'mb_per_second': round(filesize / 1024.00 / 1024.00 / seconds, 2) if seconds > 0 else None,
+                'read_syscalls': read_syscalls,
+                'write_syscalls': write_syscalls,
+                'peak_rss_bytes': _peak_rss(),
+                'peak_rss_scope': 'stage' if self.per_stage_rss else 'process'}
+
+
+def _time_command(command):
+    """Run a command in the package directory and return how long it took, None if it failed."""
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        returncode = subprocess.call(command, cwd=package_dir, stdout=devnull, stderr=devnull)
+    if returncode != 0:
+        return None
+    return time.perf_counter() - started
+
+
+def measure_startup(runs=startup_runs):
+    """Measure the startup of the program in fresh interpreters, keeping the fastest of the runs.
+    The gui is only measured where PySide and a display are available.
+    Input:
+        runs    : integer - runs of each measurement.
+    Output:
+        returns : dict - seconds for the bare interpreter, the command line help, the gui import, the gui window
+                  being shown and the deferred startup being done (None where not measured), and gui_error"""
+    best = dict((name, None) for name in startup_names)
+    best['gui_error'] = None
+    commands = {'interpreter': [sys.executable, '-c', 'pass'],
+                'cli': [sys.executable, 'mclub.py', '--help']}
+    for run in range(runs):
+        for name, command in commands.items():
+            seconds = _time_command(command)
+            if seconds is not None and (best[name] is None or seconds < best[name]):
+                best[name] = seconds
+        process = subprocess.Popen([sys.executable, '-c', gui_probe], cwd=package_dir, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, universal_newlines=True)
+        output, errors = process.communicate()
+        if process.returncode != 0:
+            lines = errors.strip().splitlines()
+            best['gui_error'] = lines[-1] if lines else 'exit code %s' % process.returncode
+            continue
+        for name, seconds in json.loads(output.strip().splitlines()[-1]).items():
+            if best[name] is None or seconds < best[name]:
+                best[name] = seconds
+    for name in startup_names:
+        if best[name] is not None:
+            best[name] = round(best[name], 4)
+    return best
+
+
+def run_stages(source, destdir, params):
+    """Run the scan, plan and copy stages over a tree once.
+    Input:
+        source  : string - the root of the tree.
+        destdir : string - an empty destination directory.
+        params  : dict - extra copy parameters, see CopyEngine.run.
+    Output:
+        returns : dict - stage name to its measurements, see StageProbe.result"""
+    stages = {}
+    probe = StageProbe()
+    scanner = FileOperations()
+    filelist = [meta.path for meta in scanner.scan_dir(source)]
+    stages['scan'] = probe.result(scanner.filecount, scanner.filesize)
+    probe = StageProbe()
+    planner = PathPlanner(destdir, 0)
+    planner.collisions(filelist, planner.plan(filelist))
+    stages['plan'] = probe.result(len(filelist), scanner.filesize)
+    del filelist
+    paramdict = {'destdir': destdir, 'filelist': [source], 'flattencount': 0, 'overwrite_opt': None}
+    paramdict.update(params)
+    probe = StageProbe()
+    summary = CopyEngine().run(paramdict)
+    stages['copy'] = probe.result(summary['files_copied'], summary['bytes_copied'])
+    stages['copy']['copy_methods'] = summary['copy_methods']
+    stages['copy']['phases'] = dict((name, round(phase['seconds'], 4))
+                                    for name, phase in summary['phases'].items())
+    return stages
+
+
+def run_benchmark(names, workdir=None, scale=1.0, repeat=1, params=None, keep=False, log=None,
+                  startup=startup_runs):
+    """Generate the trees of the profiles and measure each stage, keeping the fastest of the repeats.
+    Input:
+        names   : list - the profiles to run, see profiles.
+        workdir : string - where the trees are generated, a temporary directory if omitted.
+        scale   : float - multiplies the number of files of the profiles.
+        repeat  : integer - runs of each profile, the fastest run of each stage is reported.
+        params  : dict - extra copy parameters such as workers, see CopyEngine.run.
+        keep    : bool - keep the generated trees.
+        log     : file - receives a line per run, None for no output.
+        startup : integer - runs of the startup measurement, see measure_startup, 0 to skip it.
+    Output:
+        returns : dict - the JSON report"""
+    params = params or {}
+    root = tempfile.mkdtemp(prefix='mcmover_bench_', dir=workdir)
+    report = {'format': report_format,
+              'environment': {'python': platform.python_version(),
+                              'platform': platform.platform(),
+                              'cpus': os.cpu_count(),
+                              'device_class': device_class(os.stat(root).st_dev)},
+              'settings': {'scale': scale, 'repeat': repeat,
+                           'workers': params.get('workers', copy_workers),
+                           'large_workers': params.get('large_workers', large_copy_workers)},
+              'profiles': {},
+              'startup': None}
+    if startup:
+        report['startup'] = measure_startup(startup)
+        if log is not None:
+            log.write('startup: %s\n' % '  '.join('%s %ss' % (name, report['startup'][name])
+                                                  for name in startup_names))
+    try:
+        for name in names:
+            source = os.path.join(root, name, 'source')
+            os.makedirs(source)
+            filecount, filesize = generate_tree(source, profiles[name], scale)
+            best = {}
+            for run in range(repeat):
+                destdir = os.path.join(root, name, 'dest%d' % run)
+                os.makedirs(destdir)
+                stages = run_stages(source, destdir, params)
+                shutil.rmtree(destdir)
+                for stage in stage_names:
+                    if stage not in best or stages[stage]['seconds'] < best[stage]['seconds']:
+                        best[stage] = stages[stage]
+                if log is not None:
+                    log.write('%s run %s: %s\n' % (name, run + 1, '  '.join(
+                        '%s %.3fs' % (stage, stages[stage]['seconds']) for stage in stage_names)))
+            report['profiles'][name] = {'files': filecount, 'bytes': filesize, 'stages': best}
+    finally:
+        if not keep:
+            shutil.rmtree(root, ignore_errors=True)
+    return report
+
+
+def compare(baseline, report, stream):
+    """Print the change in time of each stage against a previous report.
+    Input:
+        baseline: dict - the previous report.
+        report  : dict - the new report.
+        stream  : file - receives the comparison.
+    Output:
+        None"""
+    if baseline.get('format') != report['format']:
+        stream.write('The baseline has report format %s, expected %s\n' % (baseline.get('format'), report['format']))
+        return
+    for name, profile in sorted(report['profiles'].items()):
+        before = baseline['profiles'].get(name)
+        if before is None:
+            continue
+        for stage in stage_names:
+            old = before['stages'][stage]['seconds']
+            new = profile['stages'][stage]['seconds']
+            change = (new - old) * 100.0 / old if old > 0 else 0.0
+            stream.write('%-6s %-5s %9.3fs -> %9.3fs  %+6.1f%%\n' % (name, stage, old, new, change))
+    if baseline.get('startup') and report['startup']:
+        for name in startup_names:
+            old = baseline['startup'].get(name)
+            new = report['startup'][name]
+            if old and new:
+                stream.write('startup %-11s %9.3fs -> %9.3fs  %+6.1f%%\n' % (name, old, new, (new - old) * 100.0 / old))
+
+
+def main(argv=None):
+    """Run the benchmark from the command line.
+    Input:
+        argv    : list - the command line arguments, sys.argv is used if omitted.
+    Output:
+        returns : int - exit code"""
+    parser = argparse.ArgumentParser(prog='benchmark',
+                                     description='Measure the scan, plan and copy stages on synthetic trees.')
+    parser.add_argument('profiles', nargs='*', metavar='PROFILE',
+                        help='profiles to run, all of them if omitted: %s' % ', '.join(profiles))
+    parser.add_argument('--workdir', help='where the trees are generated, the system temporary directory by default')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the number of files of the profiles')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each profile, the fastest is reported')
+    parser.add_argument('-w', '--workers', type=int, default=copy_workers, help='number of small file copy threads')
+    parser.add_argument('--large-workers', type=int, default=large_copy_workers,
+                        help='number of large file copy threads')
+    parser.add_argument('--startup-runs', type=int, default=startup_runs, metavar='COUNT',
+                        help='runs of the startup measurement, the fastest is reported, 0 to skip it')
+    parser.add_argument('--keep', action='store_true', help='keep the generated trees')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write the JSON report to FILE instead of stdout')
+    parser.add_argument('--compare', metavar='FILE', help='print the change against a previous JSON report')
+    args = parser.parse_args(argv)
+    for name in args.profiles:
+        if name not in profiles:
+            parser.error('unknown profile %s, choose from %s' % (name, ', '.join(profiles)))
+    report = run_benchmark(args.profiles or list(profiles), args.workdir, args.scale, max(1, args.repeat),
+                           {'workers': args.workers, 'large_workers': args.large_workers}, args.keep, sys.stderr,
+                           max(0, args.startup_runs))
+    text = json.dumps(report, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as handle:
+            compare(json.load(handle), report, sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
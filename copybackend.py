@@ -0,0 +1,544 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import stat
+import errno
+import queue
+import shutil
+import threading
+
+if sys.platform.startswith('linux'):
+    import fcntl
+
+from devices import device_class
+
+buffer_size = 1024 * 1024
+preallocate_size = 16 * 1024 * 1024
+hash_buffers = 3
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h
+
+# Errors meaning that a method is not supported for the pair of filesystems, the next method is tried instead
+unsupported_errors = set([errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP,
+                          errno.ETXTBSY, errno.EBADF, errno.ENOTTY])
+
+_disabled = set()
+_disabled_lock = threading.Lock()
+_buffers = threading.local()
+
+
+def _is_disabled(method, devices):
+    return (method, devices) in _disabled
+
+
+def _disable(method, devices):
+    with _disabled_lock:
+        _disabled.add((method, devices))
+
+
+def _buffer():
+    """Return the copy buffer of the calling thread, allocated once and reused for every file."""
+    view = getattr(_buffers, 'view', None)
+    if view is None:
+        view = _buffers.view = memoryview(bytearray(getattr(_buffers, 'size', buffer_size)))
+    return view
+
+
+def set_thread_buffer_size(size):
+    """Set the size of the copy buffer used by the calling thread, e.g. larger buffers for threads streaming big files.
+    Can be used as a thread pool initializer.
+    Input:
+        size    : int - buffer size in bytes.
+    Output:
+        None"""
+    _buffers.size = size
+    _buffers.view = None
+
+
+def _clone(src_fd, dst_fd):
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    done = 0
+    while done < count:
+        copied = os.copy_file_range(src_fd, dst_fd, count - done, offset + done, offset + done)
+        if copied == 0:
+            break
+        done += copied
+    return done
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    done = 0
+    while done < count:
+        copied = os.sendfile(dst_fd, src_fd, offset + done, count - done)
+        if copied == 0:
+            break
+        done += copied
+    return done
+
+
+def _read_chunk(fd, chunk):
+    """Read into a memoryview from the current position, returning the number of bytes read."""
+    if hasattr(os, 'readv'):
+        return os.readv(fd, [chunk])
+    data = os.read(fd, len(chunk))
+    chunk[:len(data)] = data
+    return len(data)
+
+
+def _write_all(fd, chunk):
+    written = 0
+    while written < len(chunk):
+        written += os.write(fd, chunk[written:])
+
+
+def _readinto(src_fd, dst_fd, offset, count):
+    view = _buffer()
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    done = 0
+    while done < count:
+        read = _read_chunk(src_fd, view[:min(len(view), count - done)])
+        if read == 0:
+            break
+        _write_all(dst_fd, view[:read])
+        done += read
+    return done
+
+
+range_methods = []
+if hasattr(os, 'copy_file_range'):
+    range_methods.append(('copy_file_range', _copy_file_range))
+if sys.platform.startswith('linux') and hasattr(os, 'sendfile'):
+    range_methods.append(('sendfile', _sendfile))
+range_methods.append(('readinto', _readinto))
+
+
+def _devices(src_fd, dst_fd):
+    return os.fstat(src_fd).st_dev, os.fstat(dst_fd).st_dev
+
+
+def try_clone(src_fd, dst_fd, devices=None):
+    """Share the data of the source with the destination (reflink), on filesystems supporting it (btrfs, XFS).
+    Input:
+        src_fd  : int - file descriptor of the source, opened for reading.
+        dst_fd  : int - file descriptor of the empty destination, opened for writing.
+        devices : tuple - (source st_dev, destination st_dev), read from the descriptors if omitted.
+    Output:
+        returns : bool - True if the file was cloned"""
+    if not sys.platform.startswith('linux'):
+        return False
+    if devices is None:
+        devices = _devices(src_fd, dst_fd)
+    if _is_disabled('clone', devices):
+        return False
+    try:
+        _clone(src_fd, dst_fd)
+    except OSError as err:
+        if err.errno not in unsupported_errors:
+            raise
+        _disable('clone', devices)
+        return False
+    return True
+
+
+def copy_range(src_fd, dst_fd, offset, count, devices=None):
+    """Copy count bytes starting at offset from the source to the same offset in the destination.
+    The kernel copy paths are preferred, copy_file_range then sendfile, falling back to a read/write loop over a
+    reusable buffer. A method failing as unsupported is not tried again for the same pair of devices.
+    Input:
+        src_fd  : int - file descriptor of the source, opened for reading.
+        dst_fd  : int - file descriptor of the destination, opened for writing.
+        offset  : int - position of the first byte to copy.
+        count   : int - number of bytes to copy.
+        devices : tuple - (source st_dev, destination st_dev), read from the descriptors if omitted.
+    Output:
+        returns : tuple - (number of bytes copied, name of the method used)"""
+    if devices is None:
+        devices = _devices(src_fd, dst_fd)
+    done = 0
+    for name, method in range_methods:
+        if _is_disabled(name, devices):
+            continue
+        try:
+            done += method(src_fd, dst_fd, offset + done, count - done)
+            return done, name
+        except OSError as err:
+            if err.errno not in unsupported_errors or name == 'readinto':
+                raise
+            _disable(name, devices)
+    raise OSError(errno.ENOSYS, 'No copy method available')
+
+
+def allocated_size(st):
+    """Return the space taken by a file on disk, smaller than its size for sparse files.
+    Platforms without st_blocks report the size. Compressed filesystems also report less than the size, the result
+    is then an estimate of the space needed by the copy.
+    Input:
+        st      : os.stat_result - the stat of the file.
+    Output:
+        returns : int - bytes allocated, at most the size of the file"""
+    blocks = getattr(st, 'st_blocks', None)
+    if blocks is None:
+        return st.st_size
+    return min(st.st_size, blocks * 512)
+
+
+def data_extents(fd, size, offset=0):
+    """Find the data of a sparse file with SEEK_DATA and SEEK_HOLE, the holes in between read as zeros.
+    Filesystems without hole support report the whole file as data.
+    Input:
+        fd      : int - file descriptor of the file.
+        size    : int - size of the file.
+        offset  : int - position to start from.
+    Output:
+        returns : list - (offset, length) of each data extent, None if holes can not be detected"""
+    if not hasattr(os, 'SEEK_DATA'):
+        return None
+    extents = []
+    position = os.lseek(fd, 0, os.SEEK_CUR)
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as err:
+                if err.errno == errno.ENXIO:
+                    break  # Only a hole is left
+                raise
+            if start >= size:
+                break
+            offset = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+            extents.append((start, offset - start))
+    except OSError as err:
+        if err.errno in unsupported_errors:
+            return None
+        raise
+    finally:
+        os.lseek(fd, position, os.SEEK_SET)
+    return extents
+
+
+def preallocate(dst_fd, offset, count, devices):
+    """Reserve the space of a copy in the destination up front, which limits fragmentation and fails early when
+    the space runs out. Network filesystems are skipped as the C library emulates the allocation by writing to them.
+    Input:
+        dst_fd  : int - file descriptor of the destination.
+        offset  : int - position of the first byte to reserve.
+        count   : int - number of bytes to reserve.
+        devices : tuple - (source st_dev, destination st_dev).
+    Output:
+        returns : bool - True if the space was reserved"""
+    if not hasattr(os, 'posix_fallocate') or _is_disabled('fallocate', devices):
+        return False
+    if device_class(devices[1]) == 'network':
+        _disable('fallocate', devices)
+        return False
+    try:
+        os.posix_fallocate(dst_fd, offset, count)
+    except OSError as err:
+        if err.errno not in unsupported_errors:
+            raise
+        _disable('fallocate', devices)
+        return False
+    return True
+
+
+def plan_extents(src_fd, dst_fd, size, devices, offset=0):
+    """Prepare the destination of a copy and return the ranges of the source to copy.
+    Sparse sources only have their data extents copied, the destination is extended to the size of the source so
+    the holes are kept. Other sources of preallocate_size and up are preallocated in the destination.
+    Input:
+        src_fd  : int - file descriptor of the source.
+        dst_fd  : int - file descriptor of the destination, holding the first offset bytes of the copy.
+        size    : int - size of the source.
+        devices : tuple - (source st_dev, destination st_dev).
+        offset  : int - position the copy starts from.
+    Output:
+        returns : tuple - (list of (offset, length) to copy, bool True if the source is sparse)"""
+    extents = None
+    if allocated_size(os.fstat(src_fd)) < size:
+        extents = data_extents(src_fd, size, offset)
+    if extents is not None:
+        os.ftruncate(dst_fd, size)
+        return extents, True
+    if size - offset >= preallocate_size:
+        preallocate(dst_fd, offset, size - offset, devices)
+    if offset < size:
+        return [(offset, size - offset)], False
+    return [], False
+
+
+def copy_chunks(src_fd, dst_fd, extents, devices, chunk=None):
+    """Copy ranges of the source to the same offsets in the destination, see copy_range.
+    Input:
+        src_fd  : int - file descriptor of the source.
+        dst_fd  : int - file descriptor of the destination.
+        extents : list - (offset, length) of the ranges to copy, see plan_extents.
+        devices : tuple - (source st_dev, destination st_dev).
+        chunk   : int - largest number of bytes copied at once, each range is copied in one call if omitted.
+    Output:
+        yields  : tuple - (offset reached, bytes copied, name of the method used) after each chunk"""
+    for start, length in extents:
+        offset = start
+        end = start + length
+        while offset < end:
+            copied, method = copy_range(src_fd, dst_fd, offset, min(chunk or length, end - offset), devices)
+            if copied == 0:
+                return  # The source has shrunk
+            offset += copied
+            yield offset, copied, method
+
+
+def unlink_shared(path):
+    """Remove a destination hard linked to other files, such as the duplicates linked by dedupe, so that writing the
+    new data creates a file of its own instead of overwriting the content of every link.
+    Input:
+        path    : string - path of the destination file.
+    Output:
+        returns : bool - True if the file was removed"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if st.st_nlink < 2 or not stat.S_ISREG(st.st_mode):
+        return False
+    os.unlink(path)
+    return True
+
+
+def open_pair(src, dst, truncate=True):
+    """Open a source for reading and a destination for writing, as raw file descriptors.
+    A destination hard linked to other files is replaced by a new file, see unlink_shared.
+    Input:
+        src     : string - path of the source file.
+        dst     : string - path of the destination file.
+        truncate: bool - empty the destination, set to False to continue a partial copy.
+    Output:
+        returns : tuple - (source descriptor, destination descriptor)"""
+    binary = getattr(os, 'O_BINARY', 0)
+    src_fd = os.open(src, os.O_RDONLY | binary)
+    try:
+        if truncate:
+            unlink_shared(dst)
+        flags = os.O_WRONLY | os.O_CREAT | binary
+        if truncate:
+            flags |= os.O_TRUNC
+        dst_fd = os.open(dst, flags, 0o666)
+    except:
+        os.close(src_fd)
+        raise
+    return src_fd, dst_fd
+
+
+def copy_data(src, dst, throttle=None):
+    """Copy the data of src to dst using the fastest path available, the metadata is not copied.
+    The data is cloned when possible, otherwise copied by copy_range. Only the data extents of sparse files are
+    copied, large files are preallocated, see plan_extents.
+    Input:
+        src     : string - path of the source file.
+        dst     : string - path of the destination file.
+        throttle: callable - called with the number of bytes copied after each chunk, the data is then copied one
+                  buffer_size chunk at a time so that the callable can hold the copy back.
+    Output:
+        returns : string - name of the method used, 'clone', 'copy_file_range', 'sendfile', 'readinto', 'sparse'
+                  or 'empty'"""
+    src_fd, dst_fd = open_pair(src, dst)
+    try:
+        devices = _devices(src_fd, dst_fd)
+        if try_clone(src_fd, dst_fd, devices):
+            method = 'clone'
+        else:
+            extents, sparse = plan_extents(src_fd, dst_fd, os.fstat(src_fd).st_size, devices)
+            method = 'empty'
+            try:
+                for offset, copied, method in copy_chunks(src_fd, dst_fd, extents, devices,
+                                                          None if throttle is None else buffer_size):
+                    if throttle is not None:
+                        throttle(copied)
+            except:
+                # Drop the preallocated space and the size set for a sparse copy, a failed copy must not look complete
+                os.ftruncate(dst_fd, 0)
+                raise
+            if sparse:
+                method = 'sparse'
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+    return method
+
+
+def copy_file(src, dst):
+    """Copy the data and metadata of src to dst, the same as shutil.copy2 but using the fastest path available.
+    Input:
+        src     : string - path of the source file.
+        dst     : string - path of the destination file.
+    Output:
+        returns : string - name of the method used, see copy_data"""
+    method = copy_data(src, dst)
+    shutil.copystat(src, dst)
+    return method
+
+
+def _hash_zeros(hasher, count):
+    zeros = getattr(_buffers, 'zeros', None)
+    if zeros is None:
+        zeros = _buffers.zeros = memoryview(bytes(buffer_size))
+    while count > 0:
+        hasher.update(zeros[:min(count, len(zeros))])
+        count -= len(zeros)
+
+
+def _copy_sparse_hashed(src_fd, dst_fd, size, extents, hasher, throttle):
+    """Copy the data extents of a sparse file through the thread buffer, hashing the holes as zeros."""
+    view = _buffer()
+    position = 0
+    for start, length in extents + [(size, 0)]:
+        _hash_zeros(hasher, start - position)
+        os.lseek(src_fd, start, os.SEEK_SET)
+        os.lseek(dst_fd, start, os.SEEK_SET)
+        position = start
+        while position < start + length:
+            read = _read_chunk(src_fd, view[:min(len(view), start + length - position)])
+            if read == 0:
+                return
+            _write_all(dst_fd, view[:read])
+            hasher.update(view[:read])
+            position += read
+            if throttle is not None:
+                throttle(read)
+
+
+class StreamHasher(threading.Thread):
+    """Hashing thread attached to a copy thread.
+    The copy thread reads each chunk into one of a small ring of buffers, writes it out and hands it over to be hashed,
+    so hashing overlaps with the I/O of the next chunk instead of slowing the copy down. hashlib releases the GIL while
+    hashing large chunks so both threads run in parallel."""
+    def __init__(self, buffers=hash_buffers, size=buffer_size):
+        super(StreamHasher, self).__init__()
+        self.daemon = True
+        self.free = queue.Queue()
+        for index in range(buffers):
+            self.free.put(memoryview(bytearray(size)))
+        self.work = queue.Queue()
+        self.start()
+
+    def run(self):
+        while True:
+            hasher, view, length = self.work.get()
+            if hasher is None:
+                if view is None:
+                    return  # Stopped
+                view.set()  # End of a stream, view holds the event the copy thread waits on
+            else:
+                hasher.update(view[:length])
+                self.free.put(view)
+
+    def finish(self):
+        """Wait until all the chunks handed over so far have been hashed."""
+        done = threading.Event()
+        self.work.put((None, done, 0))
+        done.wait()
+
+    def stop(self):
+        """Stop the thread once the chunks handed over so far have been hashed, releasing its buffers."""
+        self.work.put((None, None, 0))
+        self.join()
+
+
+class StreamHashers():
+    """The StreamHasher threads of a job, one per copy thread, started on first use and stopped when the job ends so
+    that the threads and their buffers do not outlive the copy threads."""
+    def __init__(self):
+        self.streamers = {}
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Return the StreamHasher of the calling thread.
+        Input:
+            None
+        Output:
+            returns : StreamHasher"""
+        ident = threading.current_thread().ident
+        with self.lock:
+            streamer = self.streamers.get(ident)
+            if streamer is None:
+                streamer = self.streamers[ident] = StreamHasher()
+        return streamer
+
+    def close(self):
+        """Stop the threads, once the copies using them are done.
+        Input:
+            None
+        Output:
+            None"""
+        with self.lock:
+            streamers = list(self.streamers.values())
+            self.streamers.clear()
+        for streamer in streamers:
+            streamer.stop()
+
+
+def copy_data_hashed(src, dst, hasher, throttle=None, streamers=None):
+    """Copy the data of src to dst through userspace, hashing it as it streams through the copy buffers.
+    Files larger than a buffer are hashed on the StreamHasher thread of the calling thread, smaller files inline.
+    Only the data extents of sparse files are copied, the holes are hashed as zeros.
+    Input:
+        src     : string - path of the source file.
+        dst     : string - path of the destination file.
+        hasher  : object - hashlib style object receiving the data with update().
+        throttle: callable - called with the number of bytes copied after each chunk.
+        streamers   : StreamHashers - the hashing threads of the job, a thread is started for the file and stopped
+                      once it is copied if omitted.
+    Output:
+        returns : string - name of the method used, 'hashed' or 'sparse'"""
+    src_fd, dst_fd = open_pair(src, dst)
+    try:
+        size = os.fstat(src_fd).st_size
+        extents, sparse = plan_extents(src_fd, dst_fd, size, _devices(src_fd, dst_fd))
+        if sparse:
+            try:
+                _copy_sparse_hashed(src_fd, dst_fd, size, extents, hasher, throttle)
+            except:
+                # The destination was extended to the size of the source, a failed copy must not look complete
+                os.ftruncate(dst_fd, 0)
+                raise
+            return 'sparse'
+        if size <= buffer_size:
+            view = _buffer()
+            while True:
+                read = _read_chunk(src_fd, view)
+                if read == 0:
+                    break
+                _write_all(dst_fd, view[:read])
+                hasher.update(view[:read])
+                if throttle is not None:
+                    throttle(read)
+        else:
+            streamer = StreamHasher() if streamers is None else streamers.get()
+            try:
+                while True:
+                    view = streamer.free.get()
+                    read = _read_chunk(src_fd, view)
+                    if read == 0:
+                        streamer.free.put(view)
+                        break
+                    _write_all(dst_fd, view[:read])
+                    streamer.work.put((hasher, view, read))
+                    if throttle is not None:
+                        throttle(read)
+            except:
+                # Drop the preallocated space, a failed copy must not look complete
+                os.ftruncate(dst_fd, 0)
+                raise
+            finally:
+                if streamers is None:
+                    streamer.stop()
+                else:
+                    streamer.finish()
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+    return 'hashed'
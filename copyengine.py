@@ -0,0 +1,1301 @@
+#!/usr/bin/env python
+
+import os
+import stat
+import logging
+import platform
+import shutil
+import time
+import threading
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+os_version = platform.system()
+if os_version == 'Windows':
+    import ctypes
+
+import copybackend
+from manifest import Manifest
+from journal import Journal
+from metrics import CopyMetrics
+from verify import Verifier
+from dedupe import DedupeEntry, DuplicateIndex
+from pathplan import PathPlanner
+from sizing import DirectorySizer, collapse_paths
+from devices import DeviceScheduler, locality_order
+from throttle import Throttle, set_thread_priority
+from outcomes import OutcomeStore, RetryQueue, retry_attempts, retry_backoff
+from listener import EngineListener
+from archive import ArchiveWriter, ArchiveError, archive_space
+from filters import FileFilter
+from defaults import copy_workers, large_copy_workers
+from watch import ChangeSet, PollingWatcher, WatchError, open_watcher, settle_seconds, wakeup_interval, \
+    max_pending_changes, poll_interval
+
+log = logging.getLogger(__name__)
+
+large_file_size = 16 * 1024 * 1024
+large_buffer_size = 8 * 1024 * 1024
+small_batch_size = 64
+scan_queue_size = 1000
+dest_cache_dirs = 256
+resumable_size = 64 * 1024 * 1024
+checkpoint_bytes = 64 * 1024 * 1024
+resume_chunk = 16 * 1024 * 1024
+progress_interval = 0.1
+# Parameters a resumed job may change
+throttle_params = ('bytes_per_second', 'files_per_second', 'throttle_schedule', 'nice', 'io_class')
+
+
+class FileMeta(object):
+    """Metadata of a file, gathered once during the scan and reused by the later stages."""
+    __slots__ = ('path', 'size', 'mtime', 'mode', 'inode', 'device', 'allocated')
+
+    def __init__(self, path, size=0, mtime=0, mode=0, inode=0, device=0, allocated=None):
+        self.path = path
+        self.size = size
+        # Space taken on disk, less than the size for sparse files
+        self.allocated = size if allocated is None else allocated
+        self.mtime = mtime
+        self.mode = mode
+        self.inode = inode
+        self.device = device
+
+    @classmethod
+    def from_stat(cls, path, st):
+        """Build the record from an os.stat_result.
+        Input:
+            path    : string - path of the file.
+            st      : os.stat_result - the stat of the file.
+        Output:
+            returns : FileMeta"""
+        return cls(path, st.st_size, st.st_mtime, st.st_mode, st.st_ino, st.st_dev, copybackend.allocated_size(st))
+
+    @classmethod
+    def from_path(cls, path):
+        """Stat path and build the record, None is returned if the file can not be stat'ed.
+        Input:
+            path    : string - path of the file.
+        Output:
+            returns : FileMeta or None"""
+        try:
+            return cls.from_stat(path, os.stat(path))
+        except OSError:
+            return None
+
+
+class DestinationCache():
+    """Cache of the destination directory listings used by the overwrite check.
+    Each destination directory is listed with a single scandir the first time a file is copied into it,
+    the listing is then used instead of stat'ing every destination file. Only the most recently used
+    directories are kept."""
+    def __init__(self, maxdirs=dest_cache_dirs):
+        self.maxdirs = maxdirs
+        self.listings = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_listing(self, destdir):
+        """Return the listing of destdir, reading it on first use.
+        Input:
+            destdir : string - destination directory.
+        Output:
+            returns : dict - file name to DirEntry / FileMeta, None if the directory does not exist"""
+        with self.lock:
+            if destdir in self.listings:
+                self.listings.move_to_end(destdir)
+                return self.listings[destdir]
+        try:
+            listing = dict((entry.name, entry) for entry in os.scandir(destdir))
+        except OSError:
+            listing = None
+        with self.lock:
+            listing = self.listings.setdefault(destdir, listing)
+            while len(self.listings) > self.maxdirs:
+                self.listings.popitem(last=False)
+        return listing
+
+    def lookup(self, destination):
+        """Return the metadata of an existing destination file.
+        Input:
+            destination : string - destination file path.
+        Output:
+            returns     : FileMeta or None if the file does not exist"""
+        destdir, name = os.path.split(destination)
+        listing = self.get_listing(destdir)
+        if not listing or name not in listing:
+            return None
+        entry = listing[name]
+        if isinstance(entry, FileMeta):
+            return entry
+        try:
+            return FileMeta.from_stat(destination, entry.stat())
+        except OSError:
+            return None
+
+    def dir_exists(self, destdir):
+        """Check if a destination directory exists using the cached listing.
+        Input:
+            destdir : string - destination directory.
+        Output:
+            returns : bool"""
+        return self.get_listing(destdir) is not None
+
+    def record(self, destination, meta):
+        """Update the cached listing after a file has been written to the destination.
+        Input:
+            destination : string - destination file path.
+            meta        : FileMeta - metadata of the file now at the destination.
+        Output:
+            None"""
+        destdir, name = os.path.split(destination)
+        with self.lock:
+            if destdir in self.listings:
+                if self.listings[destdir] is None:
+                    self.listings[destdir] = {}
+                self.listings[destdir][name] = meta
+
+
+class FileOperations():
+    """Class to process file based operations"""
+    def __init__(self, metrics=None, filters=None):
+        if metrics is None:
+            metrics = CopyMetrics()
+        self.metrics = metrics
+        self.filters = filters
+        self.excluded = 0
+        self.filecount = 0
+        self.filelist = []
+        self.filesize = 0
+        self.allocated = 0
+        self.copy_methods = {}
+        self.outcomes = OutcomeStore()
+        self.lock = threading.Lock()
+
+    def get_free_space(self, folder):
+        """ Return folder/drive free space (in bytes)
+        Input:
+            folder      : string - Path to folder / drive
+        Output:
+            returns     : int - Number of bytes available in path
+        """
+        if os_version == 'Windows':
+            free_bytes = ctypes.c_ulonglong(0)
+            ctypes.windll.kernel32.GetDiskFreeSpaceExW(ctypes.c_wchar_p(folder), None, None, ctypes.pointer(free_bytes))
+            return free_bytes.value
+        else:
+            st = os.statvfs(folder)
+            return st.f_bavail * st.f_frsize
+
+    def get_file_list_for_dir(self, filepath):
+        """ Process filepath to det a list of the items.
+        Class variables are updated.
+        Input:
+            filepath    : string - can be either a filepath or directory to be recursively inspected
+        Output:
+            None"""
+        for meta in self.scan_dir(filepath):
+            self.filelist.append(meta.path)
+
+    def scan_dir(self, filepath):
+        """Generator walking filepath with os.scandir and yielding the files as they are found.
+        The metadata is taken from the DirEntry stat result so that every file is only stat'ed once,
+        entries are yielded in name order per directory, or in inode order on spinning disks to limit seeking.
+        With filters the excluded directories are not descended and the files excluded by name are not stat'ed,
+        the excluded files are counted in excluded.
+        Class variables are updated as the walk proceeds.
+        Input:
+            filepath    : string - can be either a filepath or directory to be recursively inspected
+        Output:
+            yields      : FileMeta - metadata of each file found"""
+        filters = self.filters
+        if os.path.isfile(filepath):
+            meta = FileMeta.from_path(filepath) or FileMeta(filepath)
+            if filters is not None and (filters.excludes_file(filepath, os.path.basename(filepath)) or
+                                        not filters.accepts_stat(meta.size, meta.mtime)):
+                self.excluded += 1
+                return
+            self.filecount += 1
+            self.filesize += meta.size
+            self.allocated += meta.allocated
+            yield meta
+            return
+        dirs = [os.path.abspath(filepath)]
+        try:
+            by_inode = locality_order(os.stat(filepath).st_dev)
+        except OSError:
+            by_inode = False
+        while dirs:
+            current = dirs.pop()
+            try:
+                with self.metrics.phase('scan'):
+                    if by_inode:
+                        entries = sorted(os.scandir(current), key=lambda entry: entry.inode())
+                    else:
+                        entries = sorted(os.scandir(current), key=lambda entry: entry.name)
+            except OSError:
+                continue
+            subdirs = []
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink():  # Same as os.walk, symlinked dirs are not followed
+                            if filters is None or not filters.excludes_dir(entry.path, entry.name):
+                                subdirs.append(entry.path)
+                        continue
+                    if filters is not None and filters.excludes_file(entry.path, entry.name):
+                        self.excluded += 1
+                        continue
+                    with self.metrics.phase('stat'):
+                        meta = FileMeta.from_stat(entry.path, entry.stat())
+                except OSError:
+                    meta = FileMeta(entry.path)
+                if filters is not None and not filters.accepts_stat(meta.size, meta.mtime):
+                    self.excluded += 1
+                    continue
+                self.filecount += 1
+                self.filesize += meta.size
+                self.allocated += meta.allocated
+                yield meta
+            dirs.extend(reversed(subdirs))
+
+    def collapse_paths(self, pathlist):
+        """Remove selected paths that are already covered by another selected directory.
+        This avoids copying the same file twice without having to keep every scanned path in memory.
+        Input:
+            pathlist    : list - selected files and directories.
+        Output:
+            returns     : list - sorted absolute paths with the nested selections removed, see sizing.collapse_paths."""
+        return collapse_paths([os.path.abspath(path) for path in pathlist])
+
+    def get_file_size(self, filepath, ret=False):
+        """Determine size of a file in bytes, results can be returned by setting the ret flag.
+        Input:
+            filepath    : string - path, must be a file
+            ret         : bool  -  if ommited or False class variables will be set, else data will be returned
+        Output:
+            returns     : int -  number of bytes"""
+        try:
+            if not ret:
+                self.filesize += os.stat(filepath).st_size
+            else:
+                return os.stat(filepath).st_size
+        except:
+            self.filesize += 0
+
+    def get_file_age(self, filepath):
+        """Determine the age of the file by checking the last modified time.
+        Input:
+            filepath    : string - can be either a file or directory
+        Output:
+            returns     : float - number of seconds since epoch, 0 is returned if epoch fails"""
+        try:
+            fileage = os.path.getmtime(filepath)
+            return fileage
+        except:
+            return 0
+
+    def split_path(self, path):
+        """This is used when trimming directories from a path.
+        The idea is to split the path into elements then return the reversed list to address the order.
+        Input:
+            path    : string - the path that you wish to split into a list.
+        Output:
+            folders : list - the path elements in a list format, ideal for splitting."""
+        path = os.path.splitdrive(path)[1][1:]
+        folders = []
+        while 1:
+            path, folder = os.path.split(path)
+            if folder != "" and folder:
+                folders.append(folder)
+                if len(path) == 0:
+                    return folders[::-1]
+            else:
+                if path != "" and path:
+                    folders.append(path)
+                break
+        folders.reverse()
+        return folders
+
+    def get_dest_filepath(self, filepath, destpath, flattencount):
+        """Determine the flattened filepath for the destination of files.
+        Input:
+            filepath    : string - the path to the source file.
+            destpath    : string - the destination path.
+            flattencount: integer- the number of directories to trim from the source path.
+        Output:
+            dpath       : string - the destination path taking into account the flattencount."""
+        fp = self.split_path(filepath)
+        if flattencount > 0:
+            if len(fp) > flattencount:
+                dpath = os.path.abspath(os.path.join(destpath, *fp[flattencount:]))
+            else:
+                dpath = os.path.abspath(os.path.join(destpath, fp[-1]))
+        else:
+            dpath = os.path.abspath(os.path.join(destpath, *fp))
+        return dpath
+
+    def copy_file_resumable(self, filepath, destination, source_meta, journal, keep_running=None, throttle=None):
+        """Copy a large file in chunks, checkpointing the offset reached in the job journal.
+        If the journal holds a checkpoint for the destination the copy continues from that offset. Sparse files only
+        have their data extents copied, see copybackend.plan_extents.
+        The metadata is not copied, this is left to the caller once the data is complete.
+        Input:
+            filepath    : string - path to the file you wish to copy.
+            destination : string - the path to which you want to copy.
+            source_meta : FileMeta - metadata of the source file.
+            journal     : Journal - the job journal receiving the checkpoints.
+            keep_running: callable - polled between chunks, the copy is interrupted when it returns False.
+            throttle    : callable - called with the number of bytes copied after each chunk, the chunks are then
+                          copybackend.buffer_size long.
+        Output:
+            returns     : string - the copy method used, see copybackend.copy_data, None if interrupted"""
+        offset = journal.resume_offset(destination, source_meta)
+        src_fd, dst_fd = copybackend.open_pair(filepath, destination, truncate=not offset)
+        try:
+            devices = (os.fstat(src_fd).st_dev, os.fstat(dst_fd).st_dev)
+            if not offset and copybackend.try_clone(src_fd, dst_fd, devices):
+                method = 'clone'
+            else:
+                os.ftruncate(dst_fd, offset)
+                extents, sparse = copybackend.plan_extents(src_fd, dst_fd, source_meta.size, devices, offset)
+                checkpoint_at = offset + checkpoint_bytes
+                chunk = resume_chunk if throttle is None else copybackend.buffer_size
+                method = 'sparse' if sparse else 'empty'
+                for offset, copied, used in copybackend.copy_chunks(src_fd, dst_fd, extents, devices, chunk):
+                    if not sparse:
+                        method = used
+                    if throttle is not None:
+                        throttle(copied)
+                    interrupted = keep_running is not None and not keep_running()
+                    if offset >= checkpoint_at or interrupted:
+                        if interrupted:
+                            # Drop the preallocated space and the size set for a sparse copy, the destination then
+                            # only holds the data up to the checkpoint and does not look complete
+                            os.ftruncate(dst_fd, offset)
+                        os.fsync(dst_fd)
+                        journal.checkpoint(destination, source_meta, offset)
+                        checkpoint_at = offset + checkpoint_bytes
+                        if interrupted:
+                            return None
+        finally:
+            os.close(src_fd)
+            os.close(dst_fd)
+        return method
+
+    def link_file(self, link_to, destination, replace):
+        """Hard link a destination file to another destination file with the same content.
+        Input:
+            link_to     : DedupeEntry - the earlier file, its destination is linked to.
+            destination : string - the path of the new link.
+            replace     : bool - the destination exists and is replaced.
+        Output:
+            returns     : string - 'hardlink', None if the filesystem can not link the files or a later file has
+                          been written to the destination of link_to"""
+        if replace:
+            try:
+                os.remove(destination)
+            except OSError:
+                pass
+        try:
+            if not link_to.link(destination):
+                log.debug("%s has been overwritten, copying %s instead of linking", link_to.destination, destination)
+                return None
+        except OSError as err:
+            log.debug("Unable to link %s to %s, copying instead: %s", destination, link_to.destination, err)
+            return None
+        return 'hardlink'
+
+    def copy_file_to_dest(self, filepath, destination, overwrite, source_meta=None, dest_cache=None,
+                          journal=None, keep_running=None, verifier=None, link_to=None, throttle=None):
+        """Copy files to a destination and overwrite / skip based on the overwrite param.
+        If the directory is multiple directories, we attempt to create these.
+        Input:
+            filepath    : string - path to the file you wish to copy.
+            destination : string - the path to which you want to copy.
+            overwrite   : string - expects 'larger', 'newer' or 'either'
+            source_meta : FileMeta - metadata of the source from the scan, the source is stat'ed if omitted.
+            dest_cache  : DestinationCache - cached destination listings, the destination is stat'ed if omitted.
+            journal     : Journal - job journal, files left incomplete by a previous run are copied again and
+                          large files are checkpointed so they can be resumed.
+            keep_running: callable - polled while copying large files, see copy_file_resumable.
+            verifier    : Verifier - hash the data while it is copied and verify the destination, large files are
+                          then copied in one go rather than resumed from a checkpoint.
+            link_to     : DedupeEntry - an earlier file with the same content, the file is hard linked to its
+                          destination rather than copied. The data is copied if the link can not be made.
+            throttle    : callable - called with the number of bytes copied after each chunk, see
+                          copybackend.copy_data.
+        Output:
+            returns     : string - the outcome recorded in self.outcomes, 'copied', 'skipped' if the overwrite option
+                          keeps the destination, 'failed' or 'cancelled'
+        """
+        if source_meta is None:
+            source_meta = FileMeta.from_path(filepath) or FileMeta(filepath)
+        if dest_cache is not None:
+            dest_meta = dest_cache.lookup(destination)
+        else:
+            dest_meta = FileMeta.from_path(destination)
+        copy_file_flag = False
+        if dest_meta is not None:
+            if journal is not None and journal.is_incomplete(destination, source_meta, dest_meta):
+                copy_file_flag = True
+            elif overwrite == 'larger':
+                if source_meta.size > dest_meta.size:
+                    copy_file_flag = True
+            elif overwrite == 'newer':
+                if source_meta.mtime > dest_meta.mtime:
+                    copy_file_flag = True
+            elif overwrite == 'either':
+                copy_file_flag = True
+        else:
+            copy_file_flag = True
+        if copy_file_flag:
+            destdir = os.path.split(destination)[0]
+            if dest_meta is not None:
+                destdir_exists = True
+            elif dest_cache is not None:
+                destdir_exists = dest_cache.dir_exists(destdir)
+            else:
+                destdir_exists = os.path.isdir(destdir)
+            if not destdir_exists:
+                try:
+                    with self.metrics.phase('mkdir'):
+                        os.makedirs(destdir)
+                except:
+                    # Another worker may have created the directory in the meantime
+                    if not os.path.isdir(destdir):
+                        log.error("Unable to create %s", destdir)
+            self.metrics.current_file = filepath
+            try:
+                method = None
+                with self.metrics.phase('copy'):
+                    if link_to is not None:
+                        method = self.link_file(link_to, destination, dest_meta is not None)
+                    if method is not None:
+                        pass
+                    elif verifier is not None:
+                        method = verifier.copy(filepath, destination, throttle)
+                    elif journal is not None and source_meta.size >= resumable_size:
+                        method = self.copy_file_resumable(filepath, destination, source_meta, journal, keep_running,
+                                                          throttle)
+                    else:
+                        method = copybackend.copy_data(filepath, destination, throttle)
+                if method is None:
+                    self.outcomes.record('cancelled')
+                    return 'cancelled'
+                if method != 'hardlink':
+                    # A link shares the metadata of the file it points to
+                    with self.metrics.phase('metadata'):
+                        shutil.copystat(filepath, destination)
+            except Exception as err:
+                log.error("Error encountered while copying %s to %s", filepath, destination, exc_info=True)
+                self.outcomes.record_failure(filepath, destination, err)
+                return 'failed'
+            else:
+                if dest_cache is not None:
+                    # The copy keeps size and mtime, so the source metadata describes the new destination file
+                    dest_cache.record(destination, FileMeta(destination, source_meta.size, source_meta.mtime, source_meta.mode))
+                with self.lock:
+                    self.filesize += source_meta.size
+                    self.filecount += 1
+                    self.copy_methods[method] = self.copy_methods.get(method, 0) + 1
+                self.outcomes.record('copied', filepath, destination)
+                return 'copied'
+        self.outcomes.record('skipped')
+        return 'skipped'
+
+
+class DestinationTickets():
+    """Serialise the copies that resolve to the same destination path.
+    The scanner issues a ticket per file in scan order and the copy threads wait for their turn,
+    so flattened files colliding on a destination are overwritten in the same order as a serial copy.
+    Only destinations with outstanding files are tracked."""
+    def __init__(self):
+        self.issued = {}
+        self.served = {}
+        self.cancelled = False
+        self.condition = threading.Condition()
+
+    def issue(self, destination):
+        """Reserve the next slot for destination.
+        Input:
+            destination : string - destination file path.
+        Output:
+            returns     : int - the ticket to pass to wait()"""
+        with self.condition:
+            ticket = self.issued.get(destination, 0)
+            self.issued[destination] = ticket + 1
+            return ticket
+
+    def wait(self, destination, ticket):
+        """Block until all earlier tickets for destination have been released.
+        Input:
+            destination : string - destination file path.
+            ticket      : int - ticket returned by issue()
+        Output:
+            returns     : bool - False if the wait was interrupted by cancel()"""
+        with self.condition:
+            while self.served.get(destination, 0) != ticket:
+                if self.cancelled:
+                    return False
+                self.condition.wait()
+            return True
+
+    def cancel(self):
+        """Wake up all the waiting copies, used when the job is cancelled as earlier tickets may never be released.
+        Input:
+            None
+        Output:
+            None"""
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify_all()
+
+    def release(self, destination):
+        """Mark the current ticket for destination as done.
+        Input:
+            destination : string - destination file path.
+        Output:
+            None"""
+        with self.condition:
+            if destination not in self.issued:
+                return
+            served = self.served.get(destination, 0) + 1
+            if served == self.issued[destination]:
+                del self.issued[destination]
+                self.served.pop(destination, None)
+            else:
+                self.served[destination] = served
+            self.condition.notify_all()
+
+
+class CopyEngine():
+    """The copy engine, scan the selected paths and copy the files found to the destination.
+    The engine has no dependency on Qt so that it can be shared by the GUI worker thread and the command line.
+    Setting must_run to False from another thread cancels the run."""
+    def __init__(self, listener=None, sizer=None, scheduler=None):
+        if listener is None:
+            listener = EngineListener()
+        if sizer is None:
+            sizer = DirectorySizer()
+        if scheduler is None:
+            scheduler = DeviceScheduler()
+        self.listener = listener
+        self.sizer = sizer
+        self.scheduler = scheduler
+        self.throttle = Throttle()
+        self.retries = None
+        self.dedupe_dests = None
+        self.dedupe_lock = threading.Lock()
+        self.must_run = True
+
+    def preflight(self, paramdict):
+        """Size the selection before the copy starts and check that it fits in the destination.
+        The copy itself checks the space as it goes, this gives the answer before any file is copied. Incremental,
+        deduplicated and resumed jobs are not checked as the selection overstates the space they need.
+        Input:
+            paramdict   : dict - the job parameters, see run.
+        Output:
+            returns     : bool - True if the copy can start, the listener is notified of a space problem"""
+        if paramdict.get('resume') or paramdict.get('incremental') or paramdict.get('dedupe'):
+            return True
+        sized = self.sizer.size(paramdict['filelist'], self.listener.preflight_progress, lambda: self.must_run,
+                                FileFilter.from_params(paramdict))
+        if sized is None:
+            return False
+        filesize = sized[1]
+        available_space = FileOperations().get_free_space(paramdict['destdir'])
+        if filesize >= available_space:
+            self.listener.space_problem(filesize, available_space)
+            return False
+        return True
+
+    def scan(self, scanner, filequeue):
+        """Scanner stage, walk the selected paths and feed the files to the copy stage.
+        The queue is bounded so the scan never runs too far ahead of the copy.
+        Input:
+            scanner     : FileOperations - instance used for the walk, its counters hold the running totals.
+            filequeue   : Queue - bounded queue shared with the copy stage.
+        Output:
+            None, a None sentinel is queued once the scan is complete"""
+        set_thread_priority(self.nice, self.io_class)
+        try:
+            for path in scanner.collapse_paths(self.pathlist):
+                for meta in scanner.scan_dir(path):
+                    while self.must_run:
+                        try:
+                            filequeue.put(meta, timeout=0.5)
+                            break
+                        except queue.Full:
+                            pass
+                    if not self.must_run:
+                        return
+        finally:
+            self.scan_complete = True
+            while True:
+                try:
+                    filequeue.put(None, timeout=0.5)
+                    break
+                except queue.Full:
+                    if not self.must_run:
+                        break
+
+    def copy_file(self, filecopy, tickets, meta, destfilepath, ticket, entry=None, candidates=None):
+        """Copy stage task, copy a single file once any earlier file with the same destination is done.
+        Input:
+            filecopy    : FileOperations - shared instance used to tally the copied files.
+            tickets     : DestinationTickets - destination ordering shared by the copy tasks.
+            meta        : FileMeta - metadata of the source file from the scan.
+            destfilepath: string - the destination path of the file.
+            ticket      : int - ticket issued for the destination.
+            entry       : DedupeEntry - the file in the duplicate index, marked as done once copied.
+            candidates  : list - earlier files of the same size, see DuplicateIndex.candidates. The file is compared
+                          with them and, when it has the same content as one, skipped or linked to its destination
+                          once it is copied.
+        Output:
+            None"""
+        outcome = None
+        try:
+            original = None
+            if candidates and self.must_run:
+                with self.metrics.phase('dedupe'):
+                    original = self.duplicates.match(entry, candidates)
+                if original is not None:
+                    entry.original = original
+                    # The duplicate takes no space, unless the original can not be linked to
+                    with self.dedupe_lock:
+                        self.dedupe_count += 1
+                        self.dedupe_size += meta.size
+                        self.space_saved += meta.allocated
+            if not tickets.wait(destfilepath, ticket):
+                return
+            try:
+                if not self.must_run:
+                    pass
+                elif original is not None and (self.dedupe == 'skip' or original.destination == destfilepath):
+                    with self.dedupe_lock:
+                        self.dedupe_skipped_count += 1
+                        self.dedupe_skipped_size += meta.size
+                    filecopy.outcomes.record('deduplicated')
+                    self.journal.record_done(meta.path)
+                else:
+                    link_to = None
+                    if original is not None and original.wait(lambda: self.must_run):
+                        link_to = original
+                    keep_running = lambda: self.must_run
+                    self.throttle.consume_file(keep_running)
+                    throttle = None
+                    if self.throttle.limits_bytes():
+                        throttle = lambda count: self.throttle.consume_bytes(count, keep_running)
+                    with self.scheduler.slots(meta.device, self.dest_device):
+                        outcome = filecopy.copy_file_to_dest(meta.path, destfilepath, self.overwrite, meta,
+                                                             self.dest_cache, self.journal, keep_running,
+                                                             self.verifier, link_to, throttle)
+                    if outcome == 'copied':
+                        if self.journal is not None:
+                            self.journal.record_done(meta.path, destfilepath)
+                        if self.manifest is not None:
+                            self.manifest.record(meta, destfilepath)
+            finally:
+                tickets.release(destfilepath)
+        finally:
+            if entry is not None:
+                entry.finish(outcome == 'copied')
+        if outcome == 'failed' and self.retries is not None:
+            failure = filecopy.outcomes.failure(meta.path)
+            if failure is not None and failure.retryable:
+                self.retries.schedule((filecopy, tickets, meta, destfilepath), failure.attempts)
+
+    def retry_file(self, item, attempt):
+        """Retry pass task, copy a file that failed again unless a later file has since been written to its
+        destination.
+        Input:
+            item    : tuple - (FileOperations, DestinationTickets, FileMeta, destination path) of the file.
+            attempt : integer - the number of the attempt.
+        Output:
+            None"""
+        filecopy, tickets, meta, destfilepath = item
+        log.info('Retrying %s, attempt %s', meta.path, attempt)
+        self.supersede_destination(destfilepath)
+        ticket = tickets.issue(destfilepath)
+        if not tickets.wait(destfilepath, ticket):
+            return
+        failure = filecopy.outcomes.failure(meta.path)
+        if failure is None or failure.superseded:
+            tickets.release(destfilepath)
+            return
+        self.copy_file(filecopy, tickets, meta, destfilepath, ticket)
+
+    def supersede_destination(self, destfilepath, entry=None):
+        """Dedupe, record that a file is about to be written to a destination, before its ticket is issued. The
+        earlier file copied there can no longer be linked to by its duplicates, see DedupeEntry.supersede.
+        Input:
+            destfilepath: string - the destination path.
+            entry       : DedupeEntry - the file written, duplicates can link to it once it is copied.
+        Output:
+            None"""
+        if self.dedupe_dests is None:
+            return
+        earlier = self.dedupe_dests.pop(destfilepath, None)
+        if earlier is not None and earlier is not entry:
+            earlier.supersede()
+        if entry is not None:
+            self.dedupe_dests[destfilepath] = entry
+
+    def init_copy_thread(self, buffer_size=None):
+        """Thread pool initializer of the copy threads, set their buffer size and priority.
+        Input:
+            buffer_size : int - size of the copy buffer, copybackend.buffer_size if omitted.
+        Output:
+            None"""
+        if buffer_size is not None:
+            copybackend.set_thread_buffer_size(buffer_size)
+        set_thread_priority(self.nice, self.io_class)
+
+    def copy_batch(self, filecopy, tickets, batch):
+        """Small file lane task, copy a batch of small files going to the same destination directory.
+        Batching keeps the directory creation and listing of the destination to one thread and amortises the
+        task overhead over many files.
+        Input:
+            filecopy    : FileOperations - shared instance used to tally the copied files.
+            tickets     : DestinationTickets - destination ordering shared by the copy tasks.
+            batch       : list - (FileMeta, destination path, ticket, DedupeEntry, duplicate candidates) tuples,
+                          in scan order.
+        Output:
+            None"""
+        for meta, destfilepath, ticket, entry, candidates in batch:
+            self.copy_file(filecopy, tickets, meta, destfilepath, ticket, entry, candidates)
+
+    def run(self, paramdict):
+        """Run a copy job.
+        Input:
+            paramdict   : dict - the job parameters
+                          destdir       : string - the destination path.
+                          filelist      : list - the selected files and directories.
+                          flattencount  : integer - the number of directories to trim from the source paths.
+                          overwrite_opt : string - 'larger', 'newer', 'either' or None to never overwrite.
+                          workers       : integer - the number of copy threads of the small file lane.
+                          large_workers : integer - the number of copy threads of the large file lane.
+                          incremental   : bool - skip the files unchanged since the last run using the manifest.
+                          resume        : bool - resume the unfinished job journaled in destdir, only destdir is needed.
+                          timeline      : string - optional path where the JSON timeline of the run is written.
+                          verify        : string - 'sample' or 'full' to verify the copies, None to skip verification.
+                          hash_algorithm: string - the hash used for verification, see verify.hash_algorithms.
+                          dedupe        : string - 'link' to hard link the files with the same content to the first
+                                          copy, 'skip' to only copy the first, None to copy every file.
+                          bytes_per_second  : integer - bandwidth cap, None for no limit.
+                          files_per_second  : integer - files per second cap, None for no limit.
+                          throttle_schedule : list - time of day limits replacing the caps above during their
+                                              window, see throttle.parse_window.
+                          nice          : integer - niceness added to the copy threads.
+                          io_class      : string - 'low' or 'idle' to lower the I/O priority of the copy threads.
+                          retries       : integer - attempts made again at the files failing with a transient
+                                          error, see outcomes.retry_errors.
+                          watch         : bool - keep watching the selected paths once the copy is complete, see
+                                          watch. The run then only returns once cancelled.
+                          watch_interval: float - with watch, poll the selected paths every watch_interval seconds
+                                          rather than using inotify.
+                          watch_settle  : float - with watch, seconds a file must go unchanged before it is copied.
+                          archive       : string - 'tar' or 'tar.zst' to pack the files into archive volumes in
+                                          destdir rather than copying them, see pack.
+                          archive_name  : string - with archive, the name of the volumes and index.
+                          archive_split : integer - with archive, the size in bytes past which a new volume is
+                                          started, None for a single volume.
+                          include       : list - only copy the files matching one of these patterns, see
+                                          filters.FileFilter.
+                          exclude       : list - skip the files and directories matching these patterns.
+                          exclude_junk  : bool - skip the system, thumbnail, temp and cache files, see
+                                          filters.junk_patterns.
+                          min_size      : integer - skip the files smaller than min_size bytes.
+                          max_size      : integer - skip the files larger than max_size bytes.
+                          min_age       : integer - skip the files modified less than min_age seconds ago.
+                          max_age       : integer - skip the files modified more than max_age seconds ago.
+        Output:
+            returns     : dict - summary of the run, status is 'complete', 'cancelled' or 'no_space'. A complete run
+                          can have failed files, they are listed in failures and the journal is kept so that the
+                          job can be resumed to copy them. With watch the summary of the watch is in watch."""
+        if paramdict.get('archive') and not paramdict.get('resume'):
+            return self.pack(paramdict)
+        if paramdict.get('resume'):
+            # Continue the unfinished job recorded in the destination with its original parameters, the limits given
+            # for the resumed run replace the original ones
+            limits = dict((key, paramdict[key]) for key in throttle_params if key in paramdict)
+            self.journal = Journal.load(paramdict['destdir'])
+            paramdict = dict(self.journal.params)
+            paramdict.update(limits)
+        else:
+            self.journal = Journal.create(paramdict['destdir'], paramdict)
+        self.pathlist = paramdict['filelist']
+        self.destdir = paramdict['destdir']
+        self.flattencount = paramdict['flattencount']
+        self.overwrite = paramdict['overwrite_opt']
+        self.planner = PathPlanner(self.destdir, self.flattencount)
+        self.filters = FileFilter.from_params(paramdict)
+        self.dest_device = os.stat(self.destdir).st_dev
+        self.throttle.configure(paramdict.get('bytes_per_second'), paramdict.get('files_per_second'),
+                                paramdict.get('throttle_schedule'))
+        self.nice = paramdict.get('nice')
+        self.io_class = paramdict.get('io_class')
+        self.workers = max(1, int(paramdict.get('workers', copy_workers)))
+        self.large_workers = max(1, int(paramdict.get('large_workers', large_copy_workers)))
+        self.manifest = None
+        if paramdict.get('incremental'):
+            self.manifest = Manifest.for_destination(self.destdir)
+        self.verifier = None
+        if paramdict.get('verify'):
+            self.verifier = Verifier(self.destdir, paramdict['verify'], paramdict.get('hash_algorithm', 'blake2b'))
+        self.duplicates = None
+        self.dedupe_dests = None
+        self.dedupe = paramdict.get('dedupe')
+        if self.dedupe:
+            self.duplicates = DuplicateIndex()
+            # destination path -> the file last written there
+            self.dedupe_dests = {}
+        self.unchanged_count = 0
+        self.unchanged_size = 0
+        self.dedupe_count = 0
+        self.dedupe_size = 0
+        self.dedupe_skipped_count = 0
+        self.dedupe_skipped_size = 0
+        self.space_saved = 0
+        self.scan_complete = False
+        self.last_report = 0
+        self.metrics = CopyMetrics(keep_timeline=bool(paramdict.get('timeline')))
+        dirstat = FileOperations()
+        available_space = dirstat.get_free_space(self.destdir)
+        scanner = FileOperations(self.metrics, self.filters)
+        filecopy = FileOperations(self.metrics)
+        tickets = DestinationTickets()
+        self.dest_cache = DestinationCache()
+        filequeue = queue.Queue(maxsize=scan_queue_size)
+        scan_thread = threading.Thread(target=self.scan, args=(scanner, filequeue))
+        scan_thread.daemon = True
+        self.listener.copy_progress(0, 0, 0, 0, 0)
+        start_time = time.time()
+        scan_thread.start()
+        pending = set()
+        max_pending = (self.workers + self.large_workers) * 4
+        space_problem = False
+        # Small files and large files go through separate lanes, each with its own pool, so that metadata bound
+        # and bandwidth bound work run side by side. Small files are batched per destination directory.
+        self.retries = RetryQueue(self.retry_file, int(paramdict.get('retries', retry_attempts)), retry_backoff,
+                                  lambda: self.must_run)
+        small_executor = ThreadPoolExecutor(max_workers=self.workers, initializer=self.init_copy_thread)
+        large_executor = ThreadPoolExecutor(max_workers=self.large_workers, initializer=self.init_copy_thread,
+                                            initargs=(large_buffer_size,))
+        batch = []
+        batch_dir = None
+        try:
+            while self.must_run:
+                # The scanned allocated size is a running estimate of the space required, stop as soon as it no
+                # longer fits
+                if scanner.allocated - self.space_saved >= available_space:
+                    space_problem = True
+                    self.must_run = False
+                    break
+                try:
+                    item = filequeue.get(timeout=0.5)
+                except queue.Empty:
+                    # The scan is lagging, don't keep the small files waiting
+                    if batch:
+                        pending.add(small_executor.submit(self.copy_batch, filecopy, tickets, batch))
+                        batch = []
+                    self.report_progress(filecopy, scanner)
+                    continue
+                if item is None:
+                    break
+                destfilepath = self.planner.dest_filepath(item.path)
+                entry = candidates = None
+                if self.duplicates is not None:
+                    entry = DedupeEntry(item, destfilepath)
+                if self.journal.is_done(item.path) or \
+                        (self.manifest is not None and self.manifest.is_unchanged(item, destfilepath)):
+                    self.unchanged_count += 1
+                    self.unchanged_size += item.size
+                    self.space_saved += item.allocated
+                    filecopy.outcomes.record('unchanged')
+                    if entry is not None:
+                        # Already in the destination, later duplicates can link to it
+                        self.duplicates.add(entry)
+                        self.supersede_destination(destfilepath, entry)
+                        entry.finish(True)
+                    continue
+                if entry is not None:
+                    # Only bucketed by size here, the candidates are hashed by the copy task
+                    candidates = self.duplicates.candidates(entry)
+                    self.supersede_destination(destfilepath, entry)
+                ticket = tickets.issue(destfilepath)
+                if item.size >= large_file_size:
+                    pending.add(large_executor.submit(self.copy_file, filecopy, tickets, item, destfilepath, ticket,
+                                                      entry, candidates))
+                else:
+                    destdir = os.path.dirname(destfilepath)
+                    if batch and (destdir != batch_dir or len(batch) >= small_batch_size):
+                        pending.add(small_executor.submit(self.copy_batch, filecopy, tickets, batch))
+                        batch = []
+                    batch_dir = destdir
+                    batch.append((item, destfilepath, ticket, entry, candidates))
+                if len(pending) >= max_pending:
+                    # Submit the open batch before blocking, a queued copy may be waiting on one of its tickets
+                    if batch:
+                        pending.add(small_executor.submit(self.copy_batch, filecopy, tickets, batch))
+                        batch = []
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self.report_progress(filecopy, scanner)
+            if batch and self.must_run:
+                pending.add(small_executor.submit(self.copy_batch, filecopy, tickets, batch))
+            while pending and self.must_run:
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                self.report_progress(filecopy, scanner)
+            # The copy lanes are done, wait for the retry pass
+            self.retries.close()
+            while self.retries.is_alive() and self.must_run:
+                self.retries.join(0.5)
+                self.report_progress(filecopy, scanner)
+        finally:
+            self.retries.close()
+            tickets.cancel()
+            for future in pending:
+                future.cancel()
+            small_executor.shutdown(wait=True)
+            large_executor.shutdown(wait=True)
+            self.retries.join()
+            scan_thread.join()
+            if self.manifest is not None:
+                self.manifest.close()
+            if self.verifier is not None:
+                self.verifier.close()
+        outcomes, failures = filecopy.outcomes.summary()
+        if space_problem or not self.must_run or failures:
+            # Keep the journal so that the job can be resumed
+            self.journal.close()
+        else:
+            self.journal.remove()
+        if self.must_run:
+            self.report_progress(filecopy, scanner, force=True)
+        runtime = time.time() - start_time
+        with filecopy.lock:
+            summary = {'status': 'complete',
+                       'destdir': self.destdir,
+                       'files_found': scanner.filecount,
+                       'bytes_found': scanner.filesize,
+                       'files_excluded': scanner.excluded,
+                       'files_copied': filecopy.filecount,
+                       'bytes_copied': filecopy.filesize,
+                       'files_unchanged': self.unchanged_count,
+                       'bytes_unchanged': self.unchanged_size,
+                       'files_deduplicated': self.dedupe_count,
+                       'bytes_deduplicated': self.dedupe_size,
+                       'available_space': available_space,
+                       'runtime_seconds': runtime,
+                       'bytes_per_second': filecopy.filesize / runtime if runtime > 0 else 0,
+                       'copy_methods': dict(filecopy.copy_methods),
+                       'outcomes': outcomes,
+                       'files_failed': len(failures),
+                       'failures': failures,
+                       'phases': self.metrics.phases()}
+            if self.verifier is not None:
+                summary['files_verified'] = self.verifier.verified
+                summary['verify_failures'] = list(self.verifier.failures)
+        if space_problem:
+            summary['status'] = 'no_space'
+            self.listener.space_problem(scanner.allocated - self.space_saved, available_space)
+        elif not self.must_run:
+            summary['status'] = 'cancelled'
+            log.info('Copy cancelled')
+        else:
+            self.listener.copy_complete(summary)
+            if paramdict.get('watch'):
+                summary['watch'] = self.watch(paramdict, start_time)
+        if paramdict.get('timeline'):
+            self.metrics.dump(paramdict['timeline'], summary)
+        return summary
+
+    def pack(self, paramdict):
+        """Archive mode, stream the selected files into tar volumes in the destination rather than copying them one by
+        one, see archive.ArchiveWriter. The files are stored under their destination path relative to destdir.
+        The scan feeds a single packing thread through the bounded scan queue, so neither the file list nor the data
+        is held in memory. The overwrite, incremental, dedupe, verify and retry options do not apply and the job can
+        not be resumed, a cancelled job leaves the volumes written so far readable.
+        Input:
+            paramdict   : dict - the job parameters, see run.
+        Output:
+            returns     : dict - summary of the run as for run, the volumes are listed in archive"""
+        self.journal = None
+        self.pathlist = paramdict['filelist']
+        self.destdir = paramdict['destdir']
+        self.planner = PathPlanner(self.destdir, paramdict['flattencount'])
+        self.filters = FileFilter.from_params(paramdict)
+        self.throttle.configure(paramdict.get('bytes_per_second'), paramdict.get('files_per_second'),
+                                paramdict.get('throttle_schedule'))
+        self.nice = paramdict.get('nice')
+        self.io_class = paramdict.get('io_class')
+        self.unchanged_count = 0
+        self.unchanged_size = 0
+        self.dedupe_skipped_count = 0
+        self.dedupe_skipped_size = 0
+        self.scan_complete = False
+        self.last_report = 0
+        self.space_problem = False
+        self.pack_error = None
+        self.metrics = CopyMetrics(keep_timeline=bool(paramdict.get('timeline')))
+        name = paramdict.get('archive_name') or time.strftime('mcmover-%Y%m%d-%H%M%S')
+        writer = ArchiveWriter(self.destdir, name, paramdict['archive'] == 'tar.zst', paramdict.get('archive_split'))
+        available_space = FileOperations().get_free_space(self.destdir)
+        scanner = FileOperations(self.metrics, self.filters)
+        filecopy = FileOperations(self.metrics)
+        filequeue = queue.Queue(maxsize=scan_queue_size)
+        scan_thread = threading.Thread(target=self.scan, args=(scanner, filequeue))
+        scan_thread.daemon = True
+        packer = threading.Thread(target=self.pack_files, args=(writer, scanner, filecopy, filequeue,
+                                                                available_space))
+        packer.daemon = True
+        self.listener.copy_progress(0, 0, 0, 0, 0)
+        start_time = time.time()
+        scan_thread.start()
+        packer.start()
+        while packer.is_alive():
+            packer.join(0.5)
+            self.report_progress(filecopy, scanner)
+        if not self.must_run:
+            # The scan may be waiting on the queue
+            scan_thread.join()
+        if self.pack_error is not None:
+            raise self.pack_error
+        if self.must_run:
+            self.report_progress(filecopy, scanner, force=True)
+        runtime = time.time() - start_time
+        outcomes, failures = filecopy.outcomes.summary()
+        with filecopy.lock:
+            summary = {'status': 'complete',
+                       'destdir': self.destdir,
+                       'files_found': scanner.filecount,
+                       'bytes_found': scanner.filesize,
+                       'files_excluded': scanner.excluded,
+                       'files_copied': filecopy.filecount,
+                       'bytes_copied': filecopy.filesize,
+                       'files_unchanged': 0,
+                       'bytes_unchanged': 0,
+                       'files_deduplicated': 0,
+                       'bytes_deduplicated': 0,
+                       'available_space': available_space,
+                       'runtime_seconds': runtime,
+                       'bytes_per_second': filecopy.filesize / runtime if runtime > 0 else 0,
+                       'copy_methods': dict(filecopy.copy_methods),
+                       'outcomes': outcomes,
+                       'files_failed': len(failures),
+                       'failures': failures,
+                       'archive': self.archive,
+                       'phases': self.metrics.phases()}
+        if self.space_problem:
+            summary['status'] = 'no_space'
+            self.listener.space_problem(archive_space(scanner.filecount, scanner.filesize), available_space)
+        elif not self.must_run:
+            summary['status'] = 'cancelled'
+            log.info('Packing cancelled')
+        else:
+            self.listener.copy_complete(summary)
+        if paramdict.get('timeline'):
+            self.metrics.dump(paramdict['timeline'], summary)
+        return summary
+
+    def pack_files(self, writer, scanner, filecopy, filequeue, available_space):
+        """Packing thread of the archive mode, add the scanned files to the archive in scan order.
+        Input:
+            writer          : ArchiveWriter - the archive, closed once the scan is complete or the job stops.
+            scanner         : FileOperations - scanner instance holding the running totals.
+            filecopy        : FileOperations - instance used to tally the packed files.
+            filequeue       : Queue - bounded queue fed by the scan.
+            available_space : integer - bytes available in the destination.
+        Output:
+            None, an error writing the archive is left in pack_error"""
+        set_thread_priority(self.nice, self.io_class)
+        keep_running = lambda: self.must_run
+        throttle = lambda count: self.throttle.consume_bytes(count, keep_running)
+        try:
+            while self.must_run:
+                # The archive stores sparse files at their full size, less once compressed
+                if archive_space(scanner.filecount, scanner.filesize) >= available_space:
+                    self.space_problem = True
+                    self.must_run = False
+                    break
+                try:
+                    meta = filequeue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if meta is None:
+                    break
+                arcname = os.path.relpath(self.planner.dest_filepath(meta.path), self.destdir)
+                self.throttle.consume_file(keep_running)
+                self.metrics.current_file = meta.path
+                try:
+                    with self.metrics.phase('copy'):
+                        size = writer.add(meta.path, arcname, throttle if self.throttle.limits_bytes() else None)
+                except OSError as err:
+                    log.error("Error encountered while archiving %s", meta.path, exc_info=True)
+                    filecopy.outcomes.record_failure(meta.path, arcname, err)
+                    continue
+                with filecopy.lock:
+                    filecopy.filesize += size
+                    filecopy.filecount += 1
+                    filecopy.copy_methods['archive'] = filecopy.copy_methods.get('archive', 0) + 1
+                filecopy.outcomes.record('copied', meta.path, arcname)
+        except ArchiveError as err:
+            log.error('Archive failed: %s', err)
+            self.pack_error = err
+            self.must_run = False
+        finally:
+            self.archive = writer.close()
+
+    def watch(self, paramdict, since):
+        """Watch mode, keep the selected paths under watch once the copy is complete and copy the new and modified
+        files until the run is cancelled.
+        The changes are coalesced, see watch.ChangeSet, and the files go through the same destination path, overwrite
+        and retry handling as the copy. The journal, the destination cache and dedupe are not used, the manifest and
+        verification are. The destination is not watched when it lies inside a selected directory.
+        Input:
+            paramdict   : dict - the job parameters, see run.
+            since       : float - time the copy started, the files changed since are checked first as they may
+                          have been changed after the scan went past them.
+        Output:
+            returns     : dict - summary of the watch, see watch_snapshot"""
+        self.journal = None
+        self.dest_cache = None
+        self.manifest = None
+        if paramdict.get('incremental'):
+            self.manifest = Manifest.for_destination(self.destdir)
+        self.verifier = None
+        if paramdict.get('verify'):
+            self.verifier = Verifier(self.destdir, paramdict['verify'], paramdict.get('hash_algorithm', 'blake2b'))
+        roots = FileOperations().collapse_paths(self.pathlist)
+        if self.filters is not None and self.filters.min_age:
+            # The files the copy skipped as too recent are picked up once they are old enough
+            since -= self.filters.min_age
+        watcher = open_watcher(roots, since, paramdict.get('watch_interval'), self.destdir, self.filters)
+        log.info('Watching %s paths with %s', len(roots), watcher.kind)
+        changes = ChangeSet(paramdict.get('watch_settle', settle_seconds))
+        filecopy = FileOperations(self.metrics)
+        tickets = DestinationTickets()
+        self.retries = RetryQueue(self.retry_file, int(paramdict.get('retries', retry_attempts)), retry_backoff,
+                                  lambda: self.must_run)
+        executor = ThreadPoolExecutor(max_workers=self.workers, initializer=self.init_copy_thread)
+        try:
+            while self.must_run:
+                timeout = wakeup_interval
+                if changes.next_due() is not None:
+                    timeout = min(timeout, max(0, changes.next_due() - time.time()))
+                try:
+                    for path, changed in watcher.changes(timeout):
+                        changes.add(path, changed)
+                        if len(changes) >= max_pending_changes:
+                            # Hold the watcher back until the oldest changes are due, the memory used stays bounded
+                            time.sleep(max(0, changes.next_due() - time.time()))
+                            self.sync_changes(filecopy, tickets, executor, changes, watcher)
+                        if not self.must_run:
+                            break
+                except WatchError as err:
+                    log.warning('%s, polling the sources instead', err)
+                    watcher.close()
+                    watcher = PollingWatcher(roots, watcher.last_read - changes.settle,
+                                             paramdict.get('watch_interval') or poll_interval, self.destdir,
+                                             self.filters)
+                self.sync_changes(filecopy, tickets, executor, changes, watcher)
+        finally:
+            watcher.close()
+            self.retries.close()
+            tickets.cancel()
+            executor.shutdown(wait=True)
+            self.retries.join()
+            if self.manifest is not None:
+                self.manifest.close()
+            if self.verifier is not None:
+                self.verifier.close()
+        return self.watch_snapshot(filecopy, watcher)
+
+    def sync_changes(self, filecopy, tickets, executor, changes, watcher):
+        """Watch mode, copy the changed files that are due, in batches.
+        Input:
+            filecopy    : FileOperations - instance used to tally the synced files.
+            tickets     : DestinationTickets - destination ordering shared by the copy tasks.
+            executor    : ThreadPoolExecutor - the copy threads.
+            changes     : ChangeSet - the pending changes.
+            watcher     : InotifyWatcher or PollingWatcher - the watcher of the selected paths.
+        Output:
+            None, the listener is notified after each batch"""
+        paths = changes.due()
+        while paths and self.must_run:
+            pending = set()
+            for path in paths:
+                meta = FileMeta.from_path(path)
+                if meta is None or not stat.S_ISREG(meta.mode):
+                    # Removed or replaced by a directory since
+                    continue
+                if self.filters is not None and not self.filters.accepts_stat(meta.size, meta.mtime):
+                    accepted = self.filters.accepted_from(meta.size, meta.mtime)
+                    if accepted is not None:
+                        # Younger than min_age, synced once it is old enough
+                        changes.defer(path, accepted)
+                    continue
+                if meta.mtime + changes.settle > time.time():
+                    # Still being written to, found by a walk rather than a close event
+                    changes.add(path, meta.mtime)
+                    continue
+                destfilepath = self.planner.dest_filepath(path)
+                if self.manifest is not None and self.manifest.is_unchanged(meta, destfilepath):
+                    filecopy.outcomes.record('unchanged')
+                    continue
+                ticket = tickets.issue(destfilepath)
+                pending.add(executor.submit(self.copy_file, filecopy, tickets, meta, destfilepath, ticket))
+            while pending and self.must_run:
+                done, pending = wait(pending, timeout=0.5)
+            self.listener.watch_sync(self.watch_snapshot(filecopy, watcher))
+            paths = changes.due()
+
+    def watch_snapshot(self, filecopy, watcher):
+        """Return the totals of the watch so far.
+        Input:
+            filecopy    : FileOperations - instance holding the synced file totals.
+            watcher     : InotifyWatcher or PollingWatcher - the watcher of the selected paths.
+        Output:
+            returns     : dict - watcher ('inotify' or 'polling'), files_copied, bytes_copied, copy_methods, outcomes,
+                          files_failed and failures"""
+        outcomes, failures = filecopy.outcomes.summary()
+        with filecopy.lock:
+            return {'watcher': watcher.kind,
+                    'files_copied': filecopy.filecount,
+                    'bytes_copied': filecopy.filesize,
+                    'copy_methods': dict(filecopy.copy_methods),
+                    'outcomes': outcomes,
+                    'files_failed': len(failures),
+                    'failures': failures}
+
+    def report_progress(self, filecopy, scanner, force=False):
+        """Report the totals gathered so far by the worker pool to the listener.
+        Progress is aggregated here and published at most every progress_interval seconds, however often the copy
+        stage completes files, so that a large number of small files does not flood the listener.
+        While the scan is still running the totals are estimates that grow as files are found.
+        Input:
+            filecopy    : FileOperations - shared instance holding the copied file totals.
+            scanner     : FileOperations - scanner instance holding the running totals.
+            force       : bool - report even if the last report is more recent than progress_interval.
+        Output:
+            None, the listener is notified"""
+        now = time.time()
+        if not force and now - self.last_report < progress_interval:
+            return
+        self.last_report = now
+        with filecopy.lock:
+            copied_size = filecopy.filesize + self.unchanged_size + self.dedupe_skipped_size
+            copied_count = filecopy.filecount + self.unchanged_count + self.dedupe_skipped_count
+        filesize = scanner.filesize
+        filecount = scanner.filecount
+        if filesize > 0:
+            progress_percent = int((float(copied_size) / float(filesize)) * 100)
+        else:
+            progress_percent = 100 if self.scan_complete else 0
+        log.debug('Progress %s%%, %s/%s files, %s/%s bytes', progress_percent, copied_count, filecount,
+                  copied_size, filesize)
+        if self.must_run:
+            self.listener.copy_progress(progress_percent, copied_count, filecount, copied_size, filesize)
+            self.listener.copy_metrics(self.metrics.snapshot(copied_size, copied_count, filesize, filecount,
+                                                             self.scan_complete))
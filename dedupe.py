@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import os
+import hashlib
+import threading
+
+import verify
+
+dedupe_modes = ('link', 'skip')
+partial_size = 64 * 1024
+
+
+class DedupeEntry():
+    """A file taking part in the deduplication, with its hashes computed on first use and cached.
+    Once the copy of the file is done the entry records if its destination holds the content of the source,
+    duplicates of the file wait for this before linking to the destination. Once a later file is written to the same
+    destination the entry is superseded and no more links are made to it."""
+    __slots__ = ('meta', 'destination', 'partial_digest', 'full_digest', 'done', 'linkable', 'superseded', 'lock',
+                 'original')
+
+    def __init__(self, meta, destination):
+        self.meta = meta
+        self.destination = destination
+        self.partial_digest = None
+        self.full_digest = None
+        self.done = threading.Event()
+        self.linkable = False
+        self.superseded = False
+        self.lock = threading.Lock()
+        # The earlier file with the same content, once the file is found to be a duplicate
+        self.original = None
+
+    def partial_hash(self):
+        """Hash the first and last blocks of the file, enough to tell most files of the same size apart.
+        Files of up to two blocks are hashed whole.
+        Input:
+            None
+        Output:
+            returns : string - hex digest"""
+        if self.partial_digest is None:
+            hasher = hashlib.blake2b()
+            with open(self.meta.path, 'rb') as handle:
+                if self.meta.size <= partial_size * 2:
+                    hasher.update(handle.read(partial_size * 2))
+                else:
+                    hasher.update(handle.read(partial_size))
+                    handle.seek(-partial_size, os.SEEK_END)
+                    hasher.update(handle.read(partial_size))
+            self.partial_digest = hasher.hexdigest()
+        return self.partial_digest
+
+    def full_hash(self):
+        """Hash the whole file.
+        Input:
+            None
+        Output:
+            returns : string - hex digest"""
+        if self.full_digest is None:
+            if self.meta.size <= partial_size * 2:
+                # The partial hash already covers the whole file
+                self.full_digest = self.partial_hash()
+            else:
+                self.full_digest = verify.hash_file(self.meta.path, 'blake2b')
+        return self.full_digest
+
+    def finish(self, linkable):
+        """Mark the copy of the file as done and wake up its duplicates.
+        Input:
+            linkable    : bool - True if the destination now holds the content of the source.
+        Output:
+            None"""
+        self.linkable = linkable
+        self.done.set()
+
+    def supersede(self):
+        """Stop linking to the destination, called before a later file is written to it. A link being made is
+        completed first, the later file then replaces the linked destination rather than writing through the link.
+        Input:
+            None
+        Output:
+            None"""
+        with self.lock:
+            self.superseded = True
+
+    def link(self, path):
+        """Hard link a path to the destination of the file, unless a later file is written to the destination.
+        Input:
+            path    : string - the path of the new link.
+        Output:
+            returns : bool - False if the destination is superseded
+        Raises:
+            OSError if the link can not be made"""
+        with self.lock:
+            if self.superseded:
+                return False
+            os.link(self.destination, path)
+            return True
+
+    def wait(self, keep_running=None):
+        """Wait for the copy of the file to be done.
+        Input:
+            keep_running: callable - polled while waiting, the wait is interrupted when it returns False.
+        Output:
+            returns     : bool - True if the destination can be linked to"""
+        while not self.done.wait(0.5):
+            if keep_running is not None and not keep_running():
+                return False
+        return self.linkable
+
+
+class DuplicateIndex():
+    """Find the files with the same content among the scanned files.
+    Files are bucketed by size as they are scanned, which is cheap enough for the scan loop, and are only hashed
+    when another file of the same size was found before them. The hashing is left to the copy threads, see match.
+    Candidates are compared on a partial hash of the first and last blocks, then on a full hash, so most files are
+    never read in full. Empty files are not deduplicated."""
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def add(self, entry):
+        """Add a file to the index without checking it, for files already in the destination.
+        Input:
+            entry   : DedupeEntry - the file.
+        Output:
+            None"""
+        if entry.meta.size > 0:
+            with self.lock:
+                self.buckets.setdefault(entry.meta.size, []).append(entry)
+
+    def candidates(self, entry):
+        """Add a file to the index and return the earlier files of the same size, without reading any of them.
+        Input:
+            entry   : DedupeEntry - the file.
+        Output:
+            returns : list - the earlier DedupeEntry of the same size, in scan order"""
+        if entry.meta.size == 0:
+            return []
+        with self.lock:
+            bucket = self.buckets.setdefault(entry.meta.size, [])
+            candidates = list(bucket)
+            bucket.append(entry)
+        return candidates
+
+    def match(self, entry, candidates=None):
+        """Return the earlier file with the same content as entry.
+        Input:
+            entry       : DedupeEntry - the file.
+            candidates  : list - the earlier files of the same size returned by candidates, entry is added to the
+                          index and compared with them if omitted.
+        Output:
+            returns     : DedupeEntry - the earlier file, the first copy of the content if the earlier file was found
+                          to be a duplicate itself, None if the content was not seen before"""
+        if candidates is None:
+            candidates = self.candidates(entry)
+        try:
+            for candidate in candidates:
+                if candidate.partial_hash() == entry.partial_hash() and candidate.full_hash() == entry.full_hash():
+                    return candidate.original or candidate
+        except (IOError, OSError):
+            # A file that can not be read is left to the copy, which reports the error
+            pass
+        return None
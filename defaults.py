@@ -0,0 +1,5 @@
+#!/usr/bin/env python
+
+# Defaults of the copy jobs, kept apart from the copy engine so that the gui can read them without importing it
+copy_workers = 4
+large_copy_workers = 2
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import threading
+
+# Copies running at the same time on a device of each class, None for no limit
+device_streams = {'hdd': 2, 'network': 4, 'ssd': None, 'other': None}
+network_filesystems = set(['nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'afs', 'ceph', 'glusterfs', 'fuse.sshfs',
+                           'fuse.glusterfs', '9p'])
+
+_classes = {}
+_classes_lock = threading.Lock()
+
+
+def _mount_types():
+    """Return the filesystem type of each mounted device, from /proc/self/mountinfo."""
+    types = {}
+    try:
+        with open('/proc/self/mountinfo') as handle:
+            for line in handle:
+                fields = line.split()
+                separator = fields.index('-')
+                types[fields[2]] = fields[separator + 1]
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return types
+
+
+def _is_rotational(major, minor):
+    """Check the rotational flag of a block device in sysfs, partitions use the flag of their disk."""
+    devpath = os.path.realpath('/sys/dev/block/%s:%s' % (major, minor))
+    for path in (devpath, os.path.dirname(devpath)):
+        try:
+            with open(os.path.join(path, 'queue', 'rotational')) as handle:
+                return handle.read().strip() == '1'
+        except (IOError, OSError):
+            continue
+    return None
+
+
+def device_class(device):
+    """Classify a device, the result is cached.
+    Only Linux is detected, other platforms report every device as 'other'.
+    Input:
+        device  : int - st_dev of a file on the device.
+    Output:
+        returns : string - 'hdd', 'ssd', 'network' or 'other'"""
+    with _classes_lock:
+        if device in _classes:
+            return _classes[device]
+    kind = 'other'
+    if sys.platform.startswith('linux') and device:
+        major, minor = os.major(device), os.minor(device)
+        if _mount_types().get('%s:%s' % (major, minor)) in network_filesystems:
+            kind = 'network'
+        else:
+            rotational = _is_rotational(major, minor)
+            if rotational is not None:
+                kind = 'hdd' if rotational else 'ssd'
+    with _classes_lock:
+        _classes[device] = kind
+    return kind
+
+
+def locality_order(device):
+    """Check if the files of a device should be read in inode order rather than name order.
+    Inodes are allocated close to their data on most filesystems, reading in inode order keeps the heads of a
+    spinning disk moving in one direction.
+    Input:
+        device  : int - st_dev of the device.
+    Output:
+        returns : bool"""
+    return device_class(device) == 'hdd'
+
+
+class DeviceSlots():
+    """Context manager holding the slots of a copy on its source and destination devices."""
+    __slots__ = ('semaphores',)
+
+    def __init__(self, semaphores):
+        self.semaphores = semaphores
+
+    def __enter__(self):
+        for semaphore in self.semaphores:
+            semaphore.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for semaphore in reversed(self.semaphores):
+            semaphore.release()
+        return False
+
+
+class DeviceScheduler():
+    """Limit the number of copies running at the same time on each device.
+    Spinning disks and network shares lose throughput when too many streams compete for them, so copies reading
+    from or writing to them take a slot of the device first. SSDs and other devices are not limited and independent
+    devices never wait on each other. One scheduler can be shared by several jobs so that jobs using the same
+    device share its slots."""
+    def __init__(self, streams=None):
+        if streams is None:
+            streams = device_streams
+        self.streams = streams
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def semaphore(self, device):
+        """Return the semaphore limiting a device, None if the device is not limited.
+        Input:
+            device  : int - st_dev of the device.
+        Output:
+            returns : threading.Semaphore or None"""
+        with self.lock:
+            if device in self.semaphores:
+                return self.semaphores[device]
+        limit = self.streams.get(device_class(device))
+        with self.lock:
+            if device not in self.semaphores:
+                self.semaphores[device] = threading.Semaphore(limit) if limit else None
+            return self.semaphores[device]
+
+    def slots(self, source_device, dest_device):
+        """Return a context manager holding a slot on the source and destination devices of a copy.
+        The slots are always taken in device order so that copies going opposite ways can not deadlock.
+        Input:
+            source_device   : int - st_dev of the source file.
+            dest_device     : int - st_dev of the destination.
+        Output:
+            returns         : DeviceSlots"""
+        semaphores = []
+        for device in sorted(set([source_device, dest_device])):
+            semaphore = self.semaphore(device)
+            if semaphore is not None:
+                semaphores.append(semaphore)
+        return DeviceSlots(semaphores)
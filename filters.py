@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+import os
+import re
+import time
+import fnmatch
+
+age_units = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+# Operating system clutter, thumbnails, temp files and caches, excluded by the junk option
+junk_patterns = ('.DS_Store', '._*', '.Spotlight-V100/', '.Trashes/', '.fseventsd/', 'Thumbs.db', 'ehthumbs.db',
+                 'desktop.ini', '$RECYCLE.BIN/', '.thumbnails/', '*.tmp', '*.temp', '~$*', '*~', '*.swp',
+                 '__pycache__/', '*.pyc', '.cache/')
+filter_params = ('include', 'exclude', 'exclude_junk', 'min_size', 'max_size', 'min_age', 'max_age')
+
+
+def parse_age(text):
+    """Parse an age such as 90, 30m, 12h, 7d or 2w.
+    Input:
+        text    : string - a number optionally followed by s, m, h, d or w.
+    Output:
+        returns : int - the age in seconds"""
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*$', text, re.IGNORECASE)
+    if match is None:
+        raise ValueError('Invalid age %s' % text)
+    return int(float(match.group(1)) * age_units[match.group(2).lower()])
+
+
+def split_patterns(text):
+    """Split the patterns typed in the gui, separated by semicolons.
+    Input:
+        text    : string - the patterns.
+    Output:
+        returns : list"""
+    return [pattern.strip() for pattern in text.split(';') if pattern.strip()]
+
+
+class PatternSet():
+    """A list of patterns compiled into one regular expression for the names and one for the paths."""
+    __slots__ = ('names', 'paths')
+
+    def __init__(self, patterns):
+        flags = re.IGNORECASE if os.name == 'nt' else 0
+        names = []
+        paths = []
+        for pattern in patterns:
+            if pattern.startswith('re:'):
+                paths.append('(?:%s)' % pattern[3:])
+            elif '/' in pattern:
+                if not pattern.startswith(('/', '*')) and not os.path.isabs(pattern):
+                    # A relative path matches at any depth
+                    pattern = '*/' + pattern
+                paths.append('^(?:%s)' % fnmatch.translate(pattern))
+            else:
+                names.append('(?:%s)' % fnmatch.translate(pattern))
+        try:
+            self.names = re.compile('|'.join(names), flags) if names else None
+            self.paths = re.compile('|'.join(paths), flags) if paths else None
+        except re.error as err:
+            raise ValueError('Invalid pattern: %s' % err)
+
+    def matches(self, path, name):
+        """Check a file or directory against the patterns.
+        Input:
+            path    : string - the full path.
+            name    : string - the name, the last part of the path.
+        Output:
+            returns : bool"""
+        if self.names is not None and self.names.match(name):
+            return True
+        if self.paths is not None:
+            if os.sep != '/':
+                path = path.replace(os.sep, '/')
+            return self.paths.search(path) is not None
+        return False
+
+
+class FileFilter():
+    """Include and exclude rules of a job, compiled once and applied while the selection is walked.
+    Patterns are globs matched against the name of a file or directory, or against its whole path with / separators
+    when they contain a /; a relative path pattern such as build/*.o matches at any depth. A pattern ending with /
+    only matches directories and a pattern starting with re: is a regular expression searched in the whole path.
+    Excluded directories are pruned, their content is never listed. Include patterns and the size and age limits
+    only apply to files, a file is kept if it matches one of the include patterns. The scan, the sizing, the preview
+    and the watch mode share the rules so that they all see the same files."""
+    def __init__(self, include=None, exclude=None, exclude_junk=False, min_size=None, max_size=None, min_age=None,
+                 max_age=None, now=None):
+        include = list(include or [])
+        exclude = list(exclude or [])
+        if exclude_junk:
+            exclude.extend(junk_patterns)
+        for pattern in include:
+            if pattern.endswith('/'):
+                raise ValueError('Include patterns only apply to files, %s matches directories' % pattern)
+        self.include = PatternSet(include) if include else None
+        self.exclude = PatternSet([pattern for pattern in exclude if not pattern.endswith('/')])
+        self.exclude_dirs = PatternSet([pattern.rstrip('/') for pattern in exclude if pattern.endswith('/')])
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_age = min_age
+        self.max_age = max_age
+        # The ages are measured from now, from the time of each check if omitted so that a filter reused by the watch
+        # mode keeps accepting the files as they age
+        self.now = now
+        # Identifies the rules in the sizing cache, the results of age limits change with time so are not cached
+        self.key = (tuple(include), tuple(exclude), min_size, max_size)
+        self.cacheable = min_age is None and max_age is None
+
+    @classmethod
+    def from_params(cls, paramdict):
+        """Build the filter of a job.
+        Input:
+            paramdict   : dict - the job parameters, see CopyEngine.run.
+        Output:
+            returns     : FileFilter, None if the job has no rules"""
+        if not any(paramdict.get(key) for key in filter_params):
+            return None
+        return cls(paramdict.get('include'), paramdict.get('exclude'), paramdict.get('exclude_junk'),
+                   paramdict.get('min_size'), paramdict.get('max_size'), paramdict.get('min_age'),
+                   paramdict.get('max_age'))
+
+    def excludes_dir(self, path, name):
+        """Check if a directory is pruned.
+        Input:
+            path    : string - the full path of the directory.
+            name    : string - the name of the directory.
+        Output:
+            returns : bool"""
+        return self.exclude.matches(path, name) or self.exclude_dirs.matches(path, name)
+
+    def excludes_file(self, path, name):
+        """Check if a file is excluded by the patterns, before it is stat'ed.
+        Input:
+            path    : string - the full path of the file.
+            name    : string - the name of the file.
+        Output:
+            returns : bool"""
+        if self.exclude.matches(path, name):
+            return True
+        return self.include is not None and not self.include.matches(path, name)
+
+    def accepts_stat(self, size, mtime):
+        """Check a file against the size and age limits.
+        Input:
+            size    : int - the size of the file.
+            mtime   : float - the modified time of the file.
+        Output:
+            returns : bool"""
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        if self.min_age is None and self.max_age is None:
+            return True
+        now = time.time() if self.now is None else self.now
+        if self.min_age is not None and now - mtime < self.min_age:
+            return False
+        if self.max_age is not None and now - mtime > self.max_age:
+            return False
+        return True
+
+    def accepted_from(self, size, mtime):
+        """Return the time from which a file unchanged since is accepted by the size and age limits.
+        Input:
+            size    : int - the size of the file.
+            mtime   : float - the modified time of the file.
+        Output:
+            returns : float - time since the epoch, None if the file is never accepted"""
+        if self.min_size is not None and size < self.min_size:
+            return None
+        if self.max_size is not None and size > self.max_size:
+            return None
+        accepted = mtime + (self.min_age or 0)
+        if self.max_age is not None and max(accepted, time.time()) - mtime > self.max_age:
+            return None
+        return accepted
+
+    def accepts(self, path, st):
+        """Check a file against all the rules.
+        Input:
+            path    : string - the full path of the file.
+            st      : os.stat_result - the stat of the file.
+        Output:
+            returns : bool"""
+        return not self.excludes_file(path, os.path.basename(path)) and self.accepts_stat(st.st_size, st.st_mtime)
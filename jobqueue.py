@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+import os
+import json
+import heapq
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+
+from copyengine import CopyEngine, EngineListener
+from sizing import DirectorySizer
+from devices import DeviceScheduler
+
+log = logging.getLogger(__name__)
+
+max_running_jobs = 1
+# Finished jobs kept for the status requests, the oldest are dropped past this
+max_finished_jobs = 100
+if os.name == 'nt':
+    default_endpoint = 'tcp://127.0.0.1:5556'
+else:
+    default_endpoint = 'ipc:///tmp/mcmover_jobs'
+request_timeout = 5.0
+
+
+def _zmq():
+    """Import zmq on first use, it is slow to import and only the job endpoint needs it.
+    Output:
+        returns : module - zmq, None if it is not installed"""
+    try:
+        import zmq
+    except ImportError:
+        return None
+    return zmq
+
+
+class JobQueueError(Exception):
+    """Raised when a request to a job endpoint fails."""
+    pass
+
+
+class Job():
+    """A copy job and its state: queued, running, then complete, cancelled, no_space or failed."""
+    def __init__(self, job_id, params, priority, listener):
+        self.job_id = job_id
+        self.params = params
+        self.priority = priority
+        self.listener = listener
+        self.state = 'queued'
+        self.engine = None
+        self.summary = None
+        self.progress = (0, 0, 0, 0, 0)
+        self.finished = threading.Event()
+
+    def destdir(self):
+        return self.params.get('destdir')
+
+    def status(self):
+        """Return the state of the job.
+        Input:
+            None
+        Output:
+            returns : dict - job, priority, state, destdir, progress_percent, files_done, files_found and the summary
+                      once the job has finished"""
+        progress_percent, copied_count, filecount, copied_size, filesize = self.progress
+        return {'job': self.job_id, 'priority': self.priority, 'state': self.state, 'destdir': self.destdir(),
+                'progress_percent': progress_percent, 'files_done': copied_count, 'files_found': filecount,
+                'summary': self.summary}
+
+
+class JobTracker(EngineListener):
+    """Record the progress of a job and pass the notifications on to the listener of the job."""
+    def __init__(self, job):
+        self.job = job
+        self.listener = job.listener
+
+    def copy_progress(self, progress_percent, copied_count, filecount, copied_size, filesize):
+        self.job.progress = (progress_percent, copied_count, filecount, copied_size, filesize)
+        self.listener.copy_progress(progress_percent, copied_count, filecount, copied_size, filesize)
+
+    def copy_metrics(self, snapshot):
+        self.listener.copy_metrics(snapshot)
+
+    def preflight_progress(self, filecount, filesize):
+        self.listener.preflight_progress(filecount, filesize)
+
+    def space_problem(self, required_space, available_space):
+        self.listener.space_problem(required_space, available_space)
+
+    def copy_complete(self, summary):
+        self.listener.copy_complete(summary)
+
+    def job_failed(self, summary):
+        self.listener.job_failed(summary)
+
+    def watch_sync(self, snapshot):
+        self.listener.watch_sync(snapshot)
+
+
+class JobQueue():
+    """Queue of copy jobs run by a fixed number of runner threads.
+    The job with the highest priority runs first, jobs of the same priority run in the order they were submitted.
+    With one runner the jobs run one after the other, with more they run concurrently, except that jobs copying
+    to the same destination always run one at a time as they share its journal and manifest. The jobs share a
+    DeviceScheduler so that concurrent jobs reading or writing the same disk share its copy slots."""
+    def __init__(self, max_jobs=max_running_jobs, sizer=None, scheduler=None):
+        if sizer is None:
+            sizer = DirectorySizer()
+        if scheduler is None:
+            scheduler = DeviceScheduler()
+        self.sizer = sizer
+        self.scheduler = scheduler
+        self.jobs = OrderedDict()
+        self.queued = []
+        self.busy = set()
+        self.counter = itertools.count(1)
+        self.must_run = True
+        self.condition = threading.Condition()
+        self.runners = []
+        for index in range(max(1, max_jobs)):
+            runner = threading.Thread(target=self.run_jobs)
+            runner.daemon = True
+            runner.start()
+            self.runners.append(runner)
+
+    def submit(self, params, priority=0, listener=None):
+        """Queue a copy job.
+        Input:
+            params      : dict - the job parameters, see CopyEngine.run. With preflight set the selection is sized
+                          first and the job stops if it does not fit, see CopyEngine.preflight.
+            priority    : integer - jobs with a higher priority run first.
+            listener    : EngineListener - receives the notifications of the job.
+        Output:
+            returns     : Job"""
+        if listener is None:
+            listener = EngineListener()
+        with self.condition:
+            job = Job(next(self.counter), params, priority, listener)
+            self.jobs[job.job_id] = job
+            heapq.heappush(self.queued, (-priority, job.job_id, job))
+            self.condition.notify_all()
+        log.info('Job %s queued for %s', job.job_id, job.destdir())
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job.
+        Input:
+            job_id  : integer - the id of the job.
+        Output:
+            returns : bool - False if there is no such job or it has already finished"""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            if job.state == 'queued':
+                self.queued = [entry for entry in self.queued if entry[2] is not job]
+                heapq.heapify(self.queued)
+                job.state = 'cancelled'
+                job.finished.set()
+                self.prune()
+                return True
+            if job.state == 'running':
+                job.engine.must_run = False
+                return True
+        return False
+
+    def get(self, job_id):
+        """Return a job.
+        Input:
+            job_id  : integer - the id of the job.
+        Output:
+            returns : Job or None"""
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    def status(self):
+        """Return the state of all the jobs submitted.
+        Input:
+            None
+        Output:
+            returns : list - see Job.status"""
+        with self.condition:
+            jobs = list(self.jobs.values())
+        return [job.status() for job in jobs]
+
+    def shutdown(self, cancel=True):
+        """Stop the runner threads once the running jobs are done.
+        Input:
+            cancel  : bool - cancel the running and queued jobs.
+        Output:
+            None"""
+        with self.condition:
+            self.must_run = False
+            if cancel:
+                for job in list(self.jobs.values()):
+                    if job.state in ('queued', 'running'):
+                        self.cancel(job.job_id)
+            self.condition.notify_all()
+        for runner in self.runners:
+            runner.join()
+
+    def prune(self):
+        """Forget the oldest finished jobs past max_finished_jobs, so that a long running queue does not grow without
+        bound. Called with the condition held.
+        Input:
+            None
+        Output:
+            None"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished.is_set()]
+        for job_id in finished[:max(0, len(finished) - max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    def next_job(self):
+        """Wait for the next job that can run, None once the queue is shut down."""
+        with self.condition:
+            while self.must_run:
+                for entry in sorted(self.queued):
+                    job = entry[2]
+                    if job.destdir() not in self.busy:
+                        self.queued.remove(entry)
+                        heapq.heapify(self.queued)
+                        self.busy.add(job.destdir())
+                        job.engine = CopyEngine(JobTracker(job), self.sizer, self.scheduler)
+                        job.state = 'running'
+                        return job
+                self.condition.wait()
+            return None
+
+    def run_jobs(self):
+        """Runner thread, run the queued jobs until the queue is shut down."""
+        while True:
+            job = self.next_job()
+            if job is None:
+                return
+            log.info('Job %s started', job.job_id)
+            try:
+                if not job.params.get('preflight') or job.engine.preflight(job.params):
+                    job.summary = job.engine.run(job.params)
+                elif job.engine.must_run:
+                    job.summary = {'status': 'no_space', 'destdir': job.destdir()}
+                else:
+                    job.summary = {'status': 'cancelled', 'destdir': job.destdir()}
+                job.state = job.summary['status']
+            except Exception as err:
+                log.error('Job %s failed', job.job_id, exc_info=True)
+                job.summary = {'status': 'failed', 'destdir': job.destdir(), 'error': str(err)}
+                job.state = 'failed'
+                try:
+                    job.listener.job_failed(job.summary)
+                except Exception:
+                    log.error('Job %s listener failed', job.job_id, exc_info=True)
+            log.info('Job %s finished: %s', job.job_id, job.state)
+            with self.condition:
+                self.busy.discard(job.destdir())
+                job.finished.set()
+                self.prune()
+                self.condition.notify_all()
+
+
+class JobServer(threading.Thread):
+    """IPC endpoint accepting jobs from other processes, such as scripts or a second instance of the program.
+    Requests and replies are JSON objects over a zeromq REP socket:
+        {'action': 'submit', 'params': {...}, 'priority': 0}    -> {'job': id}
+        {'action': 'status'}                                   -> {'jobs': [...]}
+        {'action': 'cancel', 'job': id}                        -> {'cancelled': bool}"""
+    def __init__(self, jobs, endpoint=default_endpoint):
+        zmq = _zmq()
+        if zmq is None:
+            raise ValueError('The zmq package is required for the job endpoint')
+        super(JobServer, self).__init__()
+        self.daemon = True
+        self.jobs = jobs
+        self.endpoint = endpoint
+        self.must_run = True
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.REP)
+        self.socket.bind(endpoint)
+        self.start()
+
+    def run(self):
+        try:
+            while self.must_run:
+                if not self.socket.poll(500):
+                    continue
+                try:
+                    reply = self.handle(json.loads(self.socket.recv()))
+                except Exception as err:
+                    log.error('Invalid job request', exc_info=True)
+                    reply = {'error': str(err)}
+                self.socket.send(json.dumps(reply).encode('utf-8'))
+        finally:
+            self.socket.close(linger=0)
+
+    def handle(self, request):
+        """Process a request.
+        Input:
+            request : dict - the decoded request.
+        Output:
+            returns : dict - the reply"""
+        action = request.get('action')
+        if action == 'submit':
+            job = self.jobs.submit(request['params'], int(request.get('priority', 0)))
+            return {'job': job.job_id}
+        if action == 'status':
+            return {'jobs': self.jobs.status()}
+        if action == 'cancel':
+            return {'cancelled': self.jobs.cancel(int(request['job']))}
+        raise ValueError('Unknown action %s' % action)
+
+    def close(self):
+        """Stop serving requests.
+        Input:
+            None
+        Output:
+            None"""
+        self.must_run = False
+        self.join()
+
+
+def send_request(endpoint, request, timeout=request_timeout):
+    """Send a request to a job endpoint and return the reply.
+    Input:
+        endpoint    : string - the endpoint of the JobServer.
+        request     : dict - the request, see JobServer.
+        timeout     : float - seconds to wait for the reply.
+    Output:
+        returns     : dict - the reply
+    Raises:
+        JobQueueError if the endpoint does not reply or reports an error"""
+    zmq = _zmq()
+    if zmq is None:
+        raise JobQueueError('The zmq package is required to reach a job endpoint')
+    socket = zmq.Context.instance().socket(zmq.REQ)
+    try:
+        socket.connect(endpoint)
+        socket.send(json.dumps(request).encode('utf-8'))
+        if not socket.poll(int(timeout * 1000)):
+            raise JobQueueError('No reply from %s' % endpoint)
+        reply = json.loads(socket.recv())
+    finally:
+        socket.close(linger=0)
+    if 'error' in reply:
+        raise JobQueueError(reply['error'])
+    return reply
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import threading
+
+journal_name = '.mcmover_journal'
+journal_batch = 1000
+journal_interval = 5.0
+
+
+class Journal():
+    """Checkpoint journal of a copy job, used to resume the job after a cancel or a crash.
+    The journal is an append-only file of JSON lines kept in the root of the destination. The first line holds
+    the job parameters, the following lines hold batches of completed source files and a snapshot of the byte
+    offsets reached by the large files being copied. Lines are written and fsync'ed in batches to keep the cost low,
+    on a crash at most the last batch is lost and those files are copied again."""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.params = {}
+        self.started = time.time()
+        self.done = set()
+        self.partial = {}
+        self.pending = []
+        self.partial_changed = False
+        self.last_flush = time.time()
+        self.handle = None
+
+    @classmethod
+    def path_for_destination(cls, destdir):
+        """Return the path of the journal kept in the root of a destination directory.
+        Input:
+            destdir : string - the destination directory of the copy.
+        Output:
+            returns : string"""
+        return os.path.join(destdir, journal_name)
+
+    @classmethod
+    def exists(cls, destdir):
+        """Check if a destination directory has an unfinished job to resume.
+        Input:
+            destdir : string - the destination directory of the copy.
+        Output:
+            returns : bool"""
+        return os.path.isfile(cls.path_for_destination(destdir))
+
+    @classmethod
+    def create(cls, destdir, params):
+        """Start a new journal for a job, any previous journal in the destination is replaced.
+        The large files left partly copied by the previous job are carried over, so that they are copied again, from
+        their checkpoint, rather than taken as complete by the overwrite options.
+        Input:
+            destdir : string - the destination directory of the copy.
+            params  : dict - the job parameters, as sent to the CopyWorker.
+        Output:
+            returns : Journal"""
+        partial = {}
+        if cls.exists(destdir):
+            try:
+                previous = cls.load(destdir)
+            except (IOError, OSError):
+                pass
+            else:
+                previous.handle.close()
+                partial = previous.partial
+        journal = cls(cls.path_for_destination(destdir))
+        journal.params = params
+        journal.partial = partial
+        journal.handle = open(journal.path, 'w')
+        journal._write({'job': params, 'started': journal.started})
+        if partial:
+            journal._write({'partial': partial})
+        journal._sync()
+        return journal
+
+    @classmethod
+    def load(cls, destdir):
+        """Read the journal of an unfinished job so that it can be resumed, new entries are appended to it.
+        A truncated last line, left by a crash during a write, is ignored.
+        Input:
+            destdir : string - the destination directory of the copy.
+        Output:
+            returns : Journal"""
+        journal = cls(cls.path_for_destination(destdir))
+        with open(journal.path) as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if 'job' in entry:
+                    journal.params = entry['job']
+                    journal.started = entry['started']
+                if 'done' in entry:
+                    journal.done.update(entry['done'])
+                if 'partial' in entry:
+                    journal.partial = entry['partial']
+        journal.handle = open(journal.path, 'a')
+        return journal
+
+    def is_done(self, filepath):
+        """Check if a source file was completed by a previous run of the job.
+        Input:
+            filepath    : string - path to the source file.
+        Output:
+            returns     : bool"""
+        return filepath in self.done
+
+    def is_incomplete(self, destination, source_meta, dest_meta):
+        """Check if a destination file was left incomplete by a previous run of the job.
+        copy2 sets the modified time once the data is written, so a destination written since the job started
+        that does not carry the source modified time was interrupted and must be copied again.
+        Input:
+            destination : string - the destination path of the file.
+            source_meta : FileMeta - metadata of the source file.
+            dest_meta   : FileMeta - metadata of the existing destination file.
+        Output:
+            returns     : bool"""
+        if destination in self.partial:
+            return True
+        return dest_meta.mtime >= self.started and (dest_meta.mtime != source_meta.mtime or
+                                                    dest_meta.size != source_meta.size)
+
+    def resume_offset(self, destination, source_meta):
+        """Return the offset from which a partially copied file can be continued.
+        The copy restarts from 0 if the source changed since the checkpoint or the destination is shorter than it.
+        Input:
+            destination : string - the destination path of the file.
+            source_meta : FileMeta - metadata of the source file.
+        Output:
+            returns     : int - number of bytes already in the destination"""
+        with self.lock:
+            checkpoint = self.partial.get(destination)
+        if checkpoint is None:
+            return 0
+        offset, size, mtime = checkpoint
+        if size != source_meta.size or mtime != source_meta.mtime:
+            return 0
+        try:
+            if os.path.getsize(destination) < offset:
+                return 0
+        except OSError:
+            return 0
+        return offset
+
+    def checkpoint(self, destination, source_meta, offset):
+        """Record the offset reached by a large file being copied.
+        Input:
+            destination : string - the destination path of the file.
+            source_meta : FileMeta - metadata of the source file.
+            offset      : int - number of bytes written and flushed to the destination.
+        Output:
+            None"""
+        with self.lock:
+            self.partial[destination] = (offset, source_meta.size, source_meta.mtime)
+            self.partial_changed = True
+            self._maybe_flush()
+
+    def record_done(self, filepath, destination=None):
+        """Record a completed source file.
+        Input:
+            filepath    : string - path to the source file.
+            destination : string - the destination path, clears the checkpoint of a large file.
+        Output:
+            None"""
+        with self.lock:
+            self.pending.append(filepath)
+            if destination is not None and self.partial.pop(destination, None) is not None:
+                self.partial_changed = True
+            self._maybe_flush()
+
+    def flush(self):
+        """Write the buffered entries to the journal and sync it to disk.
+        Input:
+            None
+        Output:
+            None"""
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """Flush the buffered entries and close the journal, the file is kept so that the job can be resumed.
+        Input:
+            None
+        Output:
+            None"""
+        with self.lock:
+            self._flush()
+            self.handle.close()
+
+    def remove(self):
+        """Close and delete the journal once the job has completed.
+        Input:
+            None
+        Output:
+            None"""
+        with self.lock:
+            self.handle.close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _maybe_flush(self):
+        if len(self.pending) >= journal_batch or time.time() - self.last_flush >= journal_interval:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self._write({'done': self.pending})
+            self.pending = []
+        if self.partial_changed:
+            self._write({'partial': self.partial})
+            self.partial_changed = False
+        self._sync()
+        self.last_flush = time.time()
+
+    def _write(self, entry):
+        self.handle.write(json.dumps(entry))
+        self.handle.write('\n')
+
+    def _sync(self):
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+
+class EngineListener():
+    """Receives the notifications of a CopyEngine run, the default implementation ignores them.
+    The GUI worker thread turns them into Qt signals, the command line prints them."""
+    def copy_progress(self, progress_percent, copied_count, filecount, copied_size, filesize):
+        """Called periodically while the copy runs, the totals are estimates until the scan completes.
+        Input:
+            progress_percent:   integer - the amount complete in percent.
+            copied_count    :   integer - the number of files that have already been processed.
+            filecount       :   integer - the number of files found so far.
+            copied_size     :   integer - the number of bytes that have already been processed.
+            filesize        :   integer - the number of bytes found so far.
+        Output:
+            None"""
+        pass
+
+    def copy_metrics(self, snapshot):
+        """Called along with copy_progress with the transfer rates, ETA and phase timings of the run.
+        Input:
+            snapshot    :   dict - see CopyMetrics.snapshot
+        Output:
+            None"""
+        pass
+
+    def preflight_progress(self, filecount, filesize):
+        """Called while the selection is sized before the copy starts, with the running totals.
+        Input:
+            filecount       :   integer - the number of files found so far.
+            filesize        :   integer - the number of bytes found so far.
+        Output:
+            None"""
+        pass
+
+    def space_problem(self, required_space, available_space):
+        """Called when the selected files do not fit in the destination, the copy is stopped.
+        Input:
+            required_space  :   integer - bytes needed to complete the copy.
+            available_space :   integer - bytes available in the destination.
+        Output:
+            None"""
+        pass
+
+    def copy_complete(self, summary):
+        """Called once the copy has completed.
+        Input:
+            summary :   dict - the summary of the run, see CopyEngine.run
+        Output:
+            None"""
+        pass
+
+    def job_failed(self, summary):
+        """Called when the job stops on an unexpected error, copy_complete is then not called.
+        Input:
+            summary :   dict - status 'failed', destdir and error, the message of the error.
+        Output:
+            None"""
+        pass
+
+    def watch_sync(self, snapshot):
+        """Called in watch mode after each batch of changed files has been synced, with the totals of the watch.
+        Input:
+            snapshot    :   dict - see CopyEngine.watch_snapshot
+        Output:
+            None"""
+        pass
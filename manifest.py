@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import os
+import sqlite3
+import threading
+
+manifest_name = '.mcmover_manifest.sqlite'
+manifest_batch = 500
+
+
+class Manifest():
+    """Persistent index of the files copied by previous runs.
+    For every copied file the source path, size and modified time are stored along with the destination path.
+    On the next run a source that still matches its entry is skipped without touching the destination.
+    Writes are buffered and committed in batches, the instance can be shared between the copy threads."""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending = []
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS files (
+                                       source TEXT NOT NULL,
+                                       dest TEXT NOT NULL,
+                                       size INTEGER NOT NULL,
+                                       mtime REAL NOT NULL,
+                                       PRIMARY KEY (source, dest))""")
+        self.connection.commit()
+
+    @classmethod
+    def for_destination(cls, destdir):
+        """Open the manifest kept in the root of a destination directory.
+        Input:
+            destdir : string - the destination directory of the copy.
+        Output:
+            returns : Manifest"""
+        return cls(os.path.join(destdir, manifest_name))
+
+    def is_unchanged(self, meta, destination):
+        """Check if a source file is unchanged since it was last copied to destination.
+        Input:
+            meta        : FileMeta - metadata of the source file from the scan.
+            destination : string - the destination path of the file.
+        Output:
+            returns     : bool - True if the file can be skipped"""
+        with self.lock:
+            row = self.connection.execute("SELECT size, mtime FROM files WHERE source = ? AND dest = ?",
+                                          (meta.path, destination)).fetchone()
+        return row is not None and row[0] == meta.size and row[1] == meta.mtime
+
+    def record(self, meta, destination):
+        """Record a file that has been copied, the entry is written with the next batch.
+        Input:
+            meta        : FileMeta - metadata of the source file.
+            destination : string - the destination path of the file.
+        Output:
+            None"""
+        with self.lock:
+            self.pending.append((meta.path, destination, meta.size, meta.mtime))
+            if len(self.pending) >= manifest_batch:
+                self._flush()
+
+    def flush(self):
+        """Write the buffered entries to disk.
+        Input:
+            None
+        Output:
+            None"""
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.connection.executemany("INSERT OR REPLACE INTO files (source, dest, size, mtime) VALUES (?, ?, ?, ?)",
+                                        self.pending)
+            self.connection.commit()
+            self.pending = []
+
+    def close(self):
+        """Flush the buffered entries and close the database.
+        Input:
+            None
+        Output:
+            None"""
+        with self.lock:
+            self._flush()
+            self.connection.close()
+
+    def count(self):
+        """Return the number of entries in the manifest.
+        Input:
+            None
+        Output:
+            returns : int"""
+        with self.lock:
+            self._flush()
+            return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def verify(self):
+        """Compare the manifest with the destination and return the entries that have drifted.
+        An entry drifts when its destination is missing or no longer has the recorded size and modified time.
+        Input:
+            None
+        Output:
+            returns : list - (source, dest) tuples of the drifted entries"""
+        drifted = []
+        self.flush()
+        reader = sqlite3.connect(self.path)
+        try:
+            for source, dest, size, mtime in reader.execute("SELECT source, dest, size, mtime FROM files"):
+                try:
+                    st = os.stat(dest)
+                except OSError:
+                    drifted.append((source, dest))
+                    continue
+                if st.st_size != size or st.st_mtime != mtime:
+                    drifted.append((source, dest))
+        finally:
+            reader.close()
+        return drifted
+
+    def rebuild(self):
+        """Verify the manifest and drop the drifted entries so that those files are copied again on the next run.
+        Input:
+            None
+        Output:
+            returns : tuple - (number of entries checked, number of entries removed)"""
+        checked = self.count()
+        drifted = self.verify()
+        with self.lock:
+            self.connection.executemany("DELETE FROM files WHERE source = ? AND dest = ?", drifted)
+            self.connection.commit()
+        return checked, len(drifted)
@@ -3,279 +3,357 @@
 import sys
 import os
 import platform
-import shutil
-import zmq
-import json
+
+if __name__ == '__main__' and len(sys.argv) > 1:
+    # Headless mode, run the copy from the command line without loading Qt
+    from mclub_cli import main
+    sys.exit(main(sys.argv[1:]))
+
+import logging
 import datetime
-from PySide.QtGui import QApplication, QMainWindow, QPixmap, QSplashScreen, QFileSystemModel, QIcon, QFileDialog, QMessageBox, QProgressDialog
-from PySide.QtCore import QThread, SIGNAL, Qt
+from PySide.QtGui import QApplication, QMainWindow, QPixmap, QSplashScreen, QFileSystemModel, QIcon, QFileDialog, QMessageBox, QDialog, QLabel, QProgressBar, QSpinBox, QPushButton, QVBoxLayout, QFormLayout
+from PySide.QtCore import QObject, QThread, SIGNAL, Qt, QAbstractListModel, QModelIndex, QTimer
 
 os_version = platform.system()
 if os_version == 'Windows':
     import ctypes
 
 from ui_mclub import Ui_MainWindow
+from listener import EngineListener
+from metrics import format_eta
+from filters import FileFilter, split_patterns
+from defaults import copy_workers, large_copy_workers
+# The copy engine, the job queue and the manifest are imported when they are first used, so that the window shows
+# as soon as possible
 
 __version__ = '1.0.0.0'
-zmq_port = 5556
+preview_delay = 250
 
 
-class FileOperations():
-    """Class to process file based operations"""
-    def __init__(self):
-        self.filecount = 0
-        self.filelist = []
-        self.filesize = 0
+class CopySignals(QObject, EngineListener):
+    """Listener of the copy jobs started from the GUI, the jobs run on the threads of the job queue so that the GUI
+    does not hang and their notifications are turned into signals delivered to the GUI thread."""
+    def __init__(self, parent=None):
+        super(CopySignals, self).__init__(parent)
 
-    def get_free_space(self, folder):
-        """ Return folder/drive free space (in bytes)
-        Input:
-            folder      : string - Path to folder / drive
-        Output:
-            returns     : int - Number of bytes available in path
-        """
-        if os_version == 'Windows':
-            free_bytes = ctypes.c_ulonglong(0)
-            ctypes.windll.kernel32.GetDiskFreeSpaceExW(ctypes.c_wchar_p(folder), None, None, ctypes.pointer(free_bytes))
-            return free_bytes.value
-        else:
-            st = os.statvfs(folder)
-            return st.f_bavail * st.f_frsize
+    def preflight_progress(self, filecount, filesize):
+        self.emit(SIGNAL("preflightProgress(PyObject)"), {'filecount': filecount, 'filesize': filesize})
 
-    def get_file_list_for_dir(self, filepath):
-        """ Process filepath to det a list of the items.
-        Class variables are updated.
-        Input:
-            filepath    : string - can be either a filepath or directory to be recursively inspected
-        Output:
-            None"""
-        if not os.path.isfile(filepath):
-            for r, d, f in os.walk(filepath):
-                for file in f:
-                    file_path = os.path.join(os.path.abspath(r), file)
-                    self.filelist.append(file_path)
-                    self.filecount += 1
-                    self.get_file_size(file_path)
-        else:
-            file_path = filepath
-            self.filelist.append(file_path)
-            self.filecount += 1
-            self.get_file_size(file_path)
+    def copy_progress(self, progress_percent, copied_count, filecount, copied_size, filesize):
+        self.emit(SIGNAL("copyProgress(int, int, int)"), progress_percent, copied_count, filecount)
 
-    def get_file_size(self, filepath, ret=False):
-        """Determine size of a file in bytes, results can be returned by setting the ret flag.
-        Input:
-            filepath    : string - path, must be a file
-            ret         : bool  -  if ommited or False class variables will be set, else data will be returned
-        Output:
-            returns     : int -  number of bytes"""
-        try:
-            if not ret:
-                self.filesize += os.stat(filepath).st_size
-            else:
-                return os.stat(filepath).st_size
-        except:
-            self.filesize += 0
+    def copy_metrics(self, snapshot):
+        self.emit(SIGNAL("copyMetrics(PyObject)"), snapshot)
 
-    def get_file_age(self, filepath):
-        """Determine the age of the file by checking the last modified time.
-        Input:
-            filepath    : string - can be either a file or directory
-        Output:
-            returns     : float - number of seconds since epoch, 0 is returned if epoch fails"""
+    def space_problem(self, required_space, available_space):
+        self.emit(SIGNAL('spaceProblem(int, int)'), required_space, available_space)
+
+    def job_failed(self, summary):
+        self.emit(SIGNAL("jobFailed(QString)"), summary['error'])
+
+    def copy_complete(self, summary):
+        filesize = summary['bytes_found']
+        if filesize > 0:
+            filesize = filesize / 1024.00 / 1024.00 / 1024.00
+        runtime = datetime.timedelta(seconds=summary['runtime_seconds'])
+        self.emit(SIGNAL("copyComplete(QString, QString, QString, QString, PyObject)"),
+                         '%s' % summary['files_found'], "%f" % filesize, "%s" % runtime, "%s" % runtime.total_seconds(),
+                         {'outcomes': summary['outcomes'], 'failures': summary['failures']})
+
+
+class ManifestWorker(QThread):
+    "Worker thread verifying the incremental sync manifest of a destination against the files on disk."
+    def __init__(self, parent=None):
+        super(ManifestWorker, self).__init__(parent)
+        self.destdir = None
+
+    def run(self):
+        from manifest import Manifest
+        manifest = Manifest.for_destination(self.destdir)
         try:
-            fileage = os.path.getmtime(filepath)
-            return fileage
-        except:
+            checked, removed = manifest.rebuild()
+        finally:
+            manifest.close()
+        self.emit(SIGNAL("manifestVerified(int, int)"), checked, removed)
+
+
+class PathListModel(QAbstractListModel):
+    "List model over a python list of strings, the view only asks for the rows it displays."
+    def __init__(self, parent=None):
+        super(PathListModel, self).__init__(parent)
+        self.rows = []
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
             return 0
+        return len(self.rows)
 
-    def split_path(self, path):
-        """This is used when trimming directories from a path.
-        The idea is to split the path into elements then return the reversed list to address the order.
-        Input:
-            path    : string - the path that you wish to split into a list.
-        Output:
-            folders : list - the path elements in a list format, ideal for splitting."""
-        path = os.path.splitdrive(path)[1][1:]
-        folders = []
-        while 1:
-            path, folder = os.path.split(path)
-            if folder != "" and folder:
-                folders.append(folder)
-                if len(path) == 0:
-                    return folders[::-1]
-            else:
-                if path != "" and path:
-                    folders.append(path)
-                break
-        folders.reverse()
-        return folders
-
-    def get_dest_filepath(self, filepath, destpath, flattencount):
-        """Determine the flattened filepath for the destination of files.
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid() and index.row() < len(self.rows):
+            return self.rows[index.row()]
+        return None
+
+    def set_rows(self, rows):
+        """Replace the content of the model.
         Input:
-            filepath    : string - the path to the source file.
-            destpath    : string - the destination path.
-            flattencount: integer- the number of directories to trim from the source path.
+            rows    : list - the strings to display, the list is kept by the model.
         Output:
-            dpath       : string - the destination path taking into account the flattencount."""
-        fp = self.split_path(filepath)
-        if flattencount > 0:
-            if len(fp) > flattencount:
-                dpath = os.path.abspath(os.path.join(destpath, *fp[flattencount:]))
-            else:
-                dpath = os.path.abspath(os.path.join(destpath, fp[-1]))
-        else:
-            dpath = os.path.abspath(os.path.join(destpath, *fp))
-        return dpath
+            None"""
+        self.beginResetModel()
+        self.rows = rows
+        self.endResetModel()
 
-    def copy_file_to_dest(self, filepath, destination, overwrite):
-        """Copy files to a destination and overwrite / skip based on the overwrite param.
-        If the directory is multiple directories, we attempt to create these.
+    def remove_row(self, row):
+        """Remove a single row from the model.
         Input:
-            filepath    : string - path to the file you wish to copy.
-            destination : string - the path to which you want to copy.
-            overwrite   : string - expects 'larger', 'newer' or 'either'
+            row     : integer - the row to remove.
         Output:
-            None
-        """
-        ##TODO: Find a way to return the errors to the caller and show the user.
-        source_filesize = self.get_file_size(filepath, True)
-        source_fileage = self.get_file_age(filepath)
-        if os.path.exists(destination):
-            dest_filesize = self.get_file_size(destination, True)
-            dest_fileage = self.get_file_age(destination)
-            if overwrite == 'larger':
-                if source_filesize > dest_filesize:
-                    copy_file_flag = True
-            elif overwrite == 'newer':
-                if source_fileage > dest_fileage:
-                    copy_file_flag = True
-            elif overwrite == 'either':
-                copy_file_flag = True
-            else:
-                copy_file_flag = False
-        else:
-            copy_file_flag = True
-        if copy_file_flag:
-            destdir = os.path.split(destination)[0]
-            if not os.path.exists(destdir):
-                try:
-                    os.makedirs(destdir)
-                except:
-                    print(("Unable to create %s" % destdir))
-            try:
-                shutil.copy2(filepath, destination)
-            except:
-                print(("Error encountered while copying %s to %s" % (filepath, destination)))
-            else:
-                self.filesize += source_filesize
-                self.filecount += 1
+            None"""
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.rows[row]
+        self.endRemoveRows()
 
 
-class CopyWorker(QThread):
-    "Worker thread for the filecopy operation to prevent the GUI from hanging."
-    def __init__(self, parent=None):
-        super(CopyWorker, self).__init__(parent)
-        self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.PAIR)
-        self.socket.connect("tcp://localhost:%s" % zmq_port)
+class PreviewWorker(QThread):
+    """Worker thread sizing the selected directories, then expanding them and planning the destination of every
+    file found, so that large selections do not freeze the GUI. Setting must_run to False cancels the preview."""
+    def __init__(self, parent=None, sizer=None):
+        super(PreviewWorker, self).__init__(parent)
+        self.sizer = sizer
         self.must_run = True
+        self.itemlist = []
+        self.destdir = None
+        self.flattencount = 0
+        self.filters = None
 
     def run(self):
-        msg = self.socket.recv()
-        paramdict = json.loads(msg)
-        self.pathlist = paramdict['filelist']
-        self.destdir = paramdict['destdir']
-        self.flattencount = paramdict['flattencount']
-        self.overwrite = paramdict['overwrite_opt']
-        dirstat = FileOperations()
-        available_space = dirstat.get_free_space(self.destdir)
-        filecount = 0
-        filesize = 0
-        filelist = []
-        for filepath in self.pathlist:
-            fileop = FileOperations()
-            fileop.get_file_list_for_dir(filepath)
-            filecount += fileop.filecount
-            filelist.extend(fileop.filelist)
-            filesize += fileop.filesize
-        if filesize < available_space:
-            self.emit(SIGNAL("copyProgress(QString, QString, QString)"), '0', '0', "%s" % filecount)
-            start_time = datetime.datetime.now()
-            filecopy = FileOperations()
-            for file in sorted(set(filelist)):
-                if self.must_run:  # Check if cancel has been toggled
-                    destfilepath = filecopy.get_dest_filepath(file, self.destdir, self.flattencount)
-                    filecopy.copy_file_to_dest(file, destfilepath, self.overwrite)
-                    progress_percent = int((float(filecopy.filesize) / float(filesize)) * 100)
-                    print (('Progress Percent:\t%s\nFilecopied:\t%s\nTotalFilesize:\t%s' % (progress_percent, filecopy.filesize, filesize)))
-                    print ((float(filecopy.filesize) / float(filesize)))
-                    if self.must_run:
-                        self.emit(SIGNAL("copyProgress(QString, QString, QString)"),
-                                         '%s' % progress_percent, "%s" % filecopy.filecount, "%s" % filecount)
-                else:
-                    print ('Copy cancelled')
-                    return
-        else:
-            self.emit(SIGNAL('spaceProblem(int, int)'), filesize, available_space)
+        from copyengine import FileOperations
+        from pathplan import PathPlanner
+        if self.sizer is None:
+            from sizing import DirectorySizer
+            self.sizer = DirectorySizer()
+        sized = self.sizer.size(self.itemlist, self.sizing_progress, lambda: self.must_run, self.filters)
+        if sized is None:
             return
-        end_time = datetime.datetime.now()
-        runtime = end_time - start_time
-        if filesize > 0:
-            filesize = filesize / 1024.00 / 1024.00 / 1024.00
-        self.emit(SIGNAL("copyComplete(QString, QString, QString, QString)"),
-                         '%s' % filecount, "%f" % filesize, "%s" % runtime, "%s" % runtime.total_seconds())
+        filecount, filesize, totals = sized
+        itemrows = []
+        for item in self.itemlist:
+            if os.path.isdir(item):
+                itemrows.append('%s  (%s files, %.1f MB)' % (item, totals[item][0], totals[item][1] / 1024.00 / 1024.00))
+            else:
+                itemrows.append(item)
+        previewrows = None
+        collisions = {}
+        if self.destdir is not None:
+            scanner = FileOperations(filters=self.filters)
+            filelist = []
+            for item in self.itemlist:
+                for meta in scanner.scan_dir(item):
+                    if not self.must_run:
+                        return
+                    filelist.append(meta.path)
+            planner = PathPlanner(self.destdir, self.flattencount)
+            previewrows = planner.plan(filelist)
+            collisions = planner.collisions(filelist, previewrows)
+        if self.must_run:
+            self.emit(SIGNAL("previewReady(PyObject)"),
+                      {'itemrows': itemrows, 'previewrows': previewrows, 'filecount': filecount,
+                       'filesize': filesize, 'collisions': len(collisions)})
+
+    def sizing_progress(self, filecount, filesize):
+        if self.must_run:
+            self.emit(SIGNAL("previewProgress(PyObject)"), {'filecount': filecount, 'filesize': filesize})
+
+
+class CopyProgressDialog(QDialog):
+    """Progress dialog of a copy, with the bandwidth and files per second limits that can be changed while the copy
+    runs. Emits canceled() when the copy is cancelled and limitsChanged(int, int) with the new limits in bytes and
+    files per second, 0 for no limit."""
+    def __init__(self, bandwidth_limit=0, files_limit=0, parent=None):
+        super(CopyProgressDialog, self).__init__(parent)
+        self.setModal(True)
+        self.label = QLabel("Copy in progress.", self)
+        self.progressBar = QProgressBar(self)
+        self.progressBar.setRange(0, 100)
+        self.bwLimit = QSpinBox(self)
+        self.bwLimit.setRange(0, 10000)
+        self.bwLimit.setSingleStep(5)
+        self.bwLimit.setSpecialValueText("Unlimited")
+        self.bwLimit.setValue(bandwidth_limit)
+        self.filesLimit = QSpinBox(self)
+        self.filesLimit.setRange(0, 100000)
+        self.filesLimit.setSingleStep(10)
+        self.filesLimit.setSpecialValueText("Unlimited")
+        self.filesLimit.setValue(files_limit)
+        limits = QFormLayout()
+        limits.addRow("Bandwidth Limit (MB/s)", self.bwLimit)
+        limits.addRow("Files/Sec Limit", self.filesLimit)
+        self.cancelButton = QPushButton("Cancel", self)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.label)
+        layout.addWidget(self.progressBar)
+        layout.addLayout(limits)
+        layout.addWidget(self.cancelButton)
+        self.bwLimit.valueChanged.connect(self.limits_changed)
+        self.filesLimit.valueChanged.connect(self.limits_changed)
+        self.cancelButton.clicked.connect(self.reject)
+
+    def setValue(self, value):
+        self.progressBar.setValue(value)
+        if value >= self.progressBar.maximum():
+            self.accept()
+
+    def maximum(self):
+        return self.progressBar.maximum()
+
+    def setLabelText(self, text):
+        self.label.setText(text)
+
+    def limits_changed(self, value):
+        self.emit(SIGNAL("limitsChanged(int, int)"), self.bwLimit.value() * 1024 * 1024, self.filesLimit.value())
+
+    def reject(self):
+        """Cancel the copy, also called when the dialog is closed."""
+        self.emit(SIGNAL("canceled()"))
+        super(CopyProgressDialog, self).reject()
 
 
 class MainWindow(QMainWindow, Ui_MainWindow):
     def __init__(self, parent=None):
         super(MainWindow, self).__init__(parent)
         self.setupUi(self)
-        self.build_dir_tree()
+        self.model = None
         self.setWindowIcon(QIcon('favicon.png'))
         self.actionAbout.triggered.connect(self.about)
         self.destButton.clicked.connect(self.destination_chooser)
         self.actionChoose_Destination.triggered.connect(self.destination_chooser)
         self.copyButton.clicked.connect(self.copy_files)
         self.actionStart_Copy.triggered.connect(self.copy_files)
+        self.actionVerify_Manifest.triggered.connect(self.verify_manifest)
+        self.actionResume_Copy.triggered.connect(self.resume_copy)
         self.ckbxTrimDir.toggled.connect(self.update_table_view)
         self.treeView.expanded.connect(self.resize_tree_column)
         self.treeView.collapsed.connect(self.resize_tree_column)
         self.treeView.clicked.connect(self.update_table_view)
         self.trimdirCount.valueChanged.connect(self.update_table_view)
-
+        self.txtInclude.editingFinished.connect(self.update_table_view)
+        self.txtExclude.editingFinished.connect(self.update_table_view)
+        self.ckbxSkipJunk.toggled.connect(self.update_table_view)
+
+        self.selectedModel = PathListModel(self)
+        self.listWidget.setModel(self.selectedModel)
+        self.previewModel = PathListModel(self)
+        self.previewView.setModel(self.previewModel)
         self.listWidget.doubleClicked.connect(self.unselectItem)
-
+        # The preview is only computed once the selection and the options stop changing
+        self.previewTimer = QTimer(self)
+        self.previewTimer.setSingleShot(True)
+        self.previewTimer.setInterval(preview_delay)
+        self.previewTimer.timeout.connect(self.start_preview)
+        self.pendingPreview = None
+        self.sizer = None
+        self.previewWorker = PreviewWorker()
+        self.connect(self.previewWorker, SIGNAL("previewReady(PyObject)"), self.preview_ready, Qt.QueuedConnection)
+        self.connect(self.previewWorker, SIGNAL("previewProgress(PyObject)"), self.preview_progress, Qt.QueuedConnection)
+        self.previewWorker.finished.connect(self.preview_finished)
+
+        self.workerCount.setValue(copy_workers)
+        self.largeWorkerCount.setValue(large_copy_workers)
         self.copyButton.setEnabled(False)
         self.lblTrimDir.setVisible(False)
         self.trimdirCount.setVisible(False)
         self.rbOWNewer.setVisible(False)
         self.rbOWLarger.setVisible(False)
         self.rbOWEither.setVisible(False)
-        self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.PAIR)
-        self.socket.bind("tcp://*:%s" % zmq_port)
+        # The job queue is created on the first copy, see get_jobs
+        self.jobs = None
+        self.jobServer = None
+        self.currentJob = None
+        self.copySignals = CopySignals()
+        self.connect(self.copySignals, SIGNAL("preflightProgress(PyObject)"), self.preflight_progress, Qt.QueuedConnection)
+        self.connect(self.copySignals, SIGNAL("copyComplete(QString, QString, QString, QString, PyObject)"), self.copy_complete, Qt.QueuedConnection)
+        self.connect(self.copySignals, SIGNAL("spaceProblem(int, int)"), self.space_problem, Qt.QueuedConnection)
+        self.connect(self.copySignals, SIGNAL("jobFailed(QString)"), self.job_failed, Qt.QueuedConnection)
+        self.connect(self.copySignals, SIGNAL("copyProgress(int, int, int)"), self.copy_progress, Qt.QueuedConnection)
+        self.connect(self.copySignals, SIGNAL("copyMetrics(PyObject)"), self.copy_metrics, Qt.QueuedConnection)
+        self.manifestWorker = ManifestWorker()
+        self.connect(self.manifestWorker, SIGNAL("manifestVerified(int, int)"), self.manifest_verified, Qt.QueuedConnection)
+        # The rest of the startup runs once the window is on screen
+        QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        """Second stage of the startup, run from the event loop once the window is shown: build the directory tree.
+        The job endpoint is started here when MCLUB_JOB_ENDPOINT is set.
+        Input:
+            None
+        Output:
+            None"""
+        self.build_dir_tree()
+        if os.environ.get('MCLUB_JOB_ENDPOINT'):
+            from jobqueue import JobServer
+            self.jobServer = JobServer(self.get_jobs(), os.environ['MCLUB_JOB_ENDPOINT'])
 
-        self.copyWorker = CopyWorker()
-        self.connect(self.copyWorker, SIGNAL("copyComplete(QString, QString, QString, QString)"), self.copy_complete, Qt.QueuedConnection)
-        self.connect(self.copyWorker, SIGNAL("spaceProblem(int, int)"), self.space_problem, Qt.QueuedConnection)
+    def get_sizer(self):
+        """Return the directory sizer shared by the preview and the copies, created on first use.
+        Input:
+            None
+        Output:
+            returns : DirectorySizer"""
+        if self.sizer is None:
+            from sizing import DirectorySizer
+            self.sizer = DirectorySizer()
+        return self.sizer
+
+    def get_jobs(self):
+        """Return the job queue, created with its runner thread on the first copy. Jobs run one at a time, set
+        MCLUB_JOB_ENDPOINT to also accept jobs from other processes.
+        Input:
+            None
+        Output:
+            returns : JobQueue"""
+        if self.jobs is None:
+            from jobqueue import JobQueue
+            self.jobs = JobQueue(sizer=self.get_sizer())
+        return self.jobs
 
     def unselectItem(self, item):
-        ##need to figure out how to remove from the model
-        self.listWidget.takeItem(item.row())
+        self.selectedModel.remove_row(item.row())
 
-    def copy_complete(self, filecount, filesize, runtime, run_seconds):
+    def copy_complete(self, filecount, filesize, runtime, run_seconds, results):
+        """Display the summary of a finished copy, with the list of the files that could not be copied.
+        Input:
+            filecount   :   string - number of files processed.
+            filesize    :   string - GB processed.
+            runtime     :   string - the run time.
+            run_seconds :   string - the run time in seconds.
+            results     :   dict - outcomes, the count of files per outcome, and failures, the failed files.
+        Output:
+            None, dialog is displayed to the user."""
         self.progress.setValue(self.progress.maximum())
+        self.statusbar.clearMessage()
         transfer_rate = round((float(filesize) * 1024) / float(run_seconds), 3)
         filesize = round(float(filesize), 3)
-        QMessageBox.information(self, "File Copy Complete",
-            """Your file copy has been successfully completed.\n
-            Files processed:\t%s\n
+        outcomes = results['outcomes']
+        message = """Files processed:\t%s\n
+            Files copied:\t%s\n
+            Files unchanged or skipped:\t%s\n
             Data copied:\t%sGB\n
             Total runtime:\t%s\n
-            Transfer Rate:\t%sMB/Sec""" % (filecount, filesize, runtime, transfer_rate),
-            WindowModility=True)
+            Transfer Rate:\t%sMB/Sec""" % (filecount, outcomes['copied'],
+                                             outcomes['unchanged'] + outcomes['skipped'] + outcomes['deduplicated'],
+                                             filesize, runtime, transfer_rate)
+        if not results['failures']:
+            QMessageBox.information(self, "File Copy Complete",
+                """Your file copy has been successfully completed.\n
+            %s""" % message,
+                WindowModility=True)
+        else:
+            box = QMessageBox(QMessageBox.Warning, "File Copy Complete",
+                              """%s files could not be copied, use File > Resume Copy to try them again.\n
+            %s""" % (len(results['failures']), message), QMessageBox.Ok, self)
+            box.setDetailedText('\n'.join('%s: %s' % (failure['path'], failure['error'])
+                                          for failure in results['failures']))
+            box.exec_()
         self.copyButton.setEnabled(True)
 
     def space_problem(self, dirsize, filesize):
@@ -288,12 +366,24 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             None, dialog is displayed to the user."""
         ##TODO: Set the messagebox modal property to true
         required_space = (filesize / 1024.00 / 1024.00 / 1024.00) - (dirsize / 1024.00 / 1024.00 / 1024.00)
+        self.progress.accept()
+        self.statusbar.clearMessage()
         QMessageBox.critical(self,
                              "Not enough space",
                              """You do not have enough space in your selected destination to complete this operation\n
                              %s more GB space required""" % required_space,
                              WindowModility=True)
-        self.copyWorker.quit()
+        self.copyButton.setEnabled(True)
+
+    def job_failed(self, error):
+        """Close the progress dialog and display the error that stopped the copy.
+        Input:
+            error   :   string - the message of the error.
+        Output:
+            None, dialog is displayed to the user."""
+        self.progress.accept()
+        self.statusbar.clearMessage()
+        QMessageBox.critical(self, "Copy failed", "The copy stopped on an error:\n%s" % error, WindowModility=True)
         self.copyButton.setEnabled(True)
 
     def build_dir_tree(self):
@@ -304,18 +394,22 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         Output:
             None"""
         ##TODO: add linux support for the model root drive.
+        # The model lists the directories on its own thread, the tree fills in as they are loaded
         self.model = QFileSystemModel(self)
-        if sys.platform == 'win32':
-            self.model.setRootPath(os.path.splitdrive(os.getcwd())[0])
+        self.model.setResolveSymlinks(False)
+        self.model.directoryLoaded.connect(self.resize_tree_column)
         self.tree = self.treeView
         self.tree.setModel(self.model)
+        if sys.platform == 'win32':
+            self.model.setRootPath(os.path.splitdrive(os.getcwd())[0])
         self.tree.setAnimated(False)
         self.tree.setIndentation(20)
         self.tree.setSortingEnabled(True)
 
     def update_table_view(self):
         """Refresh listview with selected items in the treeView using
-        the shared model.
+        the shared model. The selected directories are expanded and the
+        preview is computed in the background once the selection stops changing.
         Input:
             None
         Output:
@@ -329,26 +423,82 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 )
             )
             for selection in self.treeView.selectedIndexes()]
-        self.listWidget.clear()
-        self.listWidget.addItems(itemlist)
-
-        nitemlist = []
-        fileops = FileOperations()
+        self.selectedModel.set_rows(list(itemlist))
         if not self.ckbxTrimDir.isChecked():
             flattencount = 0
         else:
             flattencount = self.trimdirCount.value()
         if self.lblDestPath.isEnabled():
-            self.previewView.clear()
-            for item in itemlist:
-                nitemlist.append(fileops.get_dest_filepath(item, self.lblDestPath.text(), flattencount))
-            self.previewView.addItems(nitemlist)
+            destdir = self.lblDestPath.text()
         else:
-            self.previewView.clear()
-            self.previewView.addItems(['No destination folder selected'])
-
+            destdir = None
+            self.previewModel.set_rows(['No destination folder selected'])
+        self.pendingPreview = (itemlist, destdir, flattencount, self.filter_params())
+        self.previewTimer.start()
         self.resize_tree_column()
 
+    def start_preview(self):
+        """Start the preview of the latest selection, a preview still running is cancelled first and
+        the new one is started once it has stopped.
+        Input:
+            None
+        Output:
+            None"""
+        if self.previewWorker.isRunning():
+            self.previewWorker.must_run = False
+            return
+        if self.pendingPreview is None:
+            return
+        itemlist, destdir, flattencount, filter_params = self.pendingPreview
+        self.pendingPreview = None
+        try:
+            filters = FileFilter.from_params(filter_params)
+        except ValueError as err:
+            self.statusbar_msg(str(err))
+            return
+        self.previewWorker.itemlist, self.previewWorker.destdir, self.previewWorker.flattencount = itemlist, destdir, flattencount
+        self.previewWorker.filters = filters
+        self.previewWorker.sizer = self.get_sizer()
+        self.previewWorker.must_run = True
+        self.statusbar_msg('Scanning the selection...')
+        self.previewWorker.start()
+
+    def preview_finished(self):
+        """Start the preview of a selection made while the previous preview was running.
+        Input:
+            None
+        Output:
+            None"""
+        if self.pendingPreview is not None and not self.previewTimer.isActive():
+            self.start_preview()
+
+    def preview_progress(self, totals):
+        """Display the running totals of the selection while it is sized.
+        Input:
+            totals  :   dict - filecount and filesize found so far.
+        Output:
+            None"""
+        self.statusbar_msg('%s files selected, %.3f GB' % (totals['filecount'],
+                                                           totals['filesize'] / 1024.00 / 1024.00 / 1024.00))
+
+    def preview_ready(self, preview):
+        """Display the result of a preview.
+        Input:
+            preview :   dict - itemrows, previewrows (None without a destination), filecount, filesize and
+                        the number of destination collisions.
+        Output:
+            None"""
+        if self.pendingPreview is not None:
+            # The selection changed since this preview was started
+            return
+        self.selectedModel.set_rows(preview['itemrows'])
+        if preview['previewrows'] is not None:
+            self.previewModel.set_rows(preview['previewrows'])
+        msg = '%s files selected, %.3f GB' % (preview['filecount'], preview['filesize'] / 1024.00 / 1024.00 / 1024.00)
+        if preview['collisions']:
+            msg += ', %s destination paths are shared by more than one file once trimmed' % preview['collisions']
+        self.statusbar_msg(msg)
+
     def resize_tree_column(self):
         """Resize the treeView column to fit the contents.
         Input:
@@ -357,6 +507,16 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             None"""
         self.treeView.resizeColumnToContents(0)
 
+    def filter_params(self):
+        """Return the include and exclude rules entered in the options, shared by the preview and the copy.
+        Input:
+            None
+        Output:
+            returns : dict - include, exclude and exclude_junk, see CopyEngine.run"""
+        return {'include': split_patterns(self.txtInclude.text()),
+                'exclude': split_patterns(self.txtExclude.text()),
+                'exclude_junk': self.ckbxSkipJunk.isChecked()}
+
     def copy_files(self):
         """Initiate copy process. File size is calculated first to
         check that there is enough space in the destination.
@@ -367,8 +527,6 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         Output:
             None"""
         self.copyButton.setEnabled(False)
-        self.copyWorker.must_run = True
-        self.connect(self.copyWorker, SIGNAL("copyProgress(QString, QString, QString)"), self.copy_progress, Qt.QueuedConnection)
         dest_dir = self.lblDestPath.text()
         if dest_dir == '':
             QMessageBox.critical(self, "Destination not set", "Please specify a destination path", WindowModility=True)
@@ -397,35 +555,148 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 flattencount = 0
             else:
                 flattencount = self.trimdirCount.value()
+            filter_params = self.filter_params()
+            try:
+                FileFilter.from_params(filter_params)
+            except ValueError as err:
+                QMessageBox.critical(self, "Invalid filter", str(err), WindowModility=True)
+                self.copyButton.setEnabled(True)
+                return
+
+            self.show_progress()
+            var_values = {'destdir': dest_dir, 'filelist': copy_filelist, 'flattencount': flattencount,
+                          'overwrite_opt': overwrite_option, 'workers': self.workerCount.value(),
+                          'large_workers': self.largeWorkerCount.value(),
+                          'incremental': self.ckbxIncremental.isChecked(),
+                          'verify': [None, 'sample', 'full'][self.cbVerify.currentIndex()],
+                          'dedupe': [None, 'link', 'skip'][self.cbDedupe.currentIndex()],
+                          'preflight': True,
+                          'bytes_per_second': self.bwLimit.value() * 1024 * 1024,
+                          'files_per_second': self.filesLimit.value(),
+                          'nice': 10 if self.ckbxLowPriority.isChecked() else None,
+                          'io_class': 'low' if self.ckbxLowPriority.isChecked() else None}
+            var_values.update(filter_params)
+            self.currentJob = self.get_jobs().submit(var_values, listener=self.copySignals)
+
+    def resume_copy(self):
+        """Resume the unfinished copy job recorded in the journal of the selected destination.
+        The job runs again with the parameters it was started with, the files it completed are skipped and
+        large files continue from their last checkpoint.
+        Input:
+            None
+        Output:
+            None"""
+        dest_dir = self.lblDestPath.text()
+        from journal import Journal
+        if not self.lblDestPath.isEnabled() or not Journal.exists(dest_dir):
+            QMessageBox.critical(self, "Nothing to resume", "The selected destination has no unfinished copy", WindowModility=True)
+            return
+        self.copyButton.setEnabled(False)
+        self.show_progress()
+        self.currentJob = self.get_jobs().submit({'destdir': dest_dir, 'resume': True,
+                                                  'bytes_per_second': self.bwLimit.value() * 1024 * 1024,
+                                                  'files_per_second': self.filesLimit.value()},
+                                                 listener=self.copySignals)
+
+    def verify_manifest(self):
+        """Check the incremental sync manifest of the destination and drop the entries that no longer
+        match the files on disk, so that those files are copied again on the next incremental run.
+        Input:
+            None
+        Output:
+            None, manifest_verified is called once the check completes"""
+        dest_dir = self.lblDestPath.text()
+        from manifest import manifest_name
+        if not self.lblDestPath.isEnabled() or not os.path.exists(os.path.join(dest_dir, manifest_name)):
+            QMessageBox.critical(self, "No manifest", "The selected destination has no incremental sync manifest", WindowModility=True)
+            return
+        if not self.manifestWorker.isRunning():
+            self.statusbar_msg("Verifying manifest for %s" % dest_dir)
+            self.manifestWorker.destdir = dest_dir
+            self.manifestWorker.start()
 
-            self.progress = QProgressDialog("Copy in progress.", "Cancel", 0, 100, modal=True)
-            self.progress.canceled.connect(self.cancel_copy)
-            self.progress.setWindowTitle('Copy Progress')
-            var_values = {'destdir': dest_dir, 'filelist': copy_filelist, 'flattencount': flattencount, 'overwrite_opt': overwrite_option}
-            self.socket.send(json.dumps(var_values))
-            self.copyWorker.start()
+    def manifest_verified(self, checked, removed):
+        """Display the result of the manifest verification.
+        Input:
+            checked :   integer - number of manifest entries checked.
+            removed :   integer - number of entries that had drifted from the destination and were dropped.
+        Output:
+            None, dialog is displayed to the user."""
+        self.statusbar.clearMessage()
+        QMessageBox.information(self, "Manifest Verified",
+            """Manifest entries checked:\t%s\n
+            Entries rebuilt:\t%s""" % (checked, removed),
+            WindowModility=True)
 
-    def copy_progress(self, percentage_complete, filecount, filecomplete):
+    def copy_progress(self, percentage_complete, filecomplete, filecount):
         """Display the progress bar with a completed percentage.
+        Published by the worker at a limited rate, whatever the number of files copied.
         Input:
             percentage_complete :   integer - the amount complete in percent.
-            filecount           :   integer - the total number of files being processed.
             filecomplete        :   integer - the number of files that have already been processed.
+            filecount           :   integer - the total number of files being processed.
         Output:
             None, dialog is updated"""
-        ##TODO: display the current transfer rate
-        ##TODO: display the current file being transferred and possibly the progress thereof.
-        ##Perhaps use the statusbar method for this
-        self.progress.setValue(int(percentage_complete))
+        self.progress.setValue(percentage_complete)
+
+    def preflight_progress(self, totals):
+        """Show the running totals of the selection while it is sized before the copy.
+        Input:
+            totals  :   dict - filecount and filesize found so far.
+        Output:
+            None"""
+        self.progress.setLabelText('Sizing the selection: %s files, %.3f GB' % (
+            totals['filecount'], totals['filesize'] / 1024.00 / 1024.00 / 1024.00))
+
+    def copy_metrics(self, snapshot):
+        """Display the transfer rate, ETA and current file in the progress dialog and the statusbar.
+        Input:
+            snapshot    :   dict - see CopyMetrics.snapshot
+        Output:
+            None, dialog and statusbar are updated"""
+        rate = '%.2f MB/Sec  %.1f files/Sec' % (snapshot['bytes_per_second'] / 1024.00 / 1024.00,
+                                                snapshot['files_per_second'])
+        eta = 'ETA %s%s' % (format_eta(snapshot['eta_seconds']), ' (scanning)' if snapshot['estimate'] else '')
+        current_file = snapshot['current_file'] or ''
+        self.progress.setLabelText("Copy in progress.\n%s\n%s\n%s" % (rate, eta, os.path.basename(current_file)))
+        self.statusbar_msg('%s  %s  %s' % (rate, eta, current_file))
+
+    def show_progress(self):
+        """Open the progress dialog of a copy, starting with the limits of the options.
+        Input:
+            None
+        Output:
+            None"""
+        self.progress = CopyProgressDialog(self.bwLimit.value(), self.filesLimit.value(), self)
+        self.connect(self.progress, SIGNAL("canceled()"), self.cancel_copy)
+        self.connect(self.progress, SIGNAL("limitsChanged(int, int)"), self.limits_changed)
+        self.progress.setWindowTitle('Copy Progress')
+        self.progress.show()
+
+    def limits_changed(self, bytes_per_second, files_per_second):
+        """Apply the limits set in the progress dialog to the running copy, they replace its schedule if it has one.
+        Input:
+            bytes_per_second    :   integer - bandwidth cap, 0 for no limit.
+            files_per_second    :   integer - files per second cap, 0 for no limit.
+        Output:
+            None"""
+        if self.currentJob is None:
+            return
+        # A job that has not started yet picks the limits up from its parameters
+        self.currentJob.params['bytes_per_second'] = bytes_per_second
+        self.currentJob.params['files_per_second'] = files_per_second
+        if self.currentJob.engine is not None:
+            self.currentJob.engine.throttle.set_limits(bytes_per_second, files_per_second)
 
     def cancel_copy(self):
         """Slot for the cancel command on the progress dialog.
-        The must_run variable of the copyWorker class is set to False to terminate the copy.
+        The current job is cancelled in the job queue, its journal is kept so that it can be resumed.
         Input:
             None
         Output:
             None"""
-        self.copyWorker.must_run = False
+        if self.currentJob is not None:
+            self.get_jobs().cancel(self.currentJob.job_id)
         self.copyButton.setEnabled(True)
 
     def statusbar_msg(self, msg):
@@ -469,11 +740,16 @@ if __name__ == '__main__':
     ##TODO: Look into setting caching to remember a users preference from previous execution
     if os_version == 'Windows':  # Uberhack to make windows show my icon in the taskbar
         ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID('mclub.mover.%s' % __version__)
+    # Set MCLUB_DEBUG=1 to log the copy progress and errors in detail
+    logging.basicConfig(level=logging.DEBUG if os.environ.get('MCLUB_DEBUG') else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     app = QApplication(sys.argv)
     splash_img = QPixmap('splash.png')
     splash = QSplashScreen(splash_img)  # Need to see how to cleanly destroy the splash once the form is loaded.
     splash.show()
+    app.processEvents()
     frame = MainWindow()
     frame.show()
+    splash.finish(frame)
     app.setWindowIcon(QIcon('favicon.png'))
     app.exec_()
\ No newline at end of file
@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import json
+import time
+import logging
+import argparse
+
+from copyengine import EngineListener, copy_workers, large_copy_workers
+from jobqueue import JobQueue, JobServer, JobQueueError, send_request, default_endpoint, max_running_jobs
+from manifest import Manifest, manifest_name
+from journal import Journal
+from metrics import format_eta
+from verify import verify_modes, hash_algorithms
+from dedupe import dedupe_modes
+from throttle import parse_rate, parse_window, io_classes
+from outcomes import retry_attempts
+from archive import ArchiveError, archive_formats, extract, index_suffix, zstandard
+from filters import FileFilter, parse_age
+
+
+class ConsoleListener(EngineListener):
+    """Print the progress of a copy to the console, at most once per interval."""
+    def __init__(self, stream, interval=1.0):
+        self.stream = stream
+        self.interval = interval
+        self.last_report = 0
+        self.isatty = hasattr(stream, 'isatty') and stream.isatty()
+
+    def copy_metrics(self, snapshot):
+        now = time.time()
+        if now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        filesize = snapshot['filesize']
+        progress_percent = int(snapshot['copied_size'] * 100 / filesize) if filesize else 0
+        line = '%3s%%  %s/%s files  %.1f/%.1f MB  %.2f MB/Sec  %.1f files/Sec  ETA %s%s' % (
+            progress_percent, snapshot['copied_count'], snapshot['filecount'],
+            snapshot['copied_size'] / 1024.00 / 1024.00, filesize / 1024.00 / 1024.00,
+            snapshot['bytes_per_second'] / 1024.00 / 1024.00, snapshot['files_per_second'],
+            format_eta(snapshot['eta_seconds']), ' (scanning)' if snapshot['estimate'] else '')
+        if self.isatty:
+            self.stream.write('\r' + line)
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+
+    def preflight_progress(self, filecount, filesize):
+        now = time.time()
+        if now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        self.status_line('Sizing the selection: %s files  %.1f MB' % (filecount, filesize / 1024.00 / 1024.00))
+
+    def extract_progress(self, filecount, filesize):
+        now = time.time()
+        if now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        self.status_line('Extracting: %s files  %.1f MB' % (filecount, filesize / 1024.00 / 1024.00))
+
+    def status_line(self, line):
+        if self.isatty:
+            self.stream.write('\r' + line)
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+
+    def space_problem(self, required_space, available_space):
+        self.finish_line()
+        self.stream.write('Not enough space in the destination, %s more GB space required\n' %
+                          ((required_space - available_space) / 1024.00 / 1024.00 / 1024.00))
+
+    def copy_complete(self, summary):
+        self.finish_line()
+        self.stream.write('Files processed:\t%s\nData copied:\t%.3fGB\nTotal runtime:\t%.1fs\nTransfer Rate:\t%.3fMB/Sec\n' %
+                          (summary['files_found'], summary['bytes_copied'] / 1024.00 / 1024.00 / 1024.00,
+                           summary['runtime_seconds'], summary['bytes_per_second'] / 1024.00 / 1024.00))
+        if summary['files_deduplicated']:
+            self.stream.write('Duplicates:\t%s (%.3fGB)\n' % (summary['files_deduplicated'],
+                                                             summary['bytes_deduplicated'] / 1024.00 / 1024.00 / 1024.00))
+        if summary.get('files_excluded'):
+            self.stream.write('Files excluded:\t%s\n' % summary['files_excluded'])
+        if summary['files_unchanged'] or summary['outcomes']['skipped']:
+            self.stream.write('Files unchanged:\t%s\nFiles skipped:\t%s\n' % (summary['files_unchanged'],
+                                                                          summary['outcomes']['skipped']))
+        if summary['files_failed']:
+            self.stream.write('Files failed:\t%s\n' % summary['files_failed'])
+            for failure in summary['failures']:
+                self.stream.write('Copy failed:\t%s: %s (%s attempts)\n' % (failure['path'], failure['error'],
+                                                                          failure['attempts']))
+        if 'archive' in summary:
+            self.stream.write('Archive:\t%s (%s volumes, %.3fGB)\n' % (summary['archive']['index'],
+                                                                   len(summary['archive']['volumes']),
+                                                                   summary['archive']['archive_bytes'] / 1024.00 / 1024.00 / 1024.00))
+        if 'files_verified' in summary:
+            self.stream.write('Files verified:\t%s\n' % summary['files_verified'])
+            for filepath in summary['verify_failures']:
+                self.stream.write('Verification failed:\t%s\n' % filepath)
+
+    def job_failed(self, summary):
+        self.finish_line()
+        self.stream.write('Copy failed:\t%s\n' % summary['error'])
+
+    def watch_sync(self, snapshot):
+        outcomes = snapshot['outcomes']
+        self.stream.write('%s  Synced (%s):\t%s files copied, %.3fGB, %s skipped, %s failed\n' %
+                          (time.strftime('%H:%M:%S'), snapshot['watcher'], snapshot['files_copied'],
+                           snapshot['bytes_copied'] / 1024.00 / 1024.00 / 1024.00,
+                           outcomes['skipped'] + outcomes['unchanged'], snapshot['files_failed']))
+        self.stream.flush()
+
+    def finish_line(self):
+        if self.isatty and self.last_report:
+            self.stream.write('\n')
+
+
+def schedule_window(text):
+    """Check a --schedule window, the text is kept as the job parameters are stored as JSON."""
+    parse_window(text)
+    return text
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='mclub',
+                                     description='Copy files from multiple directories to a single destination.')
+    parser.add_argument('sources', nargs='*', help='files and directories to copy')
+    parser.add_argument('-d', '--dest', help='destination directory')
+    parser.add_argument('-f', '--flatten', type=int, default=0, metavar='COUNT',
+                        help='number of directories to trim from the source paths')
+    parser.add_argument('-o', '--overwrite', choices=['newer', 'larger', 'either'], default=None,
+                        help='overwrite existing destination files, never overwrite if omitted')
+    parser.add_argument('-w', '--workers', type=int, default=copy_workers,
+                        help='number of copy threads for small files')
+    parser.add_argument('--large-workers', type=int, default=large_copy_workers,
+                        help='number of copy threads for large files')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip files unchanged since the last run, using the manifest in the destination')
+    parser.add_argument('--resume', action='store_true', help='resume the unfinished job journaled in the destination')
+    parser.add_argument('--verify-manifest', action='store_true',
+                        help='drop the manifest entries that no longer match the destination and exit')
+    parser.add_argument('--verify', choices=verify_modes, default=None,
+                        help='hash the data while copying and verify the destination by sampling it or re-reading it')
+    parser.add_argument('--hash', choices=hash_algorithms, default='blake2b',
+                        help='hash used by --verify, the digests are saved in the destination')
+    parser.add_argument('--dedupe', choices=dedupe_modes, default=None,
+                        help='hard link or skip the files with the same content as a file already copied')
+    parser.add_argument('--include', action='append', default=[], metavar='PATTERN',
+                        help='only copy the files matching PATTERN, a glob matched against the file name, or the path '
+                        'if it contains a /, or a regular expression prefixed with re:, may be repeated')
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help='skip the files and directories matching PATTERN, a pattern ending with / only matches '
+                        'directories, which are then not walked, may be repeated')
+    parser.add_argument('--exclude-junk', action='store_true',
+                        help='skip the system, thumbnail, temp and cache files such as .DS_Store and Thumbs.db')
+    parser.add_argument('--min-size', type=parse_rate, metavar='SIZE',
+                        help='skip the files smaller than SIZE bytes, with an optional K, M or G suffix')
+    parser.add_argument('--max-size', type=parse_rate, metavar='SIZE',
+                        help='skip the files larger than SIZE bytes, with an optional K, M or G suffix')
+    parser.add_argument('--min-age', type=parse_age, metavar='AGE',
+                        help='skip the files modified in the last AGE seconds, with an optional m, h, d or w suffix')
+    parser.add_argument('--max-age', type=parse_age, metavar='AGE',
+                        help='skip the files not modified in the last AGE seconds, with an optional m, h, d or w '
+                        'suffix')
+    parser.add_argument('--preflight', action='store_true',
+                        help='size the sources first and stop before copying if they do not fit in the destination')
+    parser.add_argument('--retries', type=int, default=retry_attempts, metavar='COUNT',
+                        help='attempts made again at the files failing with a transient error, 0 to not retry')
+    parser.add_argument('--bwlimit', type=parse_rate, metavar='RATE',
+                        help='limit the bandwidth, in bytes per second with an optional K, M or G suffix')
+    parser.add_argument('--files-limit', type=int, metavar='COUNT', help='limit the number of files copied per second')
+    parser.add_argument('--schedule', action='append', type=schedule_window, default=[], metavar='WINDOW',
+                        help='time of day limits replacing --bwlimit and --files-limit, HH:MM-HH:MM=RATE[/FILES], '
+                        'for example 09:00-18:00=20M/100, may be repeated')
+    parser.add_argument('--nice', type=int, metavar='N', help='lower the CPU priority of the copy threads by N')
+    parser.add_argument('--ionice', choices=io_classes, default=None,
+                        help='lower the I/O priority of the copy threads, idle only uses the disks when they are free')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep watching the sources once the copy is complete and copy the new and modified '
+                        'files until interrupted')
+    parser.add_argument('--watch-interval', type=float, metavar='SECONDS',
+                        help='with --watch, walk the sources every SECONDS instead of using inotify')
+    parser.add_argument('--archive', choices=archive_formats, default=None,
+                        help='pack the files into tar volumes in the destination instead of copying them, tar.zst '
+                        'compresses them and requires the zstandard package')
+    parser.add_argument('--archive-split', type=parse_rate, metavar='SIZE',
+                        help='with --archive, start a new volume past SIZE bytes, with an optional K, M or G suffix')
+    parser.add_argument('--archive-name', metavar='NAME',
+                        help='with --archive, name of the volumes and index, mcmover-DATE-TIME by default')
+    parser.add_argument('--extract', metavar='INDEX',
+                        help='extract the archive with the index INDEX to the destination and exit, the sources are '
+                        'then optional patterns selecting the files')
+    parser.add_argument('--timeline', metavar='FILE',
+                        help='write a JSON timeline of the transfer rates and phase timings to FILE')
+    parser.add_argument('--submit', nargs='?', const=default_endpoint, metavar='ENDPOINT',
+                        help='queue the copy in the job queue served at ENDPOINT instead of running it (default %s)'
+                        % default_endpoint)
+    parser.add_argument('--priority', type=int, default=0, help='priority of a submitted job, higher runs first')
+    parser.add_argument('--jobs', nargs='?', const=default_endpoint, metavar='ENDPOINT',
+                        help='list the jobs of the queue served at ENDPOINT and exit')
+    parser.add_argument('--cancel', type=int, metavar='JOB', help='with --jobs, cancel a job of the queue')
+    parser.add_argument('--serve', nargs='?', const=default_endpoint, metavar='ENDPOINT',
+                        help='run a job queue accepting jobs at ENDPOINT until interrupted')
+    parser.add_argument('--max-jobs', type=int, default=max_running_jobs,
+                        help='number of jobs --serve runs at the same time')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log the copy progress and errors in detail')
+    parser.add_argument('--json', action='store_true',
+                        help='print a JSON summary on stdout, progress is then printed on stderr')
+    return parser
+
+
+def verify_manifest(destdir, output):
+    """Rebuild the manifest of a destination and report the result.
+    Input:
+        destdir : string - the destination directory.
+        output  : bool - print a JSON summary instead of text.
+    Output:
+        returns : int - exit code"""
+    if not os.path.exists(os.path.join(destdir, manifest_name)):
+        sys.stderr.write('%s has no incremental sync manifest\n' % destdir)
+        return 2
+    manifest = Manifest.for_destination(destdir)
+    try:
+        checked, removed = manifest.rebuild()
+    finally:
+        manifest.close()
+    if output:
+        print(json.dumps({'status': 'verified', 'destdir': destdir, 'checked': checked, 'removed': removed}))
+    else:
+        print('Manifest entries checked:\t%s\nEntries rebuilt:\t%s' % (checked, removed))
+    return 0
+
+
+def extract_archive(index_path, destdir, patterns, output):
+    """Extract an archive and report the result.
+    Input:
+        index_path  : string - the index of the archive.
+        destdir     : string - the directory the files are extracted to.
+        patterns    : list - patterns selecting the files, every file if empty.
+        output      : bool - print a JSON summary instead of text.
+    Output:
+        returns     : int - exit code"""
+    listener = ConsoleListener(sys.stderr if output else sys.stdout)
+    start_time = time.time()
+    try:
+        filecount, filesize = extract(index_path, destdir, patterns, listener.extract_progress)
+    except (ArchiveError, OSError) as err:
+        listener.finish_line()
+        sys.stderr.write('%s\n' % err)
+        return 3
+    listener.finish_line()
+    runtime = time.time() - start_time
+    if output:
+        print(json.dumps({'status': 'extracted', 'destdir': destdir, 'files_extracted': filecount,
+                          'bytes_extracted': filesize, 'runtime_seconds': runtime}, sort_keys=True))
+    else:
+        print('Files extracted:\t%s\nData extracted:\t%.3fGB\nTotal runtime:\t%.1fs' %
+              (filecount, filesize / 1024.00 / 1024.00 / 1024.00, runtime))
+    return 0
+
+
+def serve(endpoint, max_jobs):
+    """Run a job queue serving endpoint until interrupted.
+    Input:
+        endpoint    : string - the endpoint to bind.
+        max_jobs    : int - number of jobs run at the same time.
+    Output:
+        returns     : int - exit code"""
+    jobs = JobQueue(max_jobs)
+    server = JobServer(jobs, endpoint)
+    print('Serving jobs at %s' % endpoint)
+    try:
+        while True:
+            server.join(0.5)
+    except KeyboardInterrupt:
+        pass
+    server.close()
+    jobs.shutdown()
+    return 0
+
+
+def list_jobs(endpoint, cancel, output):
+    """List the jobs of a queue, optionally cancelling one first.
+    Input:
+        endpoint    : string - the endpoint of the queue.
+        cancel      : int - id of a job to cancel, None to only list the jobs.
+        output      : bool - print JSON instead of text.
+    Output:
+        returns     : int - exit code"""
+    if cancel is not None:
+        send_request(endpoint, {'action': 'cancel', 'job': cancel})
+    reply = send_request(endpoint, {'action': 'status'})
+    if output:
+        print(json.dumps(reply['jobs'], sort_keys=True))
+    else:
+        for job in reply['jobs']:
+            print('%s\t%s\t%s%%\t%s/%s files\t%s' % (job['job'], job['state'], job['progress_percent'],
+                                                    job['files_done'], job['files_found'], job['destdir']))
+    return 0
+
+
+def main(argv=None):
+    """Run a copy from the command line.
+    Input:
+        argv    : list - the command line arguments, sys.argv is used if omitted.
+    Output:
+        returns : int - exit code, 0 on success, 1 if there is not enough space, 2 on usage errors, 3 if the copy
+                  failed, 4 if some files could not be copied, 130 if cancelled"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    try:
+        if args.serve:
+            return serve(args.serve, args.max_jobs)
+        if args.jobs:
+            return list_jobs(args.jobs, args.cancel, args.json)
+    except JobQueueError as err:
+        sys.stderr.write('%s\n' % err)
+        return 3
+    if not args.dest:
+        parser.error('the following arguments are required: -d/--dest')
+    destdir = os.path.abspath(args.dest)
+    if args.extract:
+        if not os.path.isdir(destdir):
+            os.makedirs(destdir)
+        return extract_archive(os.path.abspath(args.extract), destdir, args.sources, args.json)
+    if not os.path.isdir(destdir):
+        parser.error('destination %s is not a directory' % destdir)
+    if args.verify_manifest:
+        return verify_manifest(destdir, args.json)
+    if args.resume:
+        if not Journal.exists(destdir):
+            parser.error('%s has no unfinished copy to resume' % destdir)
+        paramdict = {'destdir': destdir, 'resume': True}
+        if args.bwlimit or args.files_limit or args.schedule or args.nice or args.ionice:
+            paramdict.update({'bytes_per_second': args.bwlimit, 'files_per_second': args.files_limit,
+                              'throttle_schedule': args.schedule, 'nice': args.nice, 'io_class': args.ionice})
+    else:
+        if not args.sources:
+            parser.error('no sources given')
+        paramdict = {'destdir': destdir, 'filelist': [os.path.abspath(source) for source in args.sources],
+                     'flattencount': args.flatten, 'overwrite_opt': args.overwrite, 'workers': args.workers,
+                     'large_workers': args.large_workers, 'incremental': args.incremental, 'dedupe': args.dedupe,
+                     'preflight': args.preflight, 'bytes_per_second': args.bwlimit,
+                     'files_per_second': args.files_limit, 'throttle_schedule': args.schedule, 'nice': args.nice,
+                     'io_class': args.ionice, 'retries': args.retries, 'watch': args.watch, 'archive': args.archive}
+        if args.archive == 'tar.zst' and zstandard is None:
+            parser.error('the zstandard package is required for --archive tar.zst')
+        if args.archive_name and os.path.exists(os.path.join(destdir, args.archive_name + index_suffix)):
+            parser.error('an archive named %s already exists in %s' % (args.archive_name, destdir))
+        if args.archive:
+            paramdict.update({'archive_split': args.archive_split, 'archive_name': args.archive_name})
+        if args.watch_interval:
+            paramdict['watch_interval'] = args.watch_interval
+        paramdict.update({'include': args.include, 'exclude': args.exclude, 'exclude_junk': args.exclude_junk,
+                          'min_size': args.min_size, 'max_size': args.max_size, 'min_age': args.min_age,
+                          'max_age': args.max_age})
+        try:
+            FileFilter.from_params(paramdict)
+        except ValueError as err:
+            parser.error(str(err))
+        if args.timeline:
+            paramdict['timeline'] = os.path.abspath(args.timeline)
+        if args.verify:
+            paramdict['verify'] = args.verify
+            paramdict['hash_algorithm'] = args.hash
+    if args.submit:
+        try:
+            reply = send_request(args.submit, {'action': 'submit', 'params': paramdict, 'priority': args.priority})
+        except JobQueueError as err:
+            sys.stderr.write('%s\n' % err)
+            return 3
+        print(json.dumps(reply) if args.json else 'Job %s queued' % reply['job'])
+        return 0
+    # The job runs on a queue thread so that Ctrl-C cancels it cleanly and the journal is kept for --resume
+    jobs = JobQueue()
+    job = jobs.submit(paramdict, listener=ConsoleListener(sys.stderr if args.json else sys.stdout))
+    while not job.finished.is_set():
+        try:
+            job.finished.wait(0.5)
+        except KeyboardInterrupt:
+            jobs.cancel(job.job_id)
+    jobs.shutdown()
+    summary = job.summary
+    if args.json:
+        print(json.dumps(summary, sort_keys=True))
+    if summary['status'] == 'no_space':
+        return 1
+    if summary['status'] == 'failed':
+        return 3
+    if summary['status'] == 'cancelled':
+        return 130
+    if summary.get('files_failed'):
+        return 4
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import json
+import time
+import threading
+from collections import deque
+
+rate_window = 10.0
+phase_names = ('scan', 'stat', 'dedupe', 'mkdir', 'copy', 'metadata')
+
+
+class PhaseTimer():
+    """Context manager adding the time spent in a block to a phase of CopyMetrics."""
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.add_phase_time(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class CopyMetrics():
+    """Instrumentation of a copy run.
+    Tracks the transfer rate in bytes/sec and files/sec over a sliding window, the time spent in each phase of the
+    copy (scan, stat, dedupe, mkdir, copy, metadata) and the estimated time remaining. Phase times are summed over
+    all the threads, so they can add up to more than the run time. A timeline of snapshots can be kept and dumped as
+    JSON to diagnose slow jobs after the fact."""
+    def __init__(self, window=rate_window, keep_timeline=False):
+        self.window = window
+        self.keep_timeline = keep_timeline
+        self.started = time.time()
+        self.samples = deque()
+        self.phase_times = dict((name, 0.0) for name in phase_names)
+        self.phase_counts = dict((name, 0) for name in phase_names)
+        self.timeline = []
+        self.current_file = None
+        self.lock = threading.Lock()
+
+    def phase(self, name):
+        """Time a block of code as part of a phase.
+        Input:
+            name    : string - one of phase_names.
+        Output:
+            returns : PhaseTimer - to be used in a with statement"""
+        return PhaseTimer(self, name)
+
+    def add_phase_time(self, name, seconds):
+        """Add time spent in a phase.
+        Input:
+            name    : string - one of phase_names.
+            seconds : float - the time spent.
+        Output:
+            None"""
+        with self.lock:
+            self.phase_times[name] += seconds
+            self.phase_counts[name] += 1
+
+    def add_sample(self, copied_size, copied_count):
+        """Record the running totals, the rates are computed from the samples in the window.
+        Input:
+            copied_size     : integer - bytes processed so far.
+            copied_count    : integer - files processed so far.
+        Output:
+            None"""
+        now = time.time()
+        with self.lock:
+            self.samples.append((now, copied_size, copied_count))
+            while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+                self.samples.popleft()
+
+    def rates(self):
+        """Return the current transfer rates over the sliding window.
+        Input:
+            None
+        Output:
+            returns : tuple - (bytes per second, files per second)"""
+        with self.lock:
+            if len(self.samples) < 2:
+                return 0.0, 0.0
+            first = self.samples[0]
+            last = self.samples[-1]
+        elapsed = last[0] - first[0]
+        if elapsed <= 0:
+            return 0.0, 0.0
+        return (last[1] - first[1]) / elapsed, (last[2] - first[2]) / elapsed
+
+    def snapshot(self, copied_size, copied_count, filesize, filecount, scan_complete):
+        """Record a sample and return the current state of the run.
+        Input:
+            copied_size     : integer - bytes processed so far.
+            copied_count    : integer - files processed so far.
+            filesize        : integer - bytes found so far.
+            filecount       : integer - files found so far.
+            scan_complete   : bool - False while the totals are still estimates.
+        Output:
+            returns         : dict - elapsed, rates, eta_seconds (None if unknown), estimate, phases, current_file"""
+        self.add_sample(copied_size, copied_count)
+        bytes_per_second, files_per_second = self.rates()
+        remaining = max(filesize - copied_size, 0)
+        if bytes_per_second > 0:
+            eta = remaining / bytes_per_second
+        elif remaining == 0 and scan_complete:
+            eta = 0.0
+        else:
+            eta = None
+        snapshot = {'elapsed': time.time() - self.started,
+                    'copied_size': copied_size,
+                    'copied_count': copied_count,
+                    'filesize': filesize,
+                    'filecount': filecount,
+                    'bytes_per_second': bytes_per_second,
+                    'files_per_second': files_per_second,
+                    'eta_seconds': eta,
+                    'estimate': not scan_complete,
+                    'phases': self.phases(),
+                    'current_file': self.current_file}
+        if self.keep_timeline:
+            with self.lock:
+                self.timeline.append(snapshot)
+        return snapshot
+
+    def phases(self):
+        """Return the time spent in each phase.
+        Input:
+            None
+        Output:
+            returns : dict - phase name to {'seconds': float, 'count': int}"""
+        with self.lock:
+            return dict((name, {'seconds': self.phase_times[name], 'count': self.phase_counts[name]})
+                        for name in phase_names)
+
+    def dump(self, path, summary=None):
+        """Write the timeline of the run as JSON.
+        Input:
+            path    : string - the file to write.
+            summary : dict - the summary of the run, included in the file.
+        Output:
+            None"""
+        with self.lock:
+            timeline = list(self.timeline)
+        with open(path, 'w') as handle:
+            json.dump({'started': self.started, 'phases': self.phases(), 'summary': summary,
+                       'timeline': timeline}, handle, indent=1, sort_keys=True)
+
+
+def format_eta(seconds):
+    """Format an ETA for display.
+    Input:
+        seconds : float - seconds remaining, None if unknown.
+    Output:
+        returns : string - h:mm:ss or '--:--' if unknown"""
+    if seconds is None:
+        return '--:--'
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, (seconds % 3600) // 60, seconds % 60)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+import time
+import errno
+import heapq
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+outcome_names = ('copied', 'skipped', 'unchanged', 'deduplicated', 'failed', 'cancelled')
+retry_attempts = 3
+retry_backoff = 2.0
+# Errors that may go away on their own, such as a NAS dropping the connection, the other errors are not retried
+retry_errors = set([errno.EIO, errno.EAGAIN, errno.EBUSY, errno.EINTR, errno.ETIMEDOUT, errno.ESTALE,
+                    errno.ECONNRESET, errno.ECONNABORTED, errno.ENETDOWN, errno.ENETRESET, errno.ENETUNREACH,
+                    errno.EHOSTDOWN, errno.EHOSTUNREACH, errno.ENOLINK, errno.EREMOTEIO])
+
+
+class FileFailure():
+    """A file that could not be copied."""
+    __slots__ = ('path', 'destination', 'errno', 'error', 'retryable', 'attempts', 'superseded')
+
+    def __init__(self, path, destination):
+        self.path = path
+        self.destination = destination
+        self.errno = None
+        self.error = None
+        self.retryable = False
+        self.attempts = 0
+        self.superseded = False
+
+    def add_attempt(self, error):
+        """Record the error of an attempt.
+        Input:
+            error   : Exception - the error raised by the copy.
+        Output:
+            None"""
+        self.errno = getattr(error, 'errno', None)
+        self.error = getattr(error, 'strerror', None) or str(error) or error.__class__.__name__
+        # Errors without an errno, such as a verification mismatch, are worth another try as well
+        self.retryable = self.errno is None or self.errno in retry_errors
+        self.attempts += 1
+
+    def as_dict(self):
+        return {'path': self.path, 'destination': self.destination, 'errno': self.errno,
+                'error_name': errno.errorcode.get(self.errno), 'error': self.error, 'attempts': self.attempts}
+
+
+class OutcomeStore():
+    """Outcome of every file of a copy run.
+    Only counts are kept for the files that went through, the failures are kept in full so that they can be retried
+    and reported. A failed file that later succeeds is no longer counted as failed."""
+    def __init__(self):
+        self.counts = dict((name, 0) for name in outcome_names)
+        self.failures = OrderedDict()
+        self.failed_destinations = {}
+        self.lock = threading.Lock()
+
+    def record(self, outcome, path=None, destination=None):
+        """Count the outcome of a file.
+        Input:
+            outcome     : string - one of outcome_names, except failed, see record_failure.
+            path        : string - the source file.
+            destination : string - the destination file.
+        Output:
+            None"""
+        with self.lock:
+            self.counts[outcome] += 1
+            if outcome != 'copied' or destination is None:
+                return
+            if path in self.failures:
+                # A retry went through
+                del self.failures[path]
+                self.counts['failed'] -= 1
+            failed = self.failed_destinations.get(destination)
+            if failed is not None and failed.path != path:
+                # A later file was written to the same destination, the failed one would have been overwritten
+                failed.superseded = True
+
+    def record_failure(self, path, destination, error):
+        """Record a file that could not be copied, a file failing again has its attempts counted.
+        Input:
+            path        : string - the source file.
+            destination : string - the destination file.
+            error       : Exception - the error raised by the copy.
+        Output:
+            returns     : FileFailure"""
+        with self.lock:
+            failure = self.failures.get(path)
+            if failure is None:
+                failure = self.failures[path] = FileFailure(path, destination)
+                self.failed_destinations[destination] = failure
+                self.counts['failed'] += 1
+            failure.add_attempt(error)
+            return failure
+
+    def failure(self, path):
+        """Return the failure of a file, None if it has not failed.
+        Input:
+            path    : string - the source file.
+        Output:
+            returns : FileFailure or None"""
+        with self.lock:
+            return self.failures.get(path)
+
+    def summary(self):
+        """Return the counts of each outcome and the list of failures.
+        Input:
+            None
+        Output:
+            returns : tuple - (dict outcome name to count, list of failures as dicts sorted by path)"""
+        with self.lock:
+            counts = dict(self.counts)
+            failures = [failure.as_dict() for failure in self.failures.values()]
+        return counts, sorted(failures, key=lambda failure: failure['path'])
+
+
+class RetryQueue(threading.Thread):
+    """Retry pass of a copy run.
+    Failed files are retried on their own thread once their backoff has elapsed, the delay doubling after each
+    attempt, so the main copy lanes never wait on them. The files due at the same time are retried as one batch."""
+    def __init__(self, retry, attempts=retry_attempts, backoff=retry_backoff, keep_running=None):
+        super(RetryQueue, self).__init__()
+        self.daemon = True
+        self.retry = retry
+        self.attempts = attempts
+        self.backoff = backoff
+        self.keep_running = keep_running
+        self.queued = []
+        self.counter = itertools.count()
+        self.closing = False
+        self.condition = threading.Condition()
+        self.start()
+
+    def schedule(self, item, attempt):
+        """Queue a failed file for another attempt.
+        Input:
+            item    : object - passed back to the retry callable.
+            attempt : integer - the number of attempts made so far.
+        Output:
+            returns : bool - False if the file has used up its attempts"""
+        if attempt > self.attempts:
+            return False
+        due = time.time() + self.backoff * 2 ** (attempt - 1)
+        with self.condition:
+            heapq.heappush(self.queued, (due, next(self.counter), item, attempt))
+            self.condition.notify_all()
+        return True
+
+    def running(self):
+        return self.keep_running is None or self.keep_running()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running():
+                    if not self.queued:
+                        if self.closing:
+                            return
+                        self.condition.wait(0.5)
+                        continue
+                    delay = self.queued[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self.condition.wait(min(delay, 0.5))
+                else:
+                    return
+                batch = []
+                now = time.time()
+                while self.queued and self.queued[0][0] <= now:
+                    batch.append(heapq.heappop(self.queued))
+            log.info('Retrying %s files', len(batch))
+            for due, count, item, attempt in batch:
+                if not self.running():
+                    break
+                try:
+                    self.retry(item, attempt + 1)
+                except Exception:
+                    log.error('Retry failed', exc_info=True)
+
+    def close(self):
+        """Stop accepting files from the main copy, the thread ends once the queued files have been retried or the
+        run is cancelled.
+        Input:
+            None
+        Output:
+            None"""
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import os
+
+
+class PathPlanner():
+    """Plan the destination paths of a selection of files.
+    The destination of a directory is computed once from the destination of its parent and cached, so the files of a
+    directory and the directories sharing a common prefix reuse the work done for their parents instead of splitting
+    and joining every path from the root. The result is the same as FileOperations.get_dest_filepath for absolute
+    source paths."""
+    def __init__(self, destpath, flattencount):
+        self.destpath = os.path.abspath(destpath)
+        self.flattencount = flattencount
+        # source directory -> (destination directory, depth of the source directory)
+        self.dirs = {}
+
+    def dest_dir(self, sourcedir):
+        """Return the destination directory of a source directory.
+        Input:
+            sourcedir   : string - absolute path of the source directory.
+        Output:
+            returns     : tuple - (destination directory, depth of the source directory)"""
+        planned = self.dirs.get(sourcedir)
+        if planned is None:
+            parent, name = os.path.split(sourcedir)
+            if not name:
+                # The root of a drive, nothing is kept from it
+                planned = (self.destpath, 0)
+            else:
+                parent_dest, depth = self.dest_dir(parent)
+                depth += 1
+                if depth > self.flattencount:
+                    planned = (os.path.join(parent_dest, name), depth)
+                else:
+                    planned = (self.destpath, depth)
+            self.dirs[sourcedir] = planned
+        return planned
+
+    def dest_filepath(self, filepath):
+        """Determine the flattened destination path of a file.
+        Input:
+            filepath    : string - absolute path of the source file.
+        Output:
+            returns     : string - the destination path taking into account the flattencount."""
+        sourcedir, name = os.path.split(filepath)
+        if not name:
+            return self.dest_dir(sourcedir)[0]
+        return os.path.join(self.dest_dir(sourcedir)[0], name)
+
+    def plan(self, filelist):
+        """Determine the destination paths of a list of files in one pass.
+        Input:
+            filelist    : list - absolute paths of the source files.
+        Output:
+            returns     : list - the destination paths, in the same order"""
+        # Files are grouped by the text before their last separator, which is cheaper than os.path.split
+        prefixes = {}
+        destlist = []
+        for filepath in filelist:
+            head, sep, name = filepath.rpartition(os.sep)
+            prefix = prefixes.get(head)
+            if prefix is None:
+                prefix = prefixes[head] = os.path.join(self.dest_dir(os.path.split(filepath)[0])[0], '')
+            destlist.append(prefix + name)
+        return destlist
+
+    def collisions(self, filelist, destlist=None):
+        """Find the files that end up at the same destination once their directories are trimmed.
+        Input:
+            filelist    : list - absolute paths of the source files.
+            destlist    : list - the destination paths returned by plan(), computed if omitted.
+        Output:
+            returns     : dict - destination path to the list of source paths colliding on it"""
+        if destlist is None:
+            destlist = self.plan(filelist)
+        sources = {}
+        collided = set()
+        for filepath, destination in zip(filelist, destlist):
+            if destination in sources:
+                sources[destination].append(filepath)
+                collided.add(destination)
+            else:
+                sources[destination] = [filepath]
+        return dict((destination, sources[destination]) for destination in collided)
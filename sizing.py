@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from copybackend import allocated_size
+
+sizing_workers = 8
+sizing_interval = 0.1
+max_cached_dirs = 100000
+
+
+def collapse_paths(pathlist):
+    """Remove the selected paths that are already covered by another selected directory.
+    The paths are sorted on their components so that the paths under a directory come right after it, before a
+    sibling such as a-old that sorts between a and a/c as a string.
+    Input:
+        pathlist    : list - selected files and directories.
+    Output:
+        returns     : list - sorted paths with the duplicates and nested selections removed"""
+    collapsed = []
+    for path in sorted(set(pathlist), key=lambda path: path.split(os.sep)):
+        if collapsed and (path == collapsed[-1] or path.startswith(os.path.join(collapsed[-1], ''))):
+            continue
+        collapsed.append(path)
+    return collapsed
+
+
+class DirectorySizer():
+    """Pre-flight sizing of a selection of files and directories.
+    Directories are listed concurrently on a thread pool, the partial totals are reported as they come in.
+    The files directly in each directory are totalled and cached along with the list of its subdirectories, keyed by
+    the modified time of the directory, so an unchanged tree only costs one stat per directory the next time.
+    A file rewritten in place does not change the modified time of its directory, so the totals are an estimate and
+    the copy still checks the space left as it proceeds. Files are counted by the space allocated to them, so that
+    sparse files count for their data rather than their size. With filters the excluded directories are not listed
+    and the excluded files not counted, the cache holds the totals of the last rules used for each directory.
+    The cache keeps the max_cached directories used most recently, the others are listed again when needed."""
+    def __init__(self, workers=sizing_workers, max_cached=max_cached_dirs):
+        self.workers = workers
+        self.max_cached = max_cached
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def size_dir(self, dirpath, filters=None):
+        """Total the files directly in a directory, using the cache if the directory is unchanged.
+        Input:
+            dirpath : string - the directory.
+            filters : FileFilter - the include and exclude rules, every file is counted if omitted.
+        Output:
+            returns : tuple - (number of files, bytes, list of subdirectories)"""
+        try:
+            mtime = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            return 0, 0, []
+        key = None
+        if filters is not None:
+            key = filters.key if filters.cacheable else False
+        with self.lock:
+            cached = self.cache.get(dirpath)
+            if cached is not None:
+                self.cache.move_to_end(dirpath)
+        if cached is not None and cached[0] == mtime and cached[1] == key:
+            return cached[2:]
+        filecount = 0
+        filesize = 0
+        subdirs = []
+        try:
+            entries = list(os.scandir(dirpath))
+        except OSError:
+            return 0, 0, []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink():  # Same as the copy, symlinked dirs are not followed
+                        if filters is None or not filters.excludes_dir(entry.path, entry.name):
+                            subdirs.append(entry.path)
+                    continue
+                if filters is not None and filters.excludes_file(entry.path, entry.name):
+                    continue
+                st = entry.stat()
+                if filters is not None and not filters.accepts_stat(st.st_size, st.st_mtime):
+                    continue
+                filesize += allocated_size(st)
+            except OSError:
+                pass
+            filecount += 1
+        if key is not False:
+            with self.lock:
+                self.cache[dirpath] = (mtime, key, filecount, filesize, subdirs)
+                self.cache.move_to_end(dirpath)
+                while len(self.cache) > self.max_cached:
+                    self.cache.popitem(last=False)
+        return filecount, filesize, subdirs
+
+    def size(self, pathlist, progress=None, keep_running=None, filters=None):
+        """Total the files of a selection.
+        Input:
+            pathlist    : list - absolute paths of the selected files and directories, nested selections are
+                          only counted once.
+            progress    : callable - called with the running (number of files, bytes) totals at most every
+                          sizing_interval seconds.
+            keep_running: callable - polled while sizing, the sizing is interrupted when it returns False.
+            filters     : FileFilter - the include and exclude rules, every file is counted if omitted.
+        Output:
+            returns     : tuple - (number of files, bytes, dict of selected path to (number of files, bytes)),
+                          None if interrupted"""
+        roots = collapse_paths(pathlist)
+        totals = dict((path, None) for path in pathlist)
+        for path in roots:
+            totals[path] = [0, 0]
+        filecount = 0
+        filesize = 0
+        last_report = 0
+        pending = {}
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for path in roots:
+                if os.path.isdir(path):
+                    pending[executor.submit(self.size_dir, path, filters)] = path
+                else:
+                    totals[path] = list(self.size_file(path, filters))
+                    filecount += totals[path][0]
+                    filesize += totals[path][1]
+            while pending:
+                if keep_running is not None and not keep_running():
+                    return None
+                done, waiting = wait(pending, timeout=sizing_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    root = pending.pop(future)
+                    dircount, dirsize, subdirs = future.result()
+                    totals[root][0] += dircount
+                    totals[root][1] += dirsize
+                    filecount += dircount
+                    filesize += dirsize
+                    for subdir in subdirs:
+                        pending[executor.submit(self.size_dir, subdir, filters)] = root
+                now = time.time()
+                if progress is not None and now - last_report >= sizing_interval:
+                    last_report = now
+                    progress(filecount, filesize)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+        # Nested selections report the totals of their own subtree, from the cache filled by the walk
+        for path in totals:
+            if totals[path] is None:
+                totals[path] = list(self.cached_total(path, filters))
+        if progress is not None:
+            progress(filecount, filesize)
+        return filecount, filesize, dict((path, tuple(total)) for path, total in totals.items())
+
+    def size_file(self, path, filters=None):
+        """Total a selected file.
+        Input:
+            path    : string - the file.
+            filters : FileFilter - the include and exclude rules.
+        Output:
+            returns : tuple - (number of files, bytes), (0, 0) if the file is excluded"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return 1, 0
+        if filters is not None and not filters.accepts(path, st):
+            return 0, 0
+        return 1, allocated_size(st)
+
+    def cached_total(self, path, filters=None):
+        """Total a file or a directory tree from the cache, the directories missing from it are listed.
+        Input:
+            path    : string - the file or directory.
+            filters : FileFilter - the include and exclude rules.
+        Output:
+            returns : tuple - (number of files, bytes)"""
+        if not os.path.isdir(path):
+            return self.size_file(path, filters)
+        filecount = 0
+        filesize = 0
+        dirs = [path]
+        while dirs:
+            dircount, dirsize, subdirs = self.size_dir(dirs.pop(), filters)
+            filecount += dircount
+            filesize += dirsize
+            dirs.extend(subdirs)
+        return filecount, filesize
@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive
+from archive import ArchiveError, ArchiveWriter, extract
+from copyengine import CopyEngine
+from listener import EngineListener
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tempdir, 'src')
+        self.dest = os.path.join(self.tempdir, 'dest')
+        self.out = os.path.join(self.tempdir, 'out')
+        os.mkdir(self.dest)
+        self.files = {}
+        for index in range(10):
+            name = os.path.join('photos' if index % 2 else 'docs', 'f%d' % index)
+            path = os.path.join(self.src, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            self.files[name] = os.urandom(30000 + index)
+            with open(path, 'wb') as handle:
+                handle.write(self.files[name])
+            os.utime(path, (1000000000 + index, 1000000000 + index))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def pack(self, archive_format):
+        paramdict = {'destdir': self.dest, 'filelist': [self.src], 'overwrite_opt': None, 'archive': archive_format,
+                     'flattencount': len(self.src.strip(os.sep).split(os.sep)), 'archive_split': 100000,
+                     'archive_name': 'backup'}
+        summary = CopyEngine(EngineListener()).run(paramdict)
+        self.assertEqual((summary['status'], summary['files_copied']), ('complete', 10))
+        return summary['archive']
+
+    def check_extract(self, index, patterns=None):
+        filecount, filesize = extract(index, self.out, patterns)
+        names = [name for name in self.files if not patterns or name.startswith(patterns[0])]
+        self.assertEqual((filecount, filesize), (len(names), sum(len(self.files[name]) for name in names)))
+        for name in names:
+            path = os.path.join(self.out, name)
+            with open(path, 'rb') as handle:
+                self.assertEqual(handle.read(), self.files[name])
+            self.assertEqual(os.stat(path).st_mtime, os.stat(os.path.join(self.src, name)).st_mtime)
+        return names
+
+    def test_split_round_trip(self):
+        packed = self.pack('tar')
+        # Three files fit in a 100000 byte volume
+        self.assertEqual(len(packed['volumes']), 4)
+        members = []
+        for volume in packed['volumes']:
+            with tarfile.open(os.path.join(self.dest, volume)) as handle:
+                members.extend(handle.getnames())
+        self.assertEqual(sorted(members), sorted(name.replace(os.sep, '/') for name in self.files))
+        self.check_extract(packed['index'])
+        shutil.rmtree(self.out)
+        self.assertEqual(len(self.check_extract(packed['index'], ['photos'])), 5)
+        self.assertFalse(os.path.exists(os.path.join(self.out, 'docs')))
+
+    def test_compressed_round_trip(self):
+        if archive.zstandard is None:
+            self.skipTest('the zstandard package is not installed')
+        packed = self.pack('tar.zst')
+        self.assertGreater(len(packed['volumes']), 1)
+        self.check_extract(packed['index'], ['docs/f4'])
+
+    def test_missing_volume(self):
+        packed = self.pack('tar')
+        os.remove(os.path.join(self.dest, packed['volumes'][-1]))
+        self.assertRaises(ArchiveError, extract, packed['index'], self.out)
+
+    def test_outside_destination(self):
+        writer = ArchiveWriter(self.dest, 'evil')
+        writer.add(os.path.join(self.src, 'docs', 'f0'), '../f0')
+        packed = writer.close()
+        self.assertRaises(ArchiveError, extract, packed['index'], self.out)
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir, 'f0')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mclub_cli
+
+
+class CliTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tempdir, 'src')
+        self.dest = os.path.join(self.tempdir, 'dest')
+        os.makedirs(os.path.join(self.src, 'sub'))
+        os.mkdir(self.dest)
+        for name in ('a', os.path.join('sub', 'b')):
+            with open(os.path.join(self.src, name), 'wb') as handle:
+                handle.write(name.encode() * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def run_cli(self, *argv):
+        stdout = io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(io.StringIO()):
+            code = mclub_cli.main(list(argv))
+        return code, stdout.getvalue()
+
+    def test_json_summary(self):
+        flatten = str(len(self.src.strip(os.sep).split(os.sep)))
+        code, output = self.run_cli(self.src, '-d', self.dest, '-f', flatten, '--incremental', '--json')
+        self.assertEqual(code, 0)
+        summary = json.loads(output)
+        self.assertEqual((summary['status'], summary['files_copied']), ('complete', 2))
+        self.assertTrue(os.path.isfile(os.path.join(self.dest, 'sub', 'b')))
+        code, output = self.run_cli(self.src, '-d', self.dest, '-f', flatten, '--incremental', '--json')
+        self.assertEqual(json.loads(output)['files_unchanged'], 2)
+        code, output = self.run_cli('-d', self.dest, '--verify-manifest', '--json')
+        self.assertEqual((code, json.loads(output)['checked']), (0, 2))
+
+    def test_text_summary(self):
+        code, output = self.run_cli(self.src, '-d', self.dest)
+        self.assertEqual(code, 0)
+        self.assertIn('Files processed:\t2\n', output)
+
+    def test_usage_errors(self):
+        for argv in ((self.src,), ('-d', self.dest), ('-d', self.dest, '--resume'),
+                     (self.src, '-d', os.path.join(self.src, 'a')), (self.src, '-d', self.dest, '--include', 're:(')):
+            with redirect_stderr(io.StringIO()):
+                with self.assertRaises(SystemExit) as context:
+                    mclub_cli.main(list(argv))
+            self.assertEqual(context.exception.code, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import sys
+import errno
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import copybackend
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt(count):
+    raise Interrupted()
+
+
+class CopyBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tempdir, 'src')
+        self.dst = os.path.join(self.tempdir, 'dst')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_data(self, size):
+        data = os.urandom(size)
+        with open(self.src, 'wb') as handle:
+            handle.write(data)
+        return data
+
+    def read_dst(self):
+        with open(self.dst, 'rb') as handle:
+            return handle.read()
+
+    def test_range_methods(self):
+        data = self.write_data(3 * copybackend.buffer_size + 100)
+        for name, method in copybackend.range_methods:
+            with open(self.src, 'rb') as src_handle:
+                with open(self.dst, 'wb') as dst_handle:
+                    # Copied to the same offset, the start of the destination is left as a hole
+                    self.assertEqual(method(src_handle.fileno(), dst_handle.fileno(), 1000, len(data) - 1000),
+                                     len(data) - 1000, name)
+            self.assertEqual(self.read_dst(), b'\0' * 1000 + data[1000:], name)
+
+    def test_unsupported_method_falls_back(self):
+        def unsupported(src_fd, dst_fd, offset, count):
+            raise OSError(errno.EXDEV, 'Cross-device link')
+        data = self.write_data(100000)
+        devices = (-1, -1)
+        range_methods = copybackend.range_methods
+        copybackend.range_methods = [('unsupported', unsupported)] + range_methods
+        try:
+            with open(self.src, 'rb') as src_handle:
+                with open(self.dst, 'wb') as dst_handle:
+                    done, name = copybackend.copy_range(src_handle.fileno(), dst_handle.fileno(), 0, len(data),
+                                                        devices)
+            self.assertEqual((done, name), (len(data), range_methods[0][0]))
+            self.assertIn(('unsupported', devices), copybackend._disabled)
+        finally:
+            copybackend.range_methods = range_methods
+            copybackend._disabled.discard(('unsupported', devices))
+        self.assertEqual(self.read_dst(), data)
+
+    def test_copy_file(self):
+        data = self.write_data(copybackend.preallocate_size + 12345)
+        os.chmod(self.src, 0o640)
+        os.utime(self.src, (1000000000, 1000000000))
+        with open(self.dst, 'wb') as handle:
+            handle.write(b'x' * (len(data) + 1000))
+        self.assertIn(copybackend.copy_file(self.src, self.dst), ('clone', 'copy_file_range', 'sendfile', 'readinto'))
+        self.assertEqual(self.read_dst(), data)
+        st = os.stat(self.dst)
+        self.assertEqual((st.st_mode & 0o777, st.st_mtime), (0o640, 1000000000))
+        self.write_data(0)
+        self.assertIn(copybackend.copy_data(self.src, self.dst), ('clone', 'empty'))
+        self.assertEqual(self.read_dst(), b'')
+
+    def test_throttled_copy(self):
+        data = self.write_data(2 * copybackend.buffer_size + 10)
+        chunks = []
+        copybackend.copy_data(self.src, self.dst, chunks.append)
+        self.assertEqual(self.read_dst(), data)
+        if chunks:
+            self.assertEqual(sum(chunks), len(data))
+            self.assertLessEqual(max(chunks), copybackend.buffer_size)
+
+    def write_sparse(self, size=32 * 1024 * 1024):
+        with open(self.src, 'wb') as handle:
+            handle.write(os.urandom(4096))
+            handle.seek(size - 4096)
+            handle.write(os.urandom(4096))
+        if copybackend.allocated_size(os.stat(self.src)) >= size:
+            self.skipTest('the filesystem does not support sparse files')
+
+    def test_sparse_copy(self):
+        size = 32 * 1024 * 1024
+        self.write_sparse(size)
+        with open(self.src, 'rb') as handle:
+            extents = copybackend.data_extents(handle.fileno(), size)
+            data = handle.read()
+        self.assertEqual(extents[0][0], 0)
+        self.assertEqual(sum(extents[-1]), size)
+        self.assertLess(sum(length for start, length in extents), size)
+        self.assertIn(copybackend.copy_data(self.src, self.dst), ('sparse', 'clone'))
+        self.assertEqual(self.read_dst(), data)
+        self.assertLess(copybackend.allocated_size(os.stat(self.dst)), size)
+        os.remove(self.dst)
+        hasher = hashlib.blake2b()
+        copybackend.copy_data_hashed(self.src, self.dst, hasher)
+        self.assertEqual(hasher.hexdigest(), hashlib.blake2b(data).hexdigest())
+        self.assertEqual(self.read_dst(), data)
+        self.assertLess(copybackend.allocated_size(os.stat(self.dst)), size)
+
+    def test_preallocated_copy(self):
+        data = self.write_data(copybackend.preallocate_size + 4096)
+        with open(self.dst, 'wb') as handle:
+            handle.write(b'x' * (2 * len(data)))
+        copybackend.copy_data(self.src, self.dst, lambda count: None)
+        self.assertEqual(self.read_dst(), data)
+
+    def test_sparse_failure_truncates(self):
+        self.write_sparse()
+        self.assertRaises(Interrupted, copybackend.copy_data, self.src, self.dst, interrupt)
+        self.assertEqual(os.path.getsize(self.dst), 0)
+
+    def test_sparse_hashed_failure_truncates(self):
+        self.write_sparse()
+        self.assertRaises(Interrupted, copybackend.copy_data_hashed, self.src, self.dst, hashlib.blake2b(),
+                          interrupt)
+        self.assertEqual(os.path.getsize(self.dst), 0)
+
+    def test_preallocated_failure_truncates(self):
+        with open(self.src, 'wb') as handle:
+            handle.write(os.urandom(copybackend.preallocate_size + 4096))
+        self.assertRaises(Interrupted, copybackend.copy_data, self.src, self.dst, interrupt)
+        self.assertEqual(os.path.getsize(self.dst), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import shutil
+import threading
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import copyengine
+from copyengine import CopyEngine, FileOperations
+from listener import EngineListener
+
+
+def write_file(path, data, mtime=None):
+    with open(path, 'wb') as handle:
+        handle.write(data)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def read_file(path):
+    with open(path, 'rb') as handle:
+        return handle.read()
+
+
+class CopyEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tempdir, 'src')
+        self.dest = os.path.join(self.tempdir, 'dest')
+        os.mkdir(self.src)
+        os.mkdir(self.dest)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def run_copy(self, **params):
+        paramdict = {'destdir': self.dest, 'filelist': [self.src], 'flattencount': 0, 'overwrite_opt': None}
+        paramdict.update(params)
+        return CopyEngine(EngineListener()).run(paramdict)
+
+    def dest_path(self, name):
+        return os.path.join(self.dest, self.src.lstrip(os.sep), name)
+
+    def test_overwrite_dedupe_link(self):
+        data = os.urandom(100000)
+        write_file(os.path.join(self.src, 'a'), data, time.time() - 100)
+        write_file(os.path.join(self.src, 'b'), data, time.time() - 100)
+        self.run_copy(dedupe='link')
+        if os.stat(self.dest_path('a')).st_nlink < 2:
+            self.skipTest('the destination filesystem does not support hard links')
+        write_file(os.path.join(self.src, 'a'), b'new data')
+        summary = self.run_copy(overwrite_opt='newer')
+        self.assertEqual(summary['status'], 'complete')
+        self.assertEqual(read_file(self.dest_path('a')), b'new data')
+        self.assertEqual(read_file(self.dest_path('b')), data)
+
+    def test_dedupe_across_sources(self):
+        data = os.urandom(200000)
+        for name in ('s1/a', 's2/b', 's2/c'):
+            path = os.path.join(self.src, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            write_file(path, data)
+        write_file(os.path.join(self.src, 's2', 'd'), os.urandom(200000))
+        filelist = [os.path.join(self.src, 's1'), os.path.join(self.src, 's2')]
+        flattencount = len(self.src.strip(os.sep).split(os.sep)) + 1
+        summary = self.run_copy(filelist=filelist, flattencount=flattencount, dedupe='skip')
+        self.assertEqual((summary['files_copied'], summary['files_deduplicated']), (2, 2))
+        self.assertEqual(summary['bytes_deduplicated'], 2 * len(data))
+        self.assertEqual(sorted(os.listdir(self.dest)), ['a', 'd'])
+        shutil.rmtree(self.dest)
+        os.mkdir(self.dest)
+        summary = self.run_copy(filelist=filelist, flattencount=flattencount, dedupe='link')
+        self.assertEqual(summary['files_deduplicated'], 2)
+        for name in ('a', 'b', 'c'):
+            self.assertEqual(read_file(os.path.join(self.dest, name)), data)
+        if os.stat(os.path.join(self.dest, 'a')).st_nlink == 3:
+            self.assertEqual(os.stat(os.path.join(self.dest, 'b')).st_ino, os.stat(os.path.join(self.dest, 'a')).st_ino)
+
+    def test_dedupe_skip_different_tail(self):
+        head = os.urandom(64 * 1024)
+        write_file(os.path.join(self.src, 'a'), head + b'a' * 30000)
+        write_file(os.path.join(self.src, 'b'), head + b'b' * 30000)
+        summary = self.run_copy(dedupe='skip')
+        self.assertEqual(summary['files_deduplicated'], 0)
+        self.assertEqual(read_file(self.dest_path('b')), head + b'b' * 30000)
+
+    def test_dedupe_link_overwritten_original(self):
+        # s1/x/a and s2/x/a share a destination, s3/y/c must not be linked to it once s2/x/a is written there
+        content_a = os.urandom(100000)
+        content_b = os.urandom(100000)
+        for name, data in (('s1/x/a', content_a), ('s2/x/a', content_b), ('s3/y/c', content_a)):
+            path = os.path.join(self.src, name)
+            os.makedirs(os.path.dirname(path))
+            write_file(path, data)
+        filelist = [os.path.join(self.src, name) for name in ('s1', 's2', 's3')]
+        flattencount = len(self.src.strip(os.sep).split(os.sep)) + 1
+        summary = self.run_copy(filelist=filelist, flattencount=flattencount, overwrite_opt='either', dedupe='link')
+        self.assertEqual(summary['status'], 'complete')
+        self.assertEqual(read_file(os.path.join(self.dest, 'x', 'a')), content_b)
+        self.assertEqual(read_file(os.path.join(self.dest, 'y', 'c')), content_a)
+
+    def test_cancelled_large_copy_recopied(self):
+        resumable_size, checkpoint_bytes = copyengine.resumable_size, copyengine.checkpoint_bytes
+        copyengine.resumable_size = copyengine.checkpoint_bytes = 1024 * 1024
+        try:
+            data = os.urandom(8 * 1024 * 1024)
+            write_file(os.path.join(self.src, 'large'), data, time.time() - 100)
+            engine = CopyEngine(EngineListener())
+            paramdict = {'destdir': self.dest, 'filelist': [self.src], 'flattencount': 0, 'overwrite_opt': None,
+                         'bytes_per_second': 4 * 1024 * 1024}
+            timer = threading.Timer(0.6, setattr, (engine, 'must_run', False))
+            timer.start()
+            summary = engine.run(paramdict)
+            timer.join()
+            self.assertEqual(summary['status'], 'cancelled')
+            self.assertLess(os.path.getsize(self.dest_path('large')), len(data))
+            # A new job without resume still completes the file
+            summary = self.run_copy()
+        finally:
+            copyengine.resumable_size, copyengine.checkpoint_bytes = resumable_size, checkpoint_bytes
+        self.assertEqual(summary['status'], 'complete')
+        self.assertEqual(read_file(self.dest_path('large')), data)
+
+    def test_collapse_nested_selection(self):
+        parent = os.path.join(self.src, 'a')
+        child = os.path.join(parent, 'c')
+        sibling = os.path.join(self.src, 'a-old')
+        self.assertEqual(FileOperations().collapse_paths([parent, sibling, child]), [parent, sibling])
+        os.makedirs(child)
+        os.mkdir(sibling)
+        write_file(os.path.join(child, 'f'), b'f')
+        write_file(os.path.join(sibling, 'g'), b'g')
+        summary = self.run_copy(filelist=[parent, sibling, child], overwrite_opt='either')
+        self.assertEqual(summary['files_found'], 2)
+
+    def wait_for(self, path, timeout=10):
+        deadline = time.time() + timeout
+        while not os.path.exists(path) and time.time() < deadline:
+            time.sleep(0.1)
+        return os.path.exists(path)
+
+    def test_watch_min_age(self):
+        write_file(os.path.join(self.src, 'old'), b'old', time.time() - 100)
+        write_file(os.path.join(self.src, 'recent'), b'recent')
+        engine = CopyEngine(EngineListener())
+        paramdict = {'destdir': self.dest, 'filelist': [self.src], 'flattencount': 0, 'overwrite_opt': None,
+                     'watch': True, 'watch_interval': 0.2, 'watch_settle': 0.1, 'min_age': 1}
+        runner = threading.Thread(target=engine.run, args=(paramdict,))
+        runner.start()
+        try:
+            self.assertTrue(self.wait_for(self.dest_path('old')))
+            # Created after the job started, copied once it is a second old
+            write_file(os.path.join(self.src, 'new'), b'new')
+            self.assertFalse(os.path.exists(self.dest_path('new')))
+            self.assertTrue(self.wait_for(self.dest_path('new')))
+            # Too recent for the copy, picked up by the watch
+            self.assertTrue(self.wait_for(self.dest_path('recent')))
+        finally:
+            engine.must_run = False
+            runner.join()
+
+    def test_archive_space_sparse(self):
+        sparse = os.path.join(self.src, 'sparse')
+        with open(sparse, 'wb') as handle:
+            handle.truncate(64 * 1024 * 1024)
+        if os.stat(sparse).st_blocks * 512 >= 64 * 1024 * 1024:
+            self.skipTest('the filesystem does not support sparse files')
+        get_free_space = FileOperations.get_free_space
+        FileOperations.get_free_space = lambda self, path: 16 * 1024 * 1024
+        try:
+            summary = self.run_copy(archive='tar')
+        finally:
+            FileOperations.get_free_space = get_free_space
+        self.assertEqual(summary['status'], 'no_space')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from copyengine import FileMeta
+from dedupe import DedupeEntry, DuplicateIndex, partial_size
+
+
+class DuplicateIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def entry(self, name, data):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'wb') as handle:
+            handle.write(data)
+        return DedupeEntry(FileMeta.from_path(path), os.path.join(self.tempdir, 'dest', name))
+
+    def test_same_content(self):
+        index = DuplicateIndex()
+        data = os.urandom(partial_size * 3)
+        first = self.entry('first', data)
+        self.assertIsNone(index.match(first))
+        self.assertIs(index.match(self.entry('second', data)), first)
+
+    def test_different_tail_within_two_blocks(self):
+        # Files up to two blocks long are hashed whole, a difference past the first block is not missed
+        index = DuplicateIndex()
+        head = os.urandom(partial_size)
+        tail = os.urandom(30 * 1024)
+        self.assertIsNone(index.match(self.entry('first', head + tail)))
+        self.assertIsNone(index.match(self.entry('second', head + tail[::-1])))
+
+    def test_different_middle(self):
+        index = DuplicateIndex()
+        data = bytearray(os.urandom(partial_size * 4))
+        self.assertIsNone(index.match(self.entry('first', bytes(data))))
+        data[partial_size * 2] ^= 0xff
+        self.assertIsNone(index.match(self.entry('second', bytes(data))))
+
+    def test_candidates_do_not_read(self):
+        index = DuplicateIndex()
+        first = self.entry('first', b'data')
+        second = self.entry('second', b'data')
+        os.remove(first.meta.path)
+        os.remove(second.meta.path)
+        self.assertEqual(index.candidates(first), [])
+        self.assertEqual(index.candidates(second), [first])
+        self.assertIsNone(first.partial_digest)
+
+    def test_duplicate_of_duplicate(self):
+        index = DuplicateIndex()
+        data = os.urandom(1000)
+        first = self.entry('first', data)
+        second = self.entry('second', data)
+        third = self.entry('third', data)
+        self.assertIsNone(index.match(first))
+        second.original = index.match(second)
+        self.assertIs(index.match(third, [second]), first)
+
+    def test_empty_files(self):
+        index = DuplicateIndex()
+        self.assertIsNone(index.match(self.entry('first', b'')))
+        self.assertIsNone(index.match(self.entry('second', b'')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from copyengine import CopyEngine
+from filters import FileFilter, parse_age, split_patterns
+from listener import EngineListener
+
+
+class FileFilterTest(unittest.TestCase):
+    def test_patterns(self):
+        rules = FileFilter(exclude=['*.tmp', 'build/*.o', 'cache/', 're:/old-\\d+/', 're:\\.bak\\d*$'])
+        self.assertTrue(rules.excludes_file('/src/a.tmp', 'a.tmp'))
+        self.assertFalse(rules.excludes_file('/src/a.txt', 'a.txt'))
+        # A relative path pattern matches at any depth
+        self.assertTrue(rules.excludes_file('/src/x/build/a.o', 'a.o'))
+        self.assertFalse(rules.excludes_file('/src/x/a.o', 'a.o'))
+        self.assertTrue(rules.excludes_file('/src/a.bak2', 'a.bak2'))
+        self.assertTrue(rules.excludes_dir('/src/old-12', 'old-12'))
+        # A pattern ending with / only matches directories
+        self.assertTrue(rules.excludes_dir('/src/cache', 'cache'))
+        self.assertFalse(rules.excludes_file('/src/cache', 'cache'))
+
+    def test_include(self):
+        rules = FileFilter(include=['*.jpg', '*.png'], exclude=['private*'])
+        self.assertFalse(rules.excludes_file('/src/a.jpg', 'a.jpg'))
+        self.assertTrue(rules.excludes_file('/src/a.txt', 'a.txt'))
+        self.assertTrue(rules.excludes_file('/src/private.jpg', 'private.jpg'))
+        # Include patterns do not prune directories
+        self.assertFalse(rules.excludes_dir('/src/docs', 'docs'))
+        self.assertRaises(ValueError, FileFilter, include=['docs/'])
+        self.assertRaises(ValueError, FileFilter, exclude=['re:('])
+
+    def test_junk(self):
+        rules = FileFilter(exclude_junk=True)
+        for name in ('.DS_Store', 'Thumbs.db', '~$report.docx', 'a.swp'):
+            self.assertTrue(rules.excludes_file('/src/' + name, name), name)
+        self.assertTrue(rules.excludes_dir('/src/__pycache__', '__pycache__'))
+        self.assertFalse(rules.excludes_file('/src/report.docx', 'report.docx'))
+
+    def test_size_and_age(self):
+        now = 1000000
+        rules = FileFilter(min_size=10, max_size=100, min_age=60, max_age=3600, now=now)
+        self.assertTrue(rules.accepts_stat(50, now - 120))
+        self.assertFalse(rules.accepts_stat(5, now - 120))
+        self.assertFalse(rules.accepts_stat(500, now - 120))
+        self.assertFalse(rules.accepts_stat(50, now - 30))
+        self.assertFalse(rules.accepts_stat(50, now - 7200))
+        self.assertFalse(rules.cacheable)
+        rules = FileFilter(min_age=60)
+        mtime = time.time()
+        self.assertEqual(rules.accepted_from(50, mtime), mtime + 60)
+        self.assertIsNone(FileFilter(max_age=60).accepted_from(50, time.time() - 120))
+
+    def test_parsing(self):
+        self.assertEqual([parse_age(text) for text in ('90', '30m', '12h', '1.5d', '2W')],
+                         [90, 1800, 43200, 129600, 1209600])
+        self.assertRaises(ValueError, parse_age, '3y')
+        self.assertEqual(split_patterns(' *.tmp; ;cache/ '), ['*.tmp', 'cache/'])
+        self.assertIsNone(FileFilter.from_params({'include': [], 'exclude': [], 'exclude_junk': False}))
+
+
+class FilteredCopyTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tempdir, 'src')
+        self.dest = os.path.join(self.tempdir, 'dest')
+        for name in ('keep.txt', 'skip.tmp', 'node_modules/lib.txt', 'docs/big.txt'):
+            path = os.path.join(self.src, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as handle:
+                handle.write(b'x' * (5000 if name.startswith('docs') else 10))
+        os.mkdir(self.dest)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_filtered_copy(self):
+        paramdict = {'destdir': self.dest, 'filelist': [self.src], 'overwrite_opt': None,
+                     'flattencount': len(self.src.strip(os.sep).split(os.sep)), 'exclude': ['*.tmp', 'node_modules/'],
+                     'max_size': 1000}
+        summary = CopyEngine(EngineListener()).run(paramdict)
+        self.assertEqual(summary['files_copied'], 1)
+        self.assertEqual(os.listdir(self.dest), ['keep.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobqueue
+from jobqueue import JobQueue
+from listener import EngineListener
+
+
+class FailureListener(EngineListener):
+    def __init__(self):
+        self.failures = []
+
+    def job_failed(self, summary):
+        self.failures.append(summary)
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.dest = tempfile.mkdtemp()
+        self.jobs = JobQueue()
+
+    def tearDown(self):
+        self.jobs.shutdown()
+        shutil.rmtree(self.dest)
+
+    def test_failed_job_notifies_listener(self):
+        listener = FailureListener()
+        # The selection is missing, the engine raises
+        job = self.jobs.submit({'destdir': self.dest}, listener=listener)
+        self.assertTrue(job.finished.wait(10))
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(len(listener.failures), 1)
+        self.assertEqual(listener.failures[0]['status'], 'failed')
+
+    def test_finished_jobs_pruned(self):
+        limit = jobqueue.max_finished_jobs
+        jobqueue.max_finished_jobs = 2
+        try:
+            submitted = [self.jobs.submit({'destdir': self.dest}) for index in range(4)]
+            for job in submitted:
+                self.assertTrue(job.finished.wait(10))
+            self.assertEqual([status['job'] for status in self.jobs.status()],
+                             [job.job_id for job in submitted[-2:]])
+        finally:
+            jobqueue.max_finished_jobs = limit
+
+
+if __name__ == '__main__':
+    unittest.main()
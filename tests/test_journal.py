@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import copyengine
+from copyengine import CopyEngine, FileMeta
+from journal import Journal
+from listener import EngineListener
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tempdir, 'src')
+        self.dest = os.path.join(self.tempdir, 'dest')
+        os.mkdir(self.src)
+        os.mkdir(self.dest)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_load_checkpoints(self):
+        destination = os.path.join(self.dest, 'large')
+        with open(destination, 'wb') as handle:
+            handle.write(b'x' * 300)
+        meta = FileMeta('/src/large', 1000, 1000.5)
+        journal = Journal.create(self.dest, {'destdir': self.dest})
+        journal.record_done('/src/a')
+        journal.checkpoint(destination, meta, 200)
+        journal.close()
+        # A line cut short by a crash is ignored
+        with open(journal.path, 'a') as handle:
+            handle.write('{"done": ["/src/b"')
+        journal = Journal.load(self.dest)
+        try:
+            self.assertEqual(journal.params, {'destdir': self.dest})
+            self.assertTrue(journal.is_done('/src/a'))
+            self.assertFalse(journal.is_done('/src/b'))
+            self.assertEqual(journal.resume_offset(destination, meta), 200)
+            # Restarted when the source changed since the checkpoint
+            self.assertEqual(journal.resume_offset(destination, FileMeta('/src/large', 1000, 2000.5)), 0)
+            self.assertTrue(journal.is_incomplete(destination, meta, FileMeta(destination, 1000, 1000.5)))
+            journal.record_done('/src/large', destination)
+            self.assertEqual(journal.resume_offset(destination, meta), 0)
+        finally:
+            journal.close()
+
+    def test_resume_from_checkpoint(self):
+        resumable_size, checkpoint_bytes = copyengine.resumable_size, copyengine.checkpoint_bytes
+        copyengine.resumable_size = copyengine.checkpoint_bytes = 1024 * 1024
+        try:
+            data = os.urandom(8 * 1024 * 1024)
+            source = os.path.join(self.src, 'large')
+            with open(source, 'wb') as handle:
+                handle.write(data)
+            os.utime(source, (time.time() - 100, time.time() - 100))
+            destination = os.path.join(self.dest, self.src.lstrip(os.sep), 'large')
+            engine = CopyEngine(EngineListener())
+            paramdict = {'destdir': self.dest, 'filelist': [self.src], 'flattencount': 0, 'overwrite_opt': None,
+                         'bytes_per_second': 4 * 1024 * 1024}
+            timer = threading.Timer(0.6, setattr, (engine, 'must_run', False))
+            timer.start()
+            summary = engine.run(paramdict)
+            timer.join()
+            self.assertEqual(summary['status'], 'cancelled')
+            journal = Journal.load(self.dest)
+            offset = journal.resume_offset(destination, FileMeta.from_path(source))
+            journal.close()
+            self.assertGreater(offset, 0)
+            self.assertEqual(os.path.getsize(destination), offset)
+            # The resumed job takes its parameters from the journal, the limits given replace the original ones
+            summary = CopyEngine(EngineListener()).run({'destdir': self.dest, 'resume': True,
+                                                        'bytes_per_second': None})
+        finally:
+            copyengine.resumable_size, copyengine.checkpoint_bytes = resumable_size, checkpoint_bytes
+        self.assertEqual(summary['status'], 'complete')
+        with open(destination, 'rb') as handle:
+            self.assertEqual(handle.read(), data)
+        self.assertFalse(Journal.exists(self.dest))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from copyengine import CopyEngine, FileMeta
+from listener import EngineListener
+from manifest import Manifest
+
+
+def write_file(path, data, mtime=None):
+    with open(path, 'wb') as handle:
+        handle.write(data)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tempdir, 'src')
+        self.dest = os.path.join(self.tempdir, 'dest')
+        os.mkdir(self.src)
+        os.mkdir(self.dest)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def run_copy(self, **params):
+        paramdict = {'destdir': self.dest, 'filelist': [self.src], 'flattencount': 0, 'overwrite_opt': 'either',
+                     'incremental': True}
+        paramdict.update(params)
+        return CopyEngine(EngineListener()).run(paramdict)
+
+    def dest_path(self, name):
+        return os.path.join(self.dest, self.src.lstrip(os.sep), name)
+
+    def test_record_and_compare(self):
+        manifest = Manifest.for_destination(self.dest)
+        try:
+            meta = FileMeta('/src/a', 10, 1000.5)
+            manifest.record(meta, '/dest/a')
+            manifest.flush()
+            self.assertTrue(manifest.is_unchanged(meta, '/dest/a'))
+            self.assertFalse(manifest.is_unchanged(FileMeta('/src/a', 11, 1000.5), '/dest/a'))
+            self.assertFalse(manifest.is_unchanged(FileMeta('/src/a', 10, 1001.5), '/dest/a'))
+            self.assertFalse(manifest.is_unchanged(meta, '/other/a'))
+            self.assertEqual(manifest.count(), 1)
+        finally:
+            manifest.close()
+
+    def test_incremental_sync(self):
+        write_file(os.path.join(self.src, 'a'), b'a' * 100, time.time() - 100)
+        write_file(os.path.join(self.src, 'b'), b'b' * 100, time.time() - 100)
+        summary = self.run_copy()
+        self.assertEqual((summary['files_copied'], summary['files_unchanged']), (2, 0))
+        # Overwrite either would copy both files again without the manifest
+        summary = self.run_copy()
+        self.assertEqual((summary['files_copied'], summary['files_unchanged']), (0, 2))
+        write_file(os.path.join(self.src, 'b'), b'changed', time.time() - 50)
+        summary = self.run_copy()
+        self.assertEqual((summary['files_copied'], summary['files_unchanged']), (1, 1))
+        with open(self.dest_path('b'), 'rb') as handle:
+            self.assertEqual(handle.read(), b'changed')
+
+    def test_rebuild_drops_drifted(self):
+        write_file(os.path.join(self.src, 'a'), b'a' * 100, time.time() - 100)
+        write_file(os.path.join(self.src, 'b'), b'b' * 100, time.time() - 100)
+        self.run_copy()
+        os.remove(self.dest_path('a'))
+        manifest = Manifest.for_destination(self.dest)
+        try:
+            self.assertEqual(manifest.verify(), [(os.path.join(self.src, 'a'), self.dest_path('a'))])
+            self.assertEqual(manifest.rebuild(), (2, 1))
+        finally:
+            manifest.close()
+        summary = self.run_copy()
+        self.assertEqual((summary['files_copied'], summary['files_unchanged']), (1, 1))
+        self.assertTrue(os.path.exists(self.dest_path('a')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import errno
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import copybackend
+import copyengine
+from copyengine import CopyEngine
+from listener import EngineListener
+from outcomes import OutcomeStore, RetryQueue
+
+
+class OutcomesTest(unittest.TestCase):
+    def test_retried_failure_cleared(self):
+        outcomes = OutcomeStore()
+        failure = outcomes.record_failure('/src/a', '/dest/a', OSError(errno.EIO, 'Input/output error'))
+        self.assertTrue(failure.retryable)
+        outcomes.record_failure('/src/a', '/dest/a', OSError(errno.EIO, 'Input/output error'))
+        self.assertEqual(outcomes.failure('/src/a').attempts, 2)
+        self.assertFalse(outcomes.record_failure('/src/b', '/dest/b', OSError(errno.EACCES, 'Denied')).retryable)
+        counts, failures = outcomes.summary()
+        self.assertEqual(counts['failed'], 2)
+        self.assertEqual([(item['path'], item['error_name']) for item in failures],
+                         [('/src/a', 'EIO'), ('/src/b', 'EACCES')])
+        outcomes.record('copied', '/src/a', '/dest/a')
+        # A later file written to the destination of a failed one supersedes it
+        outcomes.record('copied', '/src/c', '/dest/b')
+        counts, failures = outcomes.summary()
+        self.assertEqual((counts['failed'], counts['copied']), (1, 2))
+        self.assertIsNone(outcomes.failure('/src/a'))
+        self.assertTrue(outcomes.failure('/src/b').superseded)
+
+    def test_retry_queue_backoff(self):
+        attempts = []
+        done = threading.Event()
+
+        def retry(item, attempt):
+            attempts.append((item, attempt, time.time()))
+            if not retries.schedule(item, attempt):
+                done.set()
+
+        retries = RetryQueue(retry, attempts=3, backoff=0.05)
+        start = time.time()
+        self.assertTrue(retries.schedule('a', 1))
+        self.assertTrue(done.wait(5))
+        retries.close()
+        retries.join(5)
+        self.assertEqual([(item, attempt) for item, attempt, when in attempts], [('a', 2), ('a', 3), ('a', 4)])
+        # 0.05, 0.1 then 0.2 seconds
+        self.assertGreaterEqual(attempts[-1][2] - start, 0.35)
+        self.assertFalse(retries.is_alive())
+
+
+class RetryCopyTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tempdir, 'src')
+        self.dest = os.path.join(self.tempdir, 'dest')
+        os.mkdir(self.src)
+        os.mkdir(self.dest)
+        for name in ('flaky', 'denied', 'fine'):
+            with open(os.path.join(self.src, name), 'wb') as handle:
+                handle.write(name.encode() * 100)
+        self.calls = {}
+        self.copy_data = copybackend.copy_data
+        self.retry_backoff = copyengine.retry_backoff
+        copybackend.copy_data = self.failing_copy
+        copyengine.retry_backoff = 0.05
+
+    def tearDown(self):
+        copybackend.copy_data = self.copy_data
+        copyengine.retry_backoff = self.retry_backoff
+        shutil.rmtree(self.tempdir)
+
+    def failing_copy(self, src, dst, throttle=None):
+        name = os.path.basename(src)
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if name == 'flaky' and self.calls[name] < 3:
+            raise OSError(errno.EIO, 'Input/output error')
+        if name == 'denied':
+            raise OSError(errno.EACCES, 'Permission denied')
+        return self.copy_data(src, dst, throttle)
+
+    def test_transient_errors_retried(self):
+        paramdict = {'destdir': self.dest, 'filelist': [self.src], 'flattencount': 0, 'overwrite_opt': None}
+        summary = CopyEngine(EngineListener()).run(paramdict)
+        self.assertEqual(self.calls, {'flaky': 3, 'denied': 1, 'fine': 1})
+        self.assertEqual((summary['files_copied'], summary['files_failed']), (2, 1))
+        self.assertEqual([(item['path'], item['attempts']) for item in summary['failures']],
+                         [(os.path.join(self.src, 'denied'), 1)])
+        self.assertTrue(os.path.isfile(os.path.join(self.dest, self.src.lstrip(os.sep), 'flaky')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from copyengine import FileOperations
+from pathplan import PathPlanner
+
+
+class PathPlannerTest(unittest.TestCase):
+    filelist = ['/a', '/a/b', '/a/b/c.txt', '/a/b/d/e.txt', '/a/b/d/f', '/x/b/c.txt', '/x/y/z/w/v.bin',
+                '/a/b.d/e', '/a/b d/e']
+
+    def test_same_as_get_dest_filepath(self):
+        operations = FileOperations()
+        for destpath in ('/dest', '/dest/sub/'):
+            for flattencount in range(7):
+                planner = PathPlanner(destpath, flattencount)
+                expected = [operations.get_dest_filepath(filepath, destpath, flattencount)
+                            for filepath in self.filelist]
+                self.assertEqual(planner.plan(self.filelist), expected, (destpath, flattencount))
+                self.assertEqual([planner.dest_filepath(filepath) for filepath in self.filelist], expected)
+
+    def test_collisions(self):
+        planner = PathPlanner('/dest', 2)
+        self.assertEqual(planner.collisions(self.filelist), {'/dest/c.txt': ['/a/b/c.txt', '/x/b/c.txt'],
+                                                             '/dest/e': ['/a/b.d/e', '/a/b d/e']})
+        self.assertEqual(PathPlanner('/dest', 0).collisions(self.filelist), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
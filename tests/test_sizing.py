@@ -0,0 +1,39 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sizing import DirectorySizer
+
+
+class DirectorySizerTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_cache_bounded(self):
+        for index in range(10):
+            dirpath = os.path.join(self.tempdir, 'd%d' % index)
+            os.mkdir(dirpath)
+            with open(os.path.join(dirpath, 'f'), 'wb') as handle:
+                handle.write(b'data')
+        sizer = DirectorySizer(max_cached=4)
+        filecount, filesize, totals = sizer.size([self.tempdir])
+        self.assertEqual(filecount, 10)
+        self.assertEqual(len(sizer.cache), 4)
+        # The least recently used directories are dropped first
+        recent = os.path.join(self.tempdir, 'd0')
+        sizer.size_dir(recent)
+        sizer.size_dir(os.path.join(self.tempdir, 'd1'))
+        self.assertIn(recent, sizer.cache)
+        self.assertEqual(sizer.size([self.tempdir])[0], 10)
+        self.assertEqual(len(sizer.cache), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import throttle
+from throttle import Throttle, TokenBucket, parse_rate, parse_window
+
+
+def local_time(hour, minute):
+    return time.mktime((2024, 6, 3, hour, minute, 0, 0, 0, -1))
+
+
+class ThrottleTest(unittest.TestCase):
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('500'), 500)
+        self.assertEqual(parse_rate('500K'), 500 * 1024)
+        self.assertEqual(parse_rate('1.5m'), 1536 * 1024)
+        self.assertEqual(parse_rate('2GiB'), 2 * 1024 * 1024 * 1024)
+        self.assertIsNone(parse_rate('0'))
+        for text in ('', 'fast', '10T', '-5M'):
+            self.assertRaises(ValueError, parse_rate, text)
+
+    def test_parse_window(self):
+        self.assertEqual(parse_window('09:00-18:00=20M/100'), (540, 1080, 20 * 1024 * 1024, 100))
+        self.assertEqual(parse_window('22:30 - 6:00 = 0'), (1350, 360, None, None))
+        for text in ('09:00-18:00', '9-18=20M', '09:60-18:00=1M', '25:00-26:00=1M'):
+            self.assertRaises(ValueError, parse_window, text)
+
+    def test_schedule(self):
+        limits = Throttle()
+        limits.configure(1000, None, ['09:00-18:00=20M/100', '22:00-06:00=0/5'])
+        self.assertEqual(limits.current_limits(local_time(12, 0)), (20 * 1024 * 1024, 100))
+        self.assertEqual(limits.current_limits(local_time(18, 0)), (1000, None))
+        self.assertEqual(limits.current_limits(local_time(23, 0)), (None, 5))
+        self.assertEqual(limits.current_limits(local_time(5, 59)), (None, 5))
+        # Limits set while the job runs replace the schedule
+        limits.set_limits(None, None)
+        limits.checked = 0
+        limits.update()
+        self.assertFalse(limits.limits_bytes())
+
+    def test_token_bucket_rate(self):
+        bucket = TokenBucket(1000)
+        start = time.time()
+        for index in range(5):
+            bucket.consume(100)
+        self.assertGreaterEqual(time.time() - start, 0.45)
+        self.assertLess(time.time() - start, 1)
+        # The wait is cut short once the job is cancelled
+        start = time.time()
+        bucket.consume(100000, lambda: False)
+        self.assertLess(time.time() - start, 1)
+
+    def test_unlimited(self):
+        bucket = TokenBucket()
+        start = time.time()
+        bucket.consume(10 ** 12)
+        self.assertLess(time.time() - start, 0.1)
+        throttle.set_thread_priority()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from verify import Verifier, hash_file
+
+
+class VerifierTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tempdir, 'src')
+        self.dest = os.path.join(self.tempdir, 'dest')
+        os.mkdir(self.src)
+        os.mkdir(self.dest)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def copy(self, names, mode='sample'):
+        verifier = Verifier(self.dest, mode, 'sha256')
+        try:
+            for name in names:
+                verifier.copy(os.path.join(self.src, name), os.path.join(self.dest, name))
+        finally:
+            verifier.close()
+        with open(verifier.sidecar_path) as handle:
+            return handle.read().splitlines()
+
+    def test_sidecar_one_line_per_file(self):
+        for name in ('a', 'b'):
+            with open(os.path.join(self.src, name), 'wb') as handle:
+                handle.write(os.urandom(1000))
+        self.copy(['a', 'b'])
+        with open(os.path.join(self.src, 'a'), 'wb') as handle:
+            handle.write(os.urandom(2000))
+        lines = self.copy(['a'], 'full')
+        self.assertEqual(lines, ['%s  b' % hash_file(os.path.join(self.src, 'b'), 'sha256'),
+                                 '%s  a' % hash_file(os.path.join(self.src, 'a'), 'sha256')])
+
+
+if __name__ == '__main__':
+    unittest.main()
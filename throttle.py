@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import time
+import ctypes
+import logging
+import platform
+import threading
+
+log = logging.getLogger(__name__)
+
+burst_seconds = 1.0
+schedule_check = 1.0
+rate_units = {'': 1, 'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+io_classes = ('low', 'idle')
+
+# ioprio_set syscall numbers, the IOPRIO_* values come from linux/ioprio.h
+ioprio_syscalls = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'armv7l': 314, 'ppc64le': 273}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+
+def parse_rate(text):
+    """Parse a rate such as 500K, 20M or 1G.
+    Input:
+        text    : string - a number optionally followed by K, M or G.
+    Output:
+        returns : int - the rate in units per second, None for 0 (no limit)"""
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*$', text, re.IGNORECASE)
+    if match is None:
+        raise ValueError('Invalid rate %s' % text)
+    rate = int(float(match.group(1)) * rate_units[match.group(2).upper()])
+    return rate or None
+
+
+def parse_window(text):
+    """Parse a time of day limit, HH:MM-HH:MM=RATE[/FILES], for example 09:00-18:00=20M/100.
+    Input:
+        text    : string - the window.
+    Output:
+        returns : tuple - (start minute, end minute, bytes per second, files per second), None for no limit"""
+    match = re.match(r'^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*=\s*([^/]+?)\s*(?:/\s*(\d+))?\s*$', text)
+    if match is None:
+        raise ValueError('Invalid schedule %s, expected HH:MM-HH:MM=RATE[/FILES]' % text)
+    start = int(match.group(1)) * 60 + int(match.group(2))
+    end = int(match.group(3)) * 60 + int(match.group(4))
+    if int(match.group(2)) > 59 or int(match.group(4)) > 59 or start > 1440 or end > 1440:
+        raise ValueError('Invalid schedule %s, the times must be between 00:00 and 24:00' % text)
+    files = int(match.group(6)) if match.group(6) else None
+    return start, end, parse_rate(match.group(5)), files or None
+
+
+class TokenBucket():
+    """Token bucket rate limiter shared by the copy threads.
+    Tokens accumulate at the rate up to one second worth. A consumer taking more tokens than are available puts the
+    bucket in debt and sleeps until it is repaid, so large chunks are allowed and the average rate is kept."""
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.tokens = 0.0
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        """Change the rate.
+        Input:
+            rate    : float - units per second, None for no limit.
+        Output:
+            None"""
+        with self.lock:
+            self.rate = rate
+            self.tokens = min(self.tokens, rate * burst_seconds) if rate else 0.0
+            self.last = time.time()
+
+    def consume(self, amount, keep_running=None):
+        """Take tokens from the bucket, sleeping as long as needed to keep to the rate.
+        Input:
+            amount      : float - the number of tokens.
+            keep_running: callable - polled while sleeping, the wait is cut short when it returns False.
+        Output:
+            None"""
+        with self.lock:
+            if not self.rate:
+                return
+            now = time.time()
+            self.tokens = min(self.tokens + (now - self.last) * self.rate, self.rate * burst_seconds)
+            self.last = now
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        deadline = time.time() + delay
+        while delay > 0:
+            time.sleep(min(delay, 0.5))
+            if keep_running is not None and not keep_running():
+                return
+            delay = deadline - time.time()
+
+
+class Throttle():
+    """Bandwidth and files per second caps of a copy job.
+    The limits can follow a schedule of time of day windows, outside the windows the base limits apply. The limits
+    can be changed while the job runs, they then replace the schedule for the rest of the job."""
+    def __init__(self):
+        self.bytes = TokenBucket()
+        self.files = TokenBucket()
+        self.base = (None, None)
+        self.schedule = []
+        self.override = False
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def configure(self, bytes_per_second=None, files_per_second=None, schedule=None):
+        """Set the limits of a job.
+        Input:
+            bytes_per_second    : int - bandwidth cap, None for no limit.
+            files_per_second    : int - files per second cap, None for no limit.
+            schedule            : list - time of day windows, see parse_window.
+        Output:
+            None"""
+        with self.lock:
+            self.base = (bytes_per_second or None, files_per_second or None)
+            self.schedule = [parse_window(window) for window in schedule or []]
+            self.override = False
+            self.checked = 0
+        self.update()
+
+    def set_limits(self, bytes_per_second, files_per_second):
+        """Change the limits while the job runs, the schedule no longer applies.
+        Input:
+            bytes_per_second    : int - bandwidth cap, None for no limit.
+            files_per_second    : int - files per second cap, None for no limit.
+        Output:
+            None"""
+        with self.lock:
+            self.override = True
+        self.bytes.set_rate(bytes_per_second or None)
+        self.files.set_rate(files_per_second or None)
+        log.info('Limits set to %s bytes/sec, %s files/sec', bytes_per_second, files_per_second)
+
+    def current_limits(self, now=None):
+        """Return the limits in force at a time of day.
+        Input:
+            now     : float - time since the epoch, the current time if omitted.
+        Output:
+            returns : tuple - (bytes per second, files per second)"""
+        local = time.localtime(now)
+        minute = local.tm_hour * 60 + local.tm_min
+        for start, end, bytes_per_second, files_per_second in self.schedule:
+            if start <= minute < end or (start > end and (minute >= start or minute < end)):
+                return bytes_per_second, files_per_second
+        return self.base
+
+    def update(self):
+        """Apply the limits of the schedule, checked at most every schedule_check seconds.
+        Input:
+            None
+        Output:
+            None"""
+        now = time.time()
+        with self.lock:
+            if self.override or now - self.checked < schedule_check:
+                return
+            self.checked = now
+            bytes_per_second, files_per_second = self.current_limits(now)
+        if bytes_per_second != self.bytes.rate:
+            self.bytes.set_rate(bytes_per_second)
+        if files_per_second != self.files.rate:
+            self.files.set_rate(files_per_second)
+
+    def limits_bytes(self):
+        """Check if the bandwidth is limited, the data is then copied in chunks rather than in one call.
+        Input:
+            None
+        Output:
+            returns : bool"""
+        return bool(self.bytes.rate)
+
+    def consume_file(self, keep_running=None):
+        """Wait for the turn of the next file under the files per second cap.
+        Input:
+            keep_running: callable - polled while waiting.
+        Output:
+            None"""
+        self.update()
+        self.files.consume(1, keep_running)
+
+    def consume_bytes(self, count, keep_running=None):
+        """Account for data copied under the bandwidth cap.
+        Input:
+            count       : int - bytes copied.
+            keep_running: callable - polled while waiting.
+        Output:
+            None"""
+        self.bytes.consume(count, keep_running)
+
+
+def set_thread_priority(nice=None, io_class=None):
+    """Lower the CPU and I/O priority of the calling thread, used by the copy threads so that the rest of the
+    process, such as the gui, keeps its priority. Only Linux supports per thread priorities, elsewhere this does
+    nothing.
+    Input:
+        nice        : int - niceness added to the thread.
+        io_class    : string - 'low' for the lowest best effort I/O priority, 'idle' to only use the disk when no
+                      other process does.
+    Output:
+        None"""
+    if not sys.platform.startswith('linux'):
+        return
+    if nice:
+        try:
+            # On Linux the priority of the calling thread is changed, not the whole process
+            os.setpriority(os.PRIO_PROCESS, 0, os.getpriority(os.PRIO_PROCESS, 0) + nice)
+        except OSError as err:
+            log.debug('Unable to change the thread priority: %s', err)
+    if io_class:
+        syscall = ioprio_syscalls.get(platform.machine())
+        if syscall is None:
+            return
+        if io_class == 'idle':
+            ioprio = IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+        else:
+            ioprio = (IOPRIO_CLASS_BE << IOPRIO_CLASS_SHIFT) | 7
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.syscall(syscall, IOPRIO_WHO_PROCESS, 0, ioprio) != 0:
+            log.debug('Unable to change the thread I/O priority: %s', os.strerror(ctypes.get_errno()))
@@ -97,6 +97,54 @@ class Ui_MainWindow(object):
         self.trimdirCount.setSingleStep(1)
         self.trimdirCount.setObjectName("trimdirCount")
         self.gridLayout.addWidget(self.trimdirCount, 1, 1, 1, 1)
+        self.lblWorkers = QtGui.QLabel(self.groupBox_5)
+        self.lblWorkers.setObjectName("lblWorkers")
+        self.gridLayout.addWidget(self.lblWorkers, 2, 0, 1, 1)
+        self.workerCount = QtGui.QSpinBox(self.groupBox_5)
+        self.workerCount.setMinimum(1)
+        self.workerCount.setMaximum(64)
+        self.workerCount.setSingleStep(1)
+        self.workerCount.setObjectName("workerCount")
+        self.gridLayout.addWidget(self.workerCount, 2, 1, 1, 1)
+        self.lblLargeWorkers = QtGui.QLabel(self.groupBox_5)
+        self.lblLargeWorkers.setObjectName("lblLargeWorkers")
+        self.gridLayout.addWidget(self.lblLargeWorkers, 3, 0, 1, 1)
+        self.largeWorkerCount = QtGui.QSpinBox(self.groupBox_5)
+        self.largeWorkerCount.setMinimum(1)
+        self.largeWorkerCount.setMaximum(16)
+        self.largeWorkerCount.setSingleStep(1)
+        self.largeWorkerCount.setObjectName("largeWorkerCount")
+        self.gridLayout.addWidget(self.largeWorkerCount, 3, 1, 1, 1)
+        self.lblBwLimit = QtGui.QLabel(self.groupBox_5)
+        self.lblBwLimit.setObjectName("lblBwLimit")
+        self.gridLayout.addWidget(self.lblBwLimit, 4, 0, 1, 1)
+        self.bwLimit = QtGui.QSpinBox(self.groupBox_5)
+        self.bwLimit.setMinimum(0)
+        self.bwLimit.setMaximum(10000)
+        self.bwLimit.setSingleStep(5)
+        self.bwLimit.setObjectName("bwLimit")
+        self.gridLayout.addWidget(self.bwLimit, 4, 1, 1, 1)
+        self.lblFilesLimit = QtGui.QLabel(self.groupBox_5)
+        self.lblFilesLimit.setObjectName("lblFilesLimit")
+        self.gridLayout.addWidget(self.lblFilesLimit, 5, 0, 1, 1)
+        self.filesLimit = QtGui.QSpinBox(self.groupBox_5)
+        self.filesLimit.setMinimum(0)
+        self.filesLimit.setMaximum(100000)
+        self.filesLimit.setSingleStep(10)
+        self.filesLimit.setObjectName("filesLimit")
+        self.gridLayout.addWidget(self.filesLimit, 5, 1, 1, 1)
+        self.lblInclude = QtGui.QLabel(self.groupBox_5)
+        self.lblInclude.setObjectName("lblInclude")
+        self.gridLayout.addWidget(self.lblInclude, 6, 0, 1, 1)
+        self.txtInclude = QtGui.QLineEdit(self.groupBox_5)
+        self.txtInclude.setObjectName("txtInclude")
+        self.gridLayout.addWidget(self.txtInclude, 6, 1, 1, 1)
+        self.lblExclude = QtGui.QLabel(self.groupBox_5)
+        self.lblExclude.setObjectName("lblExclude")
+        self.gridLayout.addWidget(self.lblExclude, 7, 0, 1, 1)
+        self.txtExclude = QtGui.QLineEdit(self.groupBox_5)
+        self.txtExclude.setObjectName("txtExclude")
+        self.gridLayout.addWidget(self.txtExclude, 7, 1, 1, 1)
         self.verticalLayout_2.addLayout(self.gridLayout)
         self.gridLayout_2 = QtGui.QGridLayout()
         self.gridLayout_2.setObjectName("gridLayout_2")
@@ -115,6 +163,27 @@ class Ui_MainWindow(object):
         self.rbOWEither.setObjectName("rbOWEither")
         self.verticalLayout.addWidget(self.rbOWEither)
         self.gridLayout_2.addLayout(self.verticalLayout, 1, 0, 1, 1)
+        self.ckbxIncremental = QtGui.QCheckBox(self.groupBox_5)
+        self.ckbxIncremental.setObjectName("ckbxIncremental")
+        self.gridLayout_2.addWidget(self.ckbxIncremental, 2, 0, 1, 1)
+        self.cbVerify = QtGui.QComboBox(self.groupBox_5)
+        self.cbVerify.setObjectName("cbVerify")
+        self.cbVerify.addItem("")
+        self.cbVerify.addItem("")
+        self.cbVerify.addItem("")
+        self.gridLayout_2.addWidget(self.cbVerify, 3, 0, 1, 1)
+        self.cbDedupe = QtGui.QComboBox(self.groupBox_5)
+        self.cbDedupe.setObjectName("cbDedupe")
+        self.cbDedupe.addItem("")
+        self.cbDedupe.addItem("")
+        self.cbDedupe.addItem("")
+        self.gridLayout_2.addWidget(self.cbDedupe, 4, 0, 1, 1)
+        self.ckbxLowPriority = QtGui.QCheckBox(self.groupBox_5)
+        self.ckbxLowPriority.setObjectName("ckbxLowPriority")
+        self.gridLayout_2.addWidget(self.ckbxLowPriority, 5, 0, 1, 1)
+        self.ckbxSkipJunk = QtGui.QCheckBox(self.groupBox_5)
+        self.ckbxSkipJunk.setObjectName("ckbxSkipJunk")
+        self.gridLayout_2.addWidget(self.ckbxSkipJunk, 6, 0, 1, 1)
         self.verticalLayout_2.addLayout(self.gridLayout_2)
         self.verticalLayout_4.addWidget(self.groupBox_5)
         self.horizontalLayout_5 = QtGui.QHBoxLayout()
@@ -143,7 +212,9 @@ class Ui_MainWindow(object):
         self.groupBox_2.setObjectName("groupBox_2")
         self.horizontalLayout_2 = QtGui.QHBoxLayout(self.groupBox_2)
         self.horizontalLayout_2.setObjectName("horizontalLayout_2")
-        self.listWidget = QtGui.QListWidget(self.groupBox_2)
+        self.listWidget = QtGui.QListView(self.groupBox_2)
+        self.listWidget.setLayoutMode(QtGui.QListView.Batched)
+        self.listWidget.setUniformItemSizes(True)
         self.listWidget.setObjectName("listWidget")
         self.horizontalLayout_2.addWidget(self.listWidget)
         self.gridLayout_4.addWidget(self.groupBox_2, 1, 0, 1, 1)
@@ -151,7 +222,9 @@ class Ui_MainWindow(object):
         self.groupBox_6.setObjectName("groupBox_6")
         self.horizontalLayout_3 = QtGui.QHBoxLayout(self.groupBox_6)
         self.horizontalLayout_3.setObjectName("horizontalLayout_3")
-        self.previewView = QtGui.QListWidget(self.groupBox_6)
+        self.previewView = QtGui.QListView(self.groupBox_6)
+        self.previewView.setLayoutMode(QtGui.QListView.Batched)
+        self.previewView.setUniformItemSizes(True)
         self.previewView.setObjectName("previewView")
         self.horizontalLayout_3.addWidget(self.previewView)
         self.gridLayout_4.addWidget(self.groupBox_6, 1, 1, 1, 1)
@@ -177,9 +250,15 @@ class Ui_MainWindow(object):
         self.actionChoose_Source.setObjectName("actionChoose_Source")
         self.actionStart_Copy = QtGui.QAction(MainWindow)
         self.actionStart_Copy.setObjectName("actionStart_Copy")
+        self.actionResume_Copy = QtGui.QAction(MainWindow)
+        self.actionResume_Copy.setObjectName("actionResume_Copy")
+        self.actionVerify_Manifest = QtGui.QAction(MainWindow)
+        self.actionVerify_Manifest.setObjectName("actionVerify_Manifest")
         self.menuFile.addAction(self.actionChoose_Destination)
         self.menuFile.addAction(self.actionChoose_Source)
         self.menuFile.addAction(self.actionStart_Copy)
+        self.menuFile.addAction(self.actionResume_Copy)
+        self.menuFile.addAction(self.actionVerify_Manifest)
         self.menuFile.addSeparator()
         self.menuFile.addAction(self.actionExit)
         self.menuHelp.addAction(self.actionAbout)
@@ -206,10 +285,29 @@ class Ui_MainWindow(object):
         self.groupBox_5.setTitle(QtGui.QApplication.translate("MainWindow", "Options", None, QtGui.QApplication.UnicodeUTF8))
         self.ckbxTrimDir.setText(QtGui.QApplication.translate("MainWindow", "Trim Directory Tree", None, QtGui.QApplication.UnicodeUTF8))
         self.lblTrimDir.setText(QtGui.QApplication.translate("MainWindow", "Number of Dirs", None, QtGui.QApplication.UnicodeUTF8))
+        self.lblWorkers.setText(QtGui.QApplication.translate("MainWindow", "Copy Threads", None, QtGui.QApplication.UnicodeUTF8))
+        self.lblLargeWorkers.setText(QtGui.QApplication.translate("MainWindow", "Large File Threads", None, QtGui.QApplication.UnicodeUTF8))
+        self.lblBwLimit.setText(QtGui.QApplication.translate("MainWindow", "Bandwidth Limit (MB/s)", None, QtGui.QApplication.UnicodeUTF8))
+        self.bwLimit.setSpecialValueText(QtGui.QApplication.translate("MainWindow", "Unlimited", None, QtGui.QApplication.UnicodeUTF8))
+        self.lblFilesLimit.setText(QtGui.QApplication.translate("MainWindow", "Files/Sec Limit", None, QtGui.QApplication.UnicodeUTF8))
+        self.filesLimit.setSpecialValueText(QtGui.QApplication.translate("MainWindow", "Unlimited", None, QtGui.QApplication.UnicodeUTF8))
+        self.lblInclude.setText(QtGui.QApplication.translate("MainWindow", "Include", None, QtGui.QApplication.UnicodeUTF8))
+        self.txtInclude.setToolTip(QtGui.QApplication.translate("MainWindow", "Only copy the files matching these patterns, separated by ;", None, QtGui.QApplication.UnicodeUTF8))
+        self.lblExclude.setText(QtGui.QApplication.translate("MainWindow", "Exclude", None, QtGui.QApplication.UnicodeUTF8))
+        self.txtExclude.setToolTip(QtGui.QApplication.translate("MainWindow", "Skip the files and directories matching these patterns, separated by ;, end a pattern with / to only match directories", None, QtGui.QApplication.UnicodeUTF8))
         self.cbOWDest.setText(QtGui.QApplication.translate("MainWindow", "Overwrite Destination", None, QtGui.QApplication.UnicodeUTF8))
         self.rbOWNewer.setText(QtGui.QApplication.translate("MainWindow", "If Newer", None, QtGui.QApplication.UnicodeUTF8))
         self.rbOWLarger.setText(QtGui.QApplication.translate("MainWindow", "If Larger", None, QtGui.QApplication.UnicodeUTF8))
         self.rbOWEither.setText(QtGui.QApplication.translate("MainWindow", "If Newer or Larger", None, QtGui.QApplication.UnicodeUTF8))
+        self.ckbxIncremental.setText(QtGui.QApplication.translate("MainWindow", "Incremental Sync", None, QtGui.QApplication.UnicodeUTF8))
+        self.cbVerify.setItemText(0, QtGui.QApplication.translate("MainWindow", "No Verification", None, QtGui.QApplication.UnicodeUTF8))
+        self.cbVerify.setItemText(1, QtGui.QApplication.translate("MainWindow", "Verify Sampled", None, QtGui.QApplication.UnicodeUTF8))
+        self.cbVerify.setItemText(2, QtGui.QApplication.translate("MainWindow", "Verify Full Re-read", None, QtGui.QApplication.UnicodeUTF8))
+        self.cbDedupe.setItemText(0, QtGui.QApplication.translate("MainWindow", "Copy Duplicates", None, QtGui.QApplication.UnicodeUTF8))
+        self.cbDedupe.setItemText(1, QtGui.QApplication.translate("MainWindow", "Hard Link Duplicates", None, QtGui.QApplication.UnicodeUTF8))
+        self.cbDedupe.setItemText(2, QtGui.QApplication.translate("MainWindow", "Skip Duplicates", None, QtGui.QApplication.UnicodeUTF8))
+        self.ckbxLowPriority.setText(QtGui.QApplication.translate("MainWindow", "Low I/O Priority", None, QtGui.QApplication.UnicodeUTF8))
+        self.ckbxSkipJunk.setText(QtGui.QApplication.translate("MainWindow", "Skip System and Temp Files", None, QtGui.QApplication.UnicodeUTF8))
         self.copyButton.setText(QtGui.QApplication.translate("MainWindow", "Start Copy", None, QtGui.QApplication.UnicodeUTF8))
         self.closeButton.setText(QtGui.QApplication.translate("MainWindow", "Close", None, QtGui.QApplication.UnicodeUTF8))
         self.groupBox_2.setTitle(QtGui.QApplication.translate("MainWindow", "Selected Items", None, QtGui.QApplication.UnicodeUTF8))
@@ -221,4 +319,6 @@ class Ui_MainWindow(object):
         self.actionChoose_Destination.setText(QtGui.QApplication.translate("MainWindow", "Choose Destination", None, QtGui.QApplication.UnicodeUTF8))
         self.actionChoose_Source.setText(QtGui.QApplication.translate("MainWindow", "Choose Source", None, QtGui.QApplication.UnicodeUTF8))
         self.actionStart_Copy.setText(QtGui.QApplication.translate("MainWindow", "Start Copy", None, QtGui.QApplication.UnicodeUTF8))
+        self.actionResume_Copy.setText(QtGui.QApplication.translate("MainWindow", "Resume Copy", None, QtGui.QApplication.UnicodeUTF8))
+        self.actionVerify_Manifest.setText(QtGui.QApplication.translate("MainWindow", "Verify Manifest", None, QtGui.QApplication.UnicodeUTF8))
 
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+import copybackend
+
+checksum_name = '.mcmover_checksums'
+hash_algorithms = ('blake2b', 'sha256', 'xxh64')
+verify_modes = ('sample', 'full')
+sample_count = 8
+sample_size = 64 * 1024
+
+
+class VerifyError(Exception):
+    """Raised when a destination file does not match its source after the copy."""
+    pass
+
+
+def new_hasher(algorithm):
+    """Return a new hash object for algorithm.
+    Input:
+        algorithm   : string - one of hash_algorithms, xxh64 requires the xxhash package.
+    Output:
+        returns     : object - hashlib style hash object"""
+    if algorithm == 'xxh64':
+        if xxhash is None:
+            raise ValueError('The xxhash package is required for the xxh64 algorithm')
+        return xxhash.xxh64()
+    if algorithm not in hash_algorithms:
+        raise ValueError('Unknown hash algorithm %s' % algorithm)
+    return hashlib.new(algorithm)
+
+
+def hash_file(path, algorithm, drop_cache=False):
+    """Hash a whole file.
+    Input:
+        path        : string - the file to hash.
+        algorithm   : string - one of hash_algorithms.
+        drop_cache  : bool - flush the file and drop it from the page cache first, so that the data is read back
+                      from the disk rather than from memory.
+    Output:
+        returns     : string - hex digest"""
+    hasher = new_hasher(algorithm)
+    view = memoryview(bytearray(copybackend.buffer_size))
+    with open(path, 'rb') as handle:
+        if drop_cache and hasattr(os, 'posix_fadvise'):
+            os.fsync(handle.fileno())
+            os.posix_fadvise(handle.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        while True:
+            read = handle.readinto(view)
+            if not read:
+                break
+            hasher.update(view[:read])
+    return hasher.hexdigest()
+
+
+def compare_samples(src, dst, size):
+    """Compare evenly spaced blocks of the source and destination.
+    Input:
+        src     : string - path of the source file.
+        dst     : string - path of the destination file.
+        size    : int - the size of the source.
+    Output:
+        returns : bool - True if the sizes and all the sampled blocks match"""
+    if os.path.getsize(dst) != size:
+        return False
+    if size <= sample_count * sample_size:
+        offsets = [0]
+        length = size
+    else:
+        step = (size - sample_size) // (sample_count - 1)
+        offsets = [step * index for index in range(sample_count)]
+        length = sample_size
+    with open(src, 'rb') as src_handle:
+        with open(dst, 'rb') as dst_handle:
+            for offset in offsets:
+                src_handle.seek(offset)
+                dst_handle.seek(offset)
+                if src_handle.read(length) != dst_handle.read(length):
+                    return False
+    return True
+
+
+class Verifier():
+    """Verified copies, the source data is hashed while it streams through the copy buffers and the destination is
+    then checked, either by comparing sampled blocks with the source or by hashing it again in full.
+    The digests are written to a sidecar file in the root of the destination, in the format used by the
+    sha256sum / b2sum tools, so the copy can be checked again later. The digests are appended as the files are
+    verified, and the sidecar is rewritten on close with a single line per file, the latest digest of the files
+    copied again replacing the one of an earlier job."""
+    def __init__(self, destdir, mode='sample', algorithm='blake2b'):
+        if mode not in verify_modes:
+            raise ValueError('Unknown verify mode %s' % mode)
+        new_hasher(algorithm)
+        self.destdir = destdir
+        self.mode = mode
+        self.algorithm = algorithm
+        self.sidecar_path = os.path.join(destdir, '%s.%s' % (checksum_name, algorithm))
+        self.checksums = self.read_sidecar(self.sidecar_path)
+        self.sidecar = open(self.sidecar_path, 'a')
+        self.lock = threading.Lock()
+        self.streamers = copybackend.StreamHashers()
+        self.verified = 0
+        self.failures = []
+
+    def copy(self, filepath, destination, throttle=None):
+        """Copy the data of a file, hash it on the way and verify the destination.
+        Input:
+            filepath    : string - path of the source file.
+            destination : string - path of the destination file.
+            throttle    : callable - called with the number of bytes copied after each chunk.
+        Output:
+            returns     : string - name of the copy method used
+        Raises:
+            VerifyError if the destination does not match the source"""
+        hasher = new_hasher(self.algorithm)
+        method = copybackend.copy_data_hashed(filepath, destination, hasher, throttle, self.streamers)
+        digest = hasher.hexdigest()
+        if self.mode == 'full':
+            matched = hash_file(destination, self.algorithm, drop_cache=True) == digest
+        else:
+            matched = compare_samples(filepath, destination, os.path.getsize(filepath))
+        relpath = os.path.relpath(destination, self.destdir)
+        with self.lock:
+            if not matched:
+                self.failures.append(filepath)
+                self.checksums.pop(relpath, None)
+                raise VerifyError('%s does not match %s' % (destination, filepath))
+            self.verified += 1
+            self.checksums.pop(relpath, None)
+            self.checksums[relpath] = digest
+            self.sidecar.write('%s  %s\n' % (digest, relpath))
+        return method
+
+    @staticmethod
+    def read_sidecar(path):
+        """Read the digests written to a sidecar by the earlier jobs.
+        Input:
+            path    : string - the sidecar file.
+        Output:
+            returns : OrderedDict - relative path to digest, the last line of a path wins"""
+        checksums = OrderedDict()
+        try:
+            with open(path) as handle:
+                for line in handle:
+                    digest, sep, relpath = line.rstrip('\n').partition('  ')
+                    if sep:
+                        checksums.pop(relpath, None)
+                        checksums[relpath] = digest
+        except (IOError, OSError):
+            pass
+        return checksums
+
+    def close(self):
+        """Rewrite the sidecar file with one line per file and stop the hashing threads, once the copies are done.
+        Input:
+            None
+        Output:
+            None"""
+        self.streamers.close()
+        with self.lock:
+            self.sidecar.close()
+            temp_path = self.sidecar_path + '.tmp'
+            with open(temp_path, 'w') as handle:
+                for relpath, digest in self.checksums.items():
+                    handle.write('%s  %s\n' % (digest, relpath))
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(temp_path, self.sidecar_path)
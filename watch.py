@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import errno
+import heapq
+import ctypes
+import select
+import struct
+import logging
+from collections import OrderedDict
+
+from devices import device_class
+
+log = logging.getLogger(__name__)
+
+settle_seconds = 2.0
+poll_interval = 10.0
+wakeup_interval = 1.0
+max_pending_changes = 100000
+sync_batch_size = 1000
+read_size = 64 * 1024
+
+# inotify values, from linux/inotify.h
+IN_CREATE = 0x00000100
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+watch_mask = IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+event_header = struct.Struct('iIII')
+
+
+class WatchError(Exception):
+    """Raised when the sources can not be watched with inotify, they are then polled."""
+    pass
+
+
+def _is_under(path, directory):
+    return directory is not None and (path == directory or path.startswith(os.path.join(directory, '')))
+
+
+def changed_files(roots, since, exclude=None, filters=None):
+    """Generator walking the roots and yielding the files changed since a time.
+    A file counts as changed when its modified or its status change time is later, the status change time catches
+    the files moved into the tree with an older modified time.
+    Input:
+        roots   : list - absolute paths of the watched files and directories.
+        since   : float - time since the epoch, 0 for every file.
+        exclude : string - a directory that is not walked, the destination when it lies inside a source.
+        filters : FileFilter - the excluded directories are not walked and the excluded files are not reported.
+    Output:
+        yields  : tuple - (path, time of the change)"""
+    dirs = []
+    for root in roots:
+        if os.path.isdir(root):
+            dirs.append(root)
+            continue
+        if filters is not None and filters.excludes_file(root, os.path.basename(root)):
+            continue
+        try:
+            st = os.stat(root)
+        except OSError:
+            continue
+        changed = max(st.st_mtime, st.st_ctime)
+        if changed >= since:
+            yield root, changed
+    while dirs:
+        current = dirs.pop()
+        if _is_under(current, exclude):
+            continue
+        try:
+            entries = list(os.scandir(current))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink():  # Same as the scan, symlinked dirs are not followed
+                        if filters is None or not filters.excludes_dir(entry.path, entry.name):
+                            dirs.append(entry.path)
+                    continue
+                if filters is not None and filters.excludes_file(entry.path, entry.name):
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            changed = max(st.st_mtime, st.st_ctime)
+            if changed >= since:
+                yield entry.path, changed
+
+
+class ChangeSet():
+    """Coalesce the changes reported by a watcher.
+    A file is only synced once it has had no change for the settle time, so that a file written in several goes or
+    reported by several events is copied once, when complete. A change to a pending file pushes its turn back.
+    Files deferred to a later time, such as the files younger than the min_age filter, wait aside until then so that
+    they do not hold back the changes behind them."""
+    def __init__(self, settle=settle_seconds):
+        self.settle = settle
+        # path -> time the file is due, in the order of the last change
+        self.pending = OrderedDict()
+        # (time the file is due, path) heap of the deferred files
+        self.deferred = []
+
+    def __len__(self):
+        return len(self.pending) + len(self.deferred)
+
+    def add(self, path, changed):
+        """Record a change.
+        Input:
+            path    : string - the changed file.
+            changed : float - time of the change.
+        Output:
+            None"""
+        self.pending.pop(path, None)
+        self.pending[path] = changed + self.settle
+
+    def defer(self, path, due):
+        """Sync a file at a later time, out of the order of the changes.
+        Input:
+            path    : string - the file.
+            due     : float - time the file is due.
+        Output:
+            None"""
+        heapq.heappush(self.deferred, (due, path))
+
+    def next_due(self):
+        """Return the time the next file is due, None if no file is pending."""
+        due = None
+        for due in self.pending.values():
+            break
+        if self.deferred and (due is None or self.deferred[0][0] < due):
+            due = self.deferred[0][0]
+        return due
+
+    def due(self, now=None, limit=sync_batch_size):
+        """Remove and return the files that are due.
+        Input:
+            now     : float - time since the epoch, the current time if omitted.
+            limit   : integer - the most files returned.
+        Output:
+            returns : list - paths of the files to sync, in the order of their changes"""
+        if now is None:
+            now = time.time()
+        while self.deferred and self.deferred[0][0] <= now:
+            due, path = heapq.heappop(self.deferred)
+            if path not in self.pending:
+                self.pending[path] = due
+        paths = []
+        while self.pending and len(paths) < limit:
+            path, due = next(iter(self.pending.items()))
+            if due > now:
+                break
+            del self.pending[path]
+            paths.append(path)
+        return paths
+
+
+class PollingWatcher():
+    """Find the changes by walking the sources at an interval.
+    Only the time of the last walk is kept, not the state of every file, so the memory used does not grow with the
+    size of the tree. Used where inotify is not available and for network shares, where inotify does not see the
+    changes made by other machines."""
+    kind = 'polling'
+
+    def __init__(self, roots, since, interval=poll_interval, exclude=None, filters=None):
+        self.roots = roots
+        self.since = since
+        self.interval = interval
+        self.exclude = exclude
+        self.filters = filters
+        # The first walk catches up on the changes made since the copy started
+        self.next_poll = 0
+
+    def rescan(self, since):
+        """Walk the sources again on the next call to changes.
+        Input:
+            since   : float - report the files changed since this time.
+        Output:
+            None"""
+        self.since = min(self.since, since)
+        self.next_poll = 0
+
+    def changes(self, timeout):
+        """Generator waiting up to timeout seconds for the next walk and yielding the changes it finds.
+        Input:
+            timeout : float - seconds to wait.
+        Output:
+            yields  : tuple - (path, time of the change)"""
+        delay = self.next_poll - time.time()
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+            return
+        started = time.time()
+        for change in changed_files(self.roots, self.since, self.exclude, self.filters):
+            yield change
+        self.since = started
+        self.next_poll = started + self.interval
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher():
+    """Find the changes with inotify, Linux only.
+    Every directory of the sources has a watch and a new directory is watched as soon as it appears. A file is
+    reported once it is closed after writing or moved in, files still open for writing are not. When the kernel
+    drops events the sources are walked for the files changed since the last events read."""
+    kind = 'inotify'
+
+    def __init__(self, roots, since, exclude=None, filters=None):
+        if not sys.platform.startswith('linux'):
+            raise WatchError('inotify is only available on Linux')
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise WatchError('inotify is not supported by the C library')
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise WatchError('Unable to start inotify: %s' % os.strerror(ctypes.get_errno()))
+        self.roots = roots
+        self.exclude = exclude
+        self.filters = filters
+        # watch descriptor -> (directory, names of the files watched in it, None for all the files)
+        self.watches = {}
+        self.last_read = time.time()
+        # The first call to changes catches up on the changes made since the copy started
+        self.rescan_since = since
+        try:
+            singles = {}
+            for root in roots:
+                if os.path.isdir(root):
+                    self.watch_tree(root)
+                else:
+                    directory, name = os.path.split(root)
+                    singles.setdefault(directory, set()).add(name)
+            for directory, names in singles.items():
+                self.add_watch(directory, names)
+        except Exception:
+            os.close(self.fd)
+            raise
+
+    def add_watch(self, directory, names=None):
+        """Watch a directory.
+        Input:
+            directory   : string - the directory.
+            names       : set - only report these files, None for all the files.
+        Output:
+            returns     : bool - False if the directory can not be watched
+        Raises:
+            WatchError when the limit of watches is reached"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), watch_mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise WatchError('The inotify watch limit is reached, see fs.inotify.max_user_watches')
+            log.debug('Unable to watch %s: %s', directory, os.strerror(error))
+            return False
+        self.watches[wd] = (directory, names)
+        return True
+
+    def watch_tree(self, directory):
+        """Watch a directory and its subdirectories, each is watched before it is listed so no new entry is missed.
+        Input:
+            directory   : string - the top directory.
+        Output:
+            None"""
+        dirs = [directory]
+        while dirs:
+            current = dirs.pop()
+            if _is_under(current, self.exclude) or not self.add_watch(current):
+                continue
+            try:
+                for entry in os.scandir(current):
+                    if entry.is_dir(follow_symlinks=False) and \
+                            (self.filters is None or not self.filters.excludes_dir(entry.path, entry.name)):
+                        dirs.append(entry.path)
+            except OSError:
+                continue
+
+    def unwatch_tree(self, directory):
+        """Stop watching a directory moved away and its subdirectories.
+        Input:
+            directory   : string - the former path of the directory.
+        Output:
+            None"""
+        for wd, (watched, names) in list(self.watches.items()):
+            if names is None and _is_under(watched, directory):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def rescan(self, since):
+        """Walk the sources for the files changed since a time on the next call to changes.
+        Input:
+            since   : float - time since the epoch.
+        Output:
+            None"""
+        if self.rescan_since is None or since < self.rescan_since:
+            self.rescan_since = since
+
+    def read_events(self):
+        """Read the queued events.
+        Output:
+            returns : list - (watch descriptor, mask, name) tuples"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, read_size)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = event_header.unpack_from(data, offset)
+                offset += event_header.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def changes(self, timeout):
+        """Generator waiting up to timeout seconds for events and yielding the changed files.
+        Input:
+            timeout : float - seconds to wait.
+        Output:
+            yields  : tuple - (path, time of the change)
+        Raises:
+            WatchError when a new directory can not be watched as the limit of watches is reached"""
+        if self.rescan_since is not None:
+            since, self.rescan_since = self.rescan_since, None
+            for change in changed_files(self.roots, since, self.exclude, self.filters):
+                yield change
+            return
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return
+        previous_read = self.last_read
+        now = self.last_read = time.time()
+        for wd, mask, name in self.read_events():
+            if mask & IN_Q_OVERFLOW:
+                log.warning('inotify dropped events, walking the sources for the changes')
+                self.rescan(previous_read - settle_seconds)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            watched = self.watches.get(wd)
+            if watched is None or not name:
+                continue
+            directory, names = watched
+            if names is not None and name not in names:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if names is not None or _is_under(path, self.exclude) or \
+                        (self.filters is not None and self.filters.excludes_dir(path, name)):
+                    continue
+                if mask & IN_MOVED_FROM:
+                    self.unwatch_tree(path)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may have landed before the watch was added, every file of the new directory is synced
+                    self.watch_tree(path)
+                    for change in changed_files([path], 0, self.exclude, self.filters):
+                        yield change
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                if self.filters is None or not self.filters.excludes_file(path, name):
+                    yield path, now
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_watcher(roots, since, interval=None, exclude=None, filters=None):
+    """Return the watcher of the sources, inotify unless it is not available, a source is on a network share or an
+    interval is given.
+    Input:
+        roots       : list - absolute paths of the watched files and directories.
+        since       : float - the changes made since this time are reported first.
+        interval    : float - seconds between walks, the sources are then polled.
+        exclude     : string - a directory that is not watched, the destination when it lies inside a source.
+        filters     : FileFilter - the excluded directories are not watched and the excluded files not reported.
+    Output:
+        returns     : InotifyWatcher or PollingWatcher"""
+    if interval is None:
+        try:
+            network = any(device_class(os.stat(root).st_dev) == 'network' for root in roots)
+        except OSError:
+            network = False
+        if not network:
+            try:
+                return InotifyWatcher(roots, since, exclude, filters)
+            except WatchError as err:
+                log.warning('%s, polling the sources instead', err)
+    return PollingWatcher(roots, since, interval or poll_interval, exclude, filters)